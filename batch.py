@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pipeline import create_client, default_output_filename, generate_report_async
+from render_pool import RenderPool
+
+DEFAULT_CONCURRENCY = 8
+MANIFEST_NAME = "manifest.json"
+
+
+def read_queries(path):
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                queries.append(line)
+    return queries
+
+
+def _new_entry(index, query):
+    return {
+        "index": index,
+        "query": query,
+        "output": None,
+        "status": "pending",
+        "error": None,
+    }
+
+
+def _output_file(output_dir, entry):
+    return os.path.join(output_dir, f"{entry['index']:03d}_{default_output_filename(entry['query'])}")
+
+
+async def _run_one(entry, output_dir, client, semaphore, report_options):
+    query = entry["query"]
+    output_file = _output_file(output_dir, entry)
+
+    async with semaphore:
+        entry["started_at"] = datetime.now(timezone.utc).isoformat()
+        start = time.perf_counter()
+        try:
+            output_doc = await generate_report_async(query, output_file, client=client, **report_options)
+            if output_doc is None:
+                entry["status"] = "failed"
+                entry["error"] = "Report JSON could not be parsed"
+            else:
+                entry["output"] = output_doc
+                entry["status"] = "ok"
+        except Exception as e:
+            entry["status"] = "failed"
+            entry["error"] = f"{type(e).__name__}: {e}"
+        entry["seconds"] = round(time.perf_counter() - start, 3)
+
+    print(f"[{entry['status']}] {query} ({entry['seconds']}s)")
+    return entry
+
+
+def write_manifest(output_dir, entries, concurrency, seconds, render_workers=0):
+    manifest = {
+        "concurrency": concurrency,
+        "render_workers": render_workers,
+        "total": len(entries),
+        "succeeded": sum(1 for entry in entries if entry["status"] == "ok"),
+        "failed": sum(1 for entry in entries if entry["status"] != "ok"),
+        "seconds": round(seconds, 3),
+        "reports": entries,
+    }
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Batch finished: {manifest['succeeded']}/{manifest['total']} reports in {manifest['seconds']}s")
+    print(f"Manifest written: {manifest_path}")
+    return manifest
+
+
+async def run_batch_async(queries, output_dir="reports", concurrency=DEFAULT_CONCURRENCY, client=None,
+                          render_workers=0, render_queue=None, **report_options):
+    if client is None:
+        client = create_client()
+    os.makedirs(output_dir, exist_ok=True)
+
+    render_pool = None
+    if render_workers:
+        render_pool = RenderPool(
+            render_workers, render_queue, report_options.get("backend", "docx"), report_options.get("template")
+        )
+        report_options = {**report_options, "render_pool": render_pool}
+
+    entries = [_new_entry(index, query) for index, query in enumerate(queries, start=1)]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    started_at = time.time()
+    start = time.perf_counter()
+    interrupted = True
+    try:
+        await asyncio.gather(*[
+            _run_one(entry, output_dir, client, semaphore, report_options)
+            for entry in entries
+        ])
+        interrupted = False
+    finally:
+        if render_pool is not None:
+            # Renders already running finish so their documents are kept.
+            render_pool.shutdown(cancel_pending=interrupted)
+        for entry in entries:
+            if entry["status"] != "pending":
+                continue
+            # A render that was already running when the batch was cancelled
+            # still completes; documents only appear once fully written.
+            output_file = _output_file(output_dir, entry)
+            if os.path.exists(output_file) and os.path.getmtime(output_file) >= started_at:
+                entry["status"] = "ok"
+                entry["output"] = output_file
+            else:
+                entry["status"] = "cancelled"
+        manifest = write_manifest(output_dir, entries, concurrency, time.perf_counter() - start, render_workers)
+    return manifest
+
+
+def run_batch(queries_file, output_dir="reports", concurrency=DEFAULT_CONCURRENCY, client=None,
+              render_workers=0, render_queue=None, **report_options):
+    queries = read_queries(queries_file)
+    return asyncio.run(run_batch_async(
+        queries, output_dir, concurrency, client, render_workers, render_queue, **report_options
+    ))
@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from fake_client import FakeGeminiClient, sample_report_blocks
+from pipeline import generate_report
+from batch import run_batch_async
+from render_pool import RenderPool
+from scheduler import CallScheduler, DEFAULT_MAX_RETRIES
+from context_cache import ContextCache
+from routing import ModelRouter, load_routing
+from map_reduce import ANALYSIS_MODES
+from docx_converter import json_to_docx
+from report_ir import compile_report
+from renderers import render_ir, BACKENDS, FORMATS, FORMAT_EXTENSIONS
+
+DEFAULT_RENDER_SIZES = (10, 100, 1000, 10000, 50000)
+# Importing main.py must stay under this many milliseconds, and must not
+# import these modules; they belong to the code paths that call the model or
+# write a Word document.
+DEFAULT_STARTUP_BUDGET_MS = 250
+HEAVY_MODULES = ("google.genai", "httpx", "docx", "lxml")
+STARTUP_COMMANDS = {
+    "interpreter": "pass",
+    "import main": (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import main\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps({{'seconds': seconds, 'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))"
+    ),
+    "main.py --help": None,
+}
+BENCH_QUERIES = [
+    "What are the key players in the Esports Industry?",
+    "Who are the key players in the cloud computing industry?",
+    "What are the trends in the electric vehicle market?",
+    "Who leads the plant-based food market?",
+]
+
+
+def _queries(count):
+    return [f"{BENCH_QUERIES[index % len(BENCH_QUERIES)]} #{index}" for index in range(count)]
+
+
+def _client(args, seed=0):
+    return FakeGeminiClient(
+        latency=args.latency,
+        jitter=args.jitter,
+        chunk_size=args.chunk_size,
+        chunk_delay=args.chunk_delay,
+        failure_rate=args.failure_rate,
+        report_blocks=args.report_blocks,
+        research_entries=args.research_entries,
+        token_latency=args.token_latency,
+        quota_rpm=args.quota_rpm,
+        model_latency={model: float(factor) for model, factor in args.model_latency or []},
+        seed=seed,
+    )
+
+
+def _router(args):
+    if not args.routing:
+        return None
+    return ModelRouter(None if args.routing == "default" else load_routing(args.routing), min_samples=3)
+
+
+def _context_cache(args):
+    # The fake client caches any size, so every stage instruction is cached.
+    return ContextCache(min_tokens=0) if args.context_cache else None
+
+
+def bench_sequential(args, output_dir, scheduler, router):
+    client = _client(args)
+    context_cache = _context_cache(args)
+    succeeded = 0
+    start = time.perf_counter()
+    for index, query in enumerate(_queries(args.reports)):
+        try:
+            if generate_report(query, os.path.join(output_dir, f"seq_{index}.docx"), client=client,
+                               stream=args.stream, analysis_mode=args.analysis_mode, fan_out=args.fan_out,
+                               scheduler=scheduler, context_cache=context_cache, router=router):
+                succeeded += 1
+        except Exception:
+            pass
+    return succeeded, time.perf_counter() - start
+
+
+def bench_batch(args, output_dir, scheduler, router):
+    client = _client(args)
+    start = time.perf_counter()
+    manifest = asyncio.run(run_batch_async(
+        _queries(args.reports), os.path.join(output_dir, "batch"), args.concurrency, client,
+        args.render_workers, stream=args.stream, analysis_mode=args.analysis_mode, fan_out=args.fan_out,
+        scheduler=scheduler, context_cache=_context_cache(args), router=router
+    ))
+    return manifest["succeeded"], time.perf_counter() - start
+
+
+def bench_concurrent(args, output_dir, scheduler, router):
+    client = _client(args)
+    render_pool = RenderPool(args.render_workers) if args.render_workers else None
+    context_cache = _context_cache(args)
+
+    def run(index, query):
+        try:
+            return generate_report(query, os.path.join(output_dir, f"thread_{index}.docx"), client=client,
+                                   stream=args.stream, render_pool=render_pool, analysis_mode=args.analysis_mode,
+                                   fan_out=args.fan_out, scheduler=scheduler, context_cache=context_cache,
+                                   router=router)
+        except Exception:
+            return None
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(run, range(args.reports), _queries(args.reports)))
+    finally:
+        if render_pool is not None:
+            render_pool.shutdown()
+    return sum(1 for result in results if result), time.perf_counter() - start
+
+
+PIPELINE_MODES = {
+    "sequential": bench_sequential,
+    "batch": bench_batch,
+    "concurrent": bench_concurrent,
+}
+
+
+def bench_pipelines(args):
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for mode in args.modes:
+            scheduler = CallScheduler(args.rpm, args.tpm, args.max_retries, base_delay=args.retry_delay)
+            router = _router(args)
+            with contextlib.redirect_stdout(io.StringIO()):
+                succeeded, seconds = PIPELINE_MODES[mode](args, output_dir, scheduler, router)
+            results.append({
+                "benchmark": "pipeline",
+                "mode": mode,
+                "reports": args.reports,
+                "succeeded": succeeded,
+                "seconds": seconds,
+                "reports_per_second": args.reports / seconds if seconds else 0.0,
+                "scheduler": dict(scheduler.stats),
+            })
+            print(f"{mode:<12}{args.reports:>8}{succeeded:>11}{seconds:>10.2f}{results[-1]['reports_per_second']:>14.2f}")
+            if router is not None:
+                print(router.format_stats())
+    return results
+
+
+def bench_render(sizes, backends):
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for backend in backends:
+            for size in sizes:
+                blocks = sample_report_blocks(size)
+                start = time.perf_counter()
+                json_to_docx(blocks, os.path.join(output_dir, f"render_{backend}_{size}.docx"), backend)
+                seconds = time.perf_counter() - start
+                results.append({
+                    "benchmark": "render",
+                    "backend": backend,
+                    "blocks": size,
+                    "seconds": seconds,
+                    "blocks_per_second": size / seconds if seconds else 0.0,
+                })
+                print(f"{backend:<9}{size:>8}{seconds:>10.3f}{results[-1]['blocks_per_second']:>14.0f}")
+    return results
+
+
+def bench_formats(sizes, formats):
+    # One compile per report, then every format from the same nodes.
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for size in sizes:
+            blocks = sample_report_blocks(size)
+            start = time.perf_counter()
+            ir = compile_report(blocks)
+            compile_seconds = time.perf_counter() - start
+            timings = []
+            for fmt in formats:
+                start = time.perf_counter()
+                render_ir(ir, os.path.join(output_dir, f"render_{size}{FORMAT_EXTENSIONS[fmt]}"), fmt)
+                seconds = time.perf_counter() - start
+                timings.append(seconds)
+                results.append({
+                    "benchmark": "formats",
+                    "format": fmt,
+                    "blocks": size,
+                    "compile_seconds": compile_seconds,
+                    "seconds": seconds,
+                    "blocks_per_second": size / seconds if seconds else 0.0,
+                })
+            print(f"{size:>8}{compile_seconds:>10.3f}" + "".join(f"{seconds:>10.3f}" for seconds in timings))
+    return results
+
+
+def bench_startup(runs, budget_ms):
+    # Fresh interpreters, so nothing is already imported. Returns the
+    # results and whether importing main.py stayed within the budget.
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    within_budget = True
+    for name, code in STARTUP_COMMANDS.items():
+        command = [sys.executable, "main.py", "--help"] if code is None else [sys.executable, "-c", code]
+        wall, imported, heavy = [], [], set()
+        for _ in range(max(1, runs)):
+            start = time.perf_counter()
+            completed = subprocess.run(command, cwd=here, capture_output=True, text=True, check=True)
+            wall.append(time.perf_counter() - start)
+            if name == "import main":
+                probe = json.loads(completed.stdout.strip().splitlines()[-1])
+                imported.append(probe["seconds"])
+                heavy.update(probe["heavy"])
+        result = {"benchmark": "startup", "command": name, "runs": len(wall), "seconds": statistics.median(wall)}
+        line = f"{name:<16}{result['seconds'] * 1000:>10.0f}"
+        if imported:
+            result["import_seconds"] = statistics.median(imported)
+            result["heavy_modules"] = sorted(heavy)
+            over = result["import_seconds"] * 1000 > budget_ms
+            within_budget = within_budget and not over and not heavy
+            line += f"{result['import_seconds'] * 1000:>10.0f}  {'over budget' if over else 'ok'}"
+            if heavy:
+                line += f", imports {', '.join(sorted(heavy))}"
+        print(line)
+        results.append(result)
+    return results, within_budget
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks with a fake Gemini client')
+    parser.add_argument('--reports', type=int, default=20, help='Reports per pipeline mode')
+    parser.add_argument('--modes', nargs='+', choices=sorted(PIPELINE_MODES), default=list(PIPELINE_MODES),
+                        help='Pipeline modes to run')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrency for batch and concurrent modes')
+    parser.add_argument('--latency', type=float, default=0.2, help='Fake latency per call in seconds')
+    parser.add_argument('--jitter', type=float, default=0.25, help='Latency jitter as a fraction of the latency')
+    parser.add_argument('--chunk-size', type=int, default=256, help='Characters per streamed chunk')
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help='Delay between streamed chunks in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Probability that a fake call fails')
+    parser.add_argument('--token-latency', type=float, default=0.0,
+                        help='Extra fake latency in seconds per 1,000 prompt tokens')
+    parser.add_argument('--quota-rpm', type=int, help='Fake per-minute request quota; calls beyond it get a 429')
+    parser.add_argument('--rpm', type=int, help='Scheduler limit on requests per minute')
+    parser.add_argument('--tpm', type=int, help='Scheduler limit on estimated prompt tokens per minute')
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_MAX_RETRIES,
+                        help='Retries per call on rate limits and transient errors')
+    parser.add_argument('--retry-delay', type=float, default=0.1, help='Base backoff delay in seconds')
+    parser.add_argument('--context-cache', action='store_true',
+                        help='Send stage instructions through the context cache instead of inline')
+    parser.add_argument('--routing', type=str, metavar='FILE',
+                        help='Route stages with this routing file, or "default" for the built-in policy')
+    parser.add_argument('--model-latency', nargs=2, action='append', metavar=('MODEL', 'FACTOR'), type=str,
+                        help='Scale the fake latency of one model, e.g. --model-latency gemini-2.0-flash-lite 0.5')
+    parser.add_argument('--report-blocks', type=int, default=40, help='Blocks in the fake report response')
+    parser.add_argument('--research-entries', type=int, default=20, help='Entries in the fake research response')
+    parser.add_argument('--fan-out', action='store_true', help='Run one research search per category')
+    parser.add_argument('--analysis-mode', choices=ANALYSIS_MODES, default='auto', help='Analysis mode for the pipeline')
+    parser.add_argument('--stream', action='store_true', help='Stream the report stage')
+    parser.add_argument('--render-workers', type=int, default=0,
+                        help='Render in this many worker processes in batch and concurrent modes (0 renders inline)')
+    parser.add_argument('--render-sizes', type=int, nargs='*', default=list(DEFAULT_RENDER_SIZES),
+                        help='Report sizes in blocks for the json_to_docx benchmark')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS),
+                        help='Rendering backends to benchmark')
+    parser.add_argument('--formats', nargs='*', choices=FORMATS, default=list(FORMATS),
+                        help='Output formats to render from one compiled report')
+    parser.add_argument('--skip-pipeline', action='store_true', help='Only run the rendering benchmark')
+    parser.add_argument('--skip-render', action='store_true', help='Only run the pipeline benchmark')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Fresh interpreters per startup measurement')
+    parser.add_argument('--startup-budget', type=float, default=DEFAULT_STARTUP_BUDGET_MS, metavar='MS',
+                        help='Fail when importing main.py takes longer, or imports google.genai, httpx or '
+                             'python-docx')
+    parser.add_argument('--skip-startup', action='store_true', help='Do not run the startup benchmark')
+    parser.add_argument('--json', type=str, metavar='FILE', help='Append results to FILE as JSON lines')
+    args = parser.parse_args()
+
+    results = []
+    within_budget = True
+    if not args.skip_startup:
+        print(f"Startup (median of {args.startup_runs} runs, import budget {args.startup_budget:g} ms)")
+        print(f"{'command':<16}{'wall ms':>10}{'import':>10}")
+        startup, within_budget = bench_startup(args.startup_runs, args.startup_budget)
+        results.extend(startup)
+    if not args.skip_pipeline:
+        render = f", {args.render_workers} render workers" if args.render_workers else ""
+        print(f"Pipeline throughput ({args.latency}s latency per call{render})")
+        print(f"{'mode':<12}{'reports':>8}{'succeeded':>11}{'seconds':>10}{'reports/s':>14}")
+        results.extend(bench_pipelines(args))
+    if not args.skip_render and args.render_sizes:
+        print("json_to_docx rendering")
+        print(f"{'backend':<9}{'blocks':>8}{'seconds':>10}{'blocks/s':>14}")
+        results.extend(bench_render(args.render_sizes, args.backends))
+    if not args.skip_render and args.render_sizes and args.formats:
+        print("Compiled report rendering (seconds)")
+        print(f"{'blocks':>8}{'compile':>10}" + "".join(f"{fmt:>10}" for fmt in args.formats))
+        results.extend(bench_formats(args.render_sizes, args.formats))
+
+    if args.json:
+        run_info = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        }
+        with open(args.json, 'a', encoding='utf-8') as f:
+            for result in results:
+                f.write(json.dumps({**run_info, **result}) + "\n")
+        print(f"Results appended to {args.json}")
+    if not within_budget:
+        print("Startup budget exceeded")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+import asyncio
+import gzip
+import hashlib
+import itertools
+import json
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import prompts
+
+CASSETTE_VERSION = 1
+USAGE_FIELDS = (
+    "prompt_token_count",
+    "candidates_token_count",
+    "total_token_count",
+    "cached_content_token_count",
+    "thoughts_token_count",
+)
+# Stage labels for the recorded calls, from the system instruction they use.
+_PROMPT_STAGES = {
+    text: name[:-len("_PROMPT")].lower()
+    for name, text in vars(prompts).items()
+    if name.endswith("_PROMPT") and isinstance(text, str)
+}
+
+
+class CassetteMissError(LookupError):
+    pass
+
+
+def _digest(value):
+    text = value if isinstance(value, str) else json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _config_dict(config):
+    if config is None:
+        return {}
+    if hasattr(config, "model_dump"):
+        return config.model_dump(exclude_none=True, mode="json")
+    return {key: value for key, value in vars(config).items() if value is not None}
+
+
+def describe_request(contents, config, systems):
+    # Returns the request as stored in a cassette plus two match keys: the
+    # exact key covers the contents, the loose key only the kind of call
+    # (instruction, search, JSON schema). Model and generation settings are
+    # left out of both, so a replay still matches when routing picks another
+    # model. A cached instruction counts as the text it stands for.
+    config = _config_dict(config)
+    system = config.pop("system_instruction", None)
+    cached_content = config.pop("cached_content", None)
+    if cached_content:
+        system = systems.get(cached_content, cached_content)
+    system = system if system is None or isinstance(system, str) else json.dumps(system, default=str)
+    system_id = _digest(system) if system else None
+    kind = [system_id, "tools" in config, config.get("response_mime_type"), config.get("response_schema")]
+    if "tools" in config:
+        stage = "research"
+    else:
+        stage = _PROMPT_STAGES.get(system, "repair" if system is None else "other")
+    return {
+        "stage": stage,
+        "system": system,
+        "system_id": system_id,
+        "contents": contents,
+        "config": config,
+        "key": _digest([contents, kind]),
+        "match": _digest(kind),
+    }
+
+
+def _usage_dict(usage_metadata):
+    if usage_metadata is None:
+        return None
+    usage = {field: getattr(usage_metadata, field, None) for field in USAGE_FIELDS}
+    return {field: value for field, value in usage.items() if value is not None}
+
+
+def _error_dict(error):
+    from google.genai import errors
+    if isinstance(error, errors.APIError):
+        return {"type": "api", "code": error.code, "details": error.details}
+    return {"type": type(error).__name__, "message": str(error)}
+
+
+def _replayed_error(error):
+    if error["type"] == "api":
+        from google.genai import errors
+        code = error["code"]
+        if 400 <= code < 500:
+            return errors.ClientError(code, error["details"])
+        if code >= 500:
+            return errors.ServerError(code, error["details"])
+        return errors.APIError(code, error["details"])
+    # Transport errors come back as the built-in types the scheduler retries.
+    message = f"{error['type']}: {error['message']}"
+    if "Timeout" in error["type"]:
+        return TimeoutError(message)
+    if error["type"].endswith("Error") and any(word in error["type"] for word in ("Connect", "Read", "Write", "Protocol")):
+        return ConnectionError(message)
+    return RuntimeError(message)
+
+
+class CassetteWriter:
+    # Appends interactions to a gzip-compressed JSON-lines file as they
+    # finish. Each line is flushed, so a run that crashes still leaves a
+    # readable cassette. Instructions are stored once and referred to by id.
+
+    def __init__(self, path, header=None):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._sequence = itertools.count(1)
+        self._prompts = set()
+        self._started = time.monotonic()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._write({
+            "cassette": CASSETTE_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(),
+            **(header or {}),
+        })
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+        self._file.flush()
+
+    def add(self, request, model, stream, started, chunks, usage, error=None):
+        with self._lock:
+            if self._file is None:
+                return
+            if request["system"] and request["system_id"] not in self._prompts:
+                self._prompts.add(request["system_id"])
+                self._write({"prompt": request["system_id"], "text": request["system"]})
+            record = {
+                "seq": next(self._sequence),
+                "stage": request["stage"],
+                "model": model,
+                "stream": stream,
+                "start": round(started - self._started, 3),
+                "seconds": round(time.monotonic() - started, 3),
+                "key": request["key"],
+                "match": request["match"],
+                "system": request["system_id"],
+                "contents": request["contents"],
+                "config": request["config"],
+                "chunks": chunks,
+                "usage": usage,
+            }
+            if error is not None:
+                record["error"] = _error_dict(error)
+            self._write(record)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_cassette(path):
+    # Returns (header, interactions). A cassette cut short by a crash is
+    # read up to its last complete line.
+    lines = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                lines.append(line)
+        except (EOFError, zlib.error, OSError) as e:
+            print(f"Cassette {path} is truncated; replaying what was recorded ({e})")
+    header, interactions, texts = None, [], {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if header is None:
+            if record.get("cassette") != CASSETTE_VERSION:
+                raise ValueError(f"{path} is not a version {CASSETTE_VERSION} cassette")
+            header = record
+        elif "prompt" in record:
+            texts[record["prompt"]] = record["text"]
+        else:
+            record["system_text"] = texts.get(record.get("system"))
+            interactions.append(record)
+    if header is None:
+        raise ValueError(f"{path} is empty")
+    return header, interactions
+
+
+class _Recording:
+    def __init__(self, owner, model, contents, config, stream):
+        self.owner = owner
+        self.model = model
+        self.stream = stream
+        self.request = describe_request(contents, config, owner._systems)
+        self.started = time.monotonic()
+        self.chunks = []
+        self.usage = None
+
+    def add(self, response):
+        text = getattr(response, "text", None)
+        if text:
+            self.chunks.append([round(time.monotonic() - self.started, 3), text])
+        usage = _usage_dict(getattr(response, "usage_metadata", None))
+        if usage:
+            self.usage = usage
+
+    def finish(self, error=None):
+        self.owner.cassette.add(self.request, self.model, self.stream, self.started, self.chunks, self.usage, error)
+
+
+class RecordingClient:
+    # Wraps a genai.Client (or the fake one) and writes every
+    # generate_content call, streamed or not, sync or async, to a cassette:
+    # request, response text with chunk timings, usage metadata and errors.
+
+    def __init__(self, client, cassette):
+        self._client = client
+        self.cassette = cassette
+        self._systems = {}
+        self.models = _RecordingModels(self)
+        self.aio = SimpleNamespace(models=_RecordingAsyncModels(self))
+        self.caches = _RecordingCaches(self)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class _RecordingCaches:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, config=None):
+        cached = self._owner._client.caches.create(model=model, config=config)
+        self._owner._systems[cached.name] = getattr(config, "system_instruction", None)
+        return cached
+
+    def update(self, name, config=None):
+        return self._owner._client.caches.update(name=name, config=config)
+
+    def delete(self, name, config=None):
+        return self._owner._client.caches.delete(name=name, config=config)
+
+
+class _RecordingModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def generate_content(self, model, contents, config=None):
+        recording = _Recording(self._owner, model, contents, config, False)
+        try:
+            response = self._owner._client.models.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            recording.finish(e)
+            raise
+        recording.add(response)
+        recording.finish()
+        return response
+
+    def generate_content_stream(self, model, contents, config=None):
+        recording = _Recording(self._owner, model, contents, config, True)
+        try:
+            for chunk in self._owner._client.models.generate_content_stream(
+                model=model, contents=contents, config=config
+            ):
+                recording.add(chunk)
+                yield chunk
+        except Exception as e:
+            recording.finish(e)
+            raise
+        recording.finish()
+
+
+class _RecordingAsyncModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def generate_content(self, model, contents, config=None):
+        recording = _Recording(self._owner, model, contents, config, False)
+        try:
+            response = await self._owner._client.aio.models.generate_content(
+                model=model, contents=contents, config=config
+            )
+        except Exception as e:
+            recording.finish(e)
+            raise
+        recording.add(response)
+        recording.finish()
+        return response
+
+    async def generate_content_stream(self, model, contents, config=None):
+        recording = _Recording(self._owner, model, contents, config, True)
+        try:
+            stream = await self._owner._client.aio.models.generate_content_stream(
+                model=model, contents=contents, config=config
+            )
+        except Exception as e:
+            recording.finish(e)
+            raise
+        return self._stream(recording, stream)
+
+    async def _stream(self, recording, stream):
+        try:
+            async for chunk in stream:
+                recording.add(chunk)
+                yield chunk
+        except Exception as e:
+            recording.finish(e)
+            raise
+        recording.finish()
+
+
+class ReplayClient:
+    # Stands in for genai.Client and answers every call from a cassette,
+    # without any network access. A request gets the first unused
+    # interaction with the same contents; failing that (e.g. a prompt that
+    # includes today's date), the next unused one of the same kind, in
+    # recorded order. Recorded errors are raised again, so retries and
+    # repairs happen as they did. With timing, each call takes as long as
+    # it did when recorded, chunk by chunk.
+
+    def __init__(self, path, timing=False):
+        self.path = path
+        self.header, self.interactions = load_cassette(path)
+        self.timing = timing
+        self.stats = {"replayed": 0, "by_position": 0, "errors": 0}
+        self._exact = {}
+        self._loose = {}
+        for interaction in self.interactions:
+            self._exact.setdefault(interaction["key"], []).append(interaction)
+            self._loose.setdefault(interaction["match"], []).append(interaction)
+        self._used = set()
+        self._systems = {}
+        self._names = itertools.count(1)
+        self._lock = threading.Lock()
+        self.models = _ReplayModels(self)
+        self.aio = SimpleNamespace(models=_ReplayAsyncModels(self))
+        self.caches = _ReplayCaches(self)
+
+    def _take(self, contents, config):
+        request = describe_request(contents, config, self._systems)
+        with self._lock:
+            for candidates, by_position in ((self._exact.get(request["key"], ()), False),
+                                            (self._loose.get(request["match"], ()), True)):
+                for interaction in candidates:
+                    if interaction["seq"] not in self._used:
+                        self._used.add(interaction["seq"])
+                        self.stats["replayed"] += 1
+                        self.stats["by_position"] += by_position
+                        self.stats["errors"] += "error" in interaction
+                        return interaction
+        raise CassetteMissError(f"{self.path} has no unused {request['stage']} interaction for this request")
+
+    @staticmethod
+    def _response(text, usage):
+        usage = SimpleNamespace(**{**{field: None for field in USAGE_FIELDS}, **usage}) if usage else None
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def _delays(self, interaction):
+        # (seconds to wait, text) per chunk, then the wait before the call
+        # ends.
+        chunks = interaction["chunks"] or []
+        if not self.timing:
+            return [(0.0, text) for _, text in chunks], 0.0
+        delays, elapsed = [], 0.0
+        for offset, text in chunks:
+            delays.append((max(0.0, offset - elapsed), text))
+            elapsed = max(elapsed, offset)
+        return delays, max(0.0, interaction["seconds"] - elapsed)
+
+    def format_stats(self):
+        stats = self.stats
+        return (
+            f"Replay: {stats['replayed']} of {len(self.interactions)} recorded calls replayed, "
+            f"{stats['by_position']} matched by position, {stats['errors']} recorded errors raised"
+        )
+
+
+class _ReplayCaches:
+    # Context caches exist only in memory during a replay.
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, model, config=None):
+        name = f"cachedContents/replay-{next(self._owner._names)}"
+        self._owner._systems[name] = getattr(config, "system_instruction", None)
+        return SimpleNamespace(name=name, model=model)
+
+    def update(self, name, config=None):
+        return SimpleNamespace(name=name)
+
+    def delete(self, name, config=None):
+        self._owner._systems.pop(name, None)
+
+
+class _ReplayModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def generate_content(self, model, contents, config=None):
+        owner = self._owner
+        interaction = owner._take(contents, config)
+        delays, rest = owner._delays(interaction)
+        time.sleep(sum(delay for delay, _ in delays) + rest)
+        if "error" in interaction:
+            raise _replayed_error(interaction["error"])
+        return owner._response("".join(text for _, text in delays), interaction["usage"])
+
+    def generate_content_stream(self, model, contents, config=None):
+        owner = self._owner
+        interaction = owner._take(contents, config)
+        delays, rest = owner._delays(interaction)
+        for index, (delay, text) in enumerate(delays):
+            time.sleep(delay)
+            yield owner._response(text, interaction["usage"] if index == len(delays) - 1 else None)
+        time.sleep(rest)
+        if "error" in interaction:
+            raise _replayed_error(interaction["error"])
+
+
+class _ReplayAsyncModels:
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def generate_content(self, model, contents, config=None):
+        owner = self._owner
+        interaction = owner._take(contents, config)
+        delays, rest = owner._delays(interaction)
+        await asyncio.sleep(sum(delay for delay, _ in delays) + rest)
+        if "error" in interaction:
+            raise _replayed_error(interaction["error"])
+        return owner._response("".join(text for _, text in delays), interaction["usage"])
+
+    async def generate_content_stream(self, model, contents, config=None):
+        owner = self._owner
+        interaction = owner._take(contents, config)
+        if "error" in interaction and not interaction["chunks"]:
+            # Failed before the first chunk, like the API's own stream call.
+            await asyncio.sleep(owner._delays(interaction)[1])
+            raise _replayed_error(interaction["error"])
+        return self._stream(interaction)
+
+    async def _stream(self, interaction):
+        owner = self._owner
+        delays, rest = owner._delays(interaction)
+        for index, (delay, text) in enumerate(delays):
+            await asyncio.sleep(delay)
+            yield owner._response(text, interaction["usage"] if index == len(delays) - 1 else None)
+        await asyncio.sleep(rest)
+        if "error" in interaction:
+            raise _replayed_error(interaction["error"])
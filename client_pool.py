@@ -0,0 +1,183 @@
+import asyncio
+import os
+import threading
+import weakref
+
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE = 10
+# httpx drops idle connections after 5 seconds by default, shorter than a
+# typical stage call, so each report would reconnect between its stages.
+DEFAULT_KEEPALIVE_SECONDS = 120.0
+# Without a timeout a stalled connection blocks its report forever; timed
+# out calls are retried by the scheduler. Grounded search and long reports
+# can take minutes.
+DEFAULT_TIMEOUT_SECONDS = 300.0
+
+
+class _PoolStats:
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.peak_open = 0
+        self._lock = threading.Lock()
+
+    def opened(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def request(self, pool):
+        open_connections = len(_connections(pool))
+        with self._lock:
+            self.requests += 1
+            self.peak_open = max(self.peak_open, open_connections)
+
+
+def _connections(pool):
+    try:
+        return pool.connections
+    except Exception:
+        return []
+
+
+def _count_connections(pool, stats):
+    # Counts the connections the pool opens; every other request reused
+    # one.
+    create_connection = pool.create_connection
+
+    def counting_create_connection(origin):
+        stats.opened()
+        return create_connection(origin)
+
+    pool.create_connection = counting_create_connection
+
+
+def counting_transport(transport, stats):
+    _count_connections(transport._pool, stats)
+    handle_request = transport.handle_request
+
+    def counting_handle_request(request):
+        response = handle_request(request)
+        stats.request(transport._pool)
+        return response
+
+    transport.handle_request = counting_handle_request
+    return transport
+
+
+def counting_async_transport(transport, stats):
+    _count_connections(transport._pool, stats)
+    handle_async_request = transport.handle_async_request
+
+    async def counting_handle_async_request(request):
+        response = await handle_async_request(request)
+        stats.request(transport._pool)
+        return response
+
+    transport.handle_async_request = counting_handle_async_request
+    return transport
+
+
+class ClientPool:
+    # Creates genai clients once and shares them: one for synchronous
+    # callers in any thread, and one per event loop for asyncio callers,
+    # since an async HTTP connection cannot be used from another loop. Every
+    # client keeps its connections alive between calls, so reports after
+    # the first skip connection setup and the TLS handshake.
+
+    def __init__(self, api_key=None, max_connections=DEFAULT_MAX_CONNECTIONS, max_keepalive=DEFAULT_MAX_KEEPALIVE,
+                 keepalive_seconds=DEFAULT_KEEPALIVE_SECONDS, timeout_seconds=DEFAULT_TIMEOUT_SECONDS, base_url=None):
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_seconds = keepalive_seconds
+        self.timeout_seconds = timeout_seconds
+        self.base_url = base_url
+        self.stats = _PoolStats()
+        self._lock = threading.Lock()
+        self._client = None
+        self._loop_clients = weakref.WeakKeyDictionary()
+        self._transports = []
+
+    def configure(self, **settings):
+        # Applies to clients created afterwards; existing ones are closed.
+        self.close()
+        with self._lock:
+            for name, value in settings.items():
+                if not hasattr(self, name) or name == "stats":
+                    raise ValueError(f"Unknown client setting: {name}")
+                if value is not None:
+                    setattr(self, name, value)
+
+    def _create(self):
+        # httpx and google.genai are imported with the first client, not
+        # with this module.
+        import httpx
+        from google import genai
+        from google.genai.types import HttpOptions
+
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=min(self.max_keepalive, self.max_connections),
+            keepalive_expiry=self.keepalive_seconds,
+        )
+        transport = counting_transport(httpx.HTTPTransport(limits=limits), self.stats)
+        async_transport = counting_async_transport(httpx.AsyncHTTPTransport(limits=limits), self.stats)
+        self._transports.append((transport, async_transport))
+        http_options = HttpOptions(
+            # In milliseconds; applied to connecting, each read and each write.
+            timeout=int(self.timeout_seconds * 1000) if self.timeout_seconds else None,
+            client_args={"transport": transport},
+            async_client_args={"transport": async_transport},
+        )
+        if self.base_url:
+            http_options.base_url = self.base_url
+        return genai.Client(api_key=self.api_key or os.getenv("GOOGLE_API_KEY"), http_options=http_options)
+
+    def get(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        with self._lock:
+            if loop is None:
+                if self._client is None:
+                    self._client = self._create()
+                return self._client
+            client = self._loop_clients.get(loop)
+            if client is None:
+                client = self._loop_clients[loop] = self._create()
+            return client
+
+    def open_connections(self):
+        with self._lock:
+            transports = [transport for pair in self._transports for transport in pair]
+        connections = [connection for transport in transports for connection in _connections(transport._pool)]
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return len(connections), idle
+
+    def close(self):
+        # Closes the synchronous connections; asynchronous ones close with
+        # their event loop.
+        with self._lock:
+            transports, self._transports = self._transports, []
+            self._client = None
+            self._loop_clients = weakref.WeakKeyDictionary()
+        for transport, _ in transports:
+            try:
+                transport.close()
+            except Exception:
+                pass
+
+    def format_stats(self):
+        stats = self.stats
+        reused = max(0, stats.requests - stats.connections_opened)
+        share = reused / stats.requests * 100 if stats.requests else 0.0
+        open_connections, idle = self.open_connections()
+        return (
+            f"HTTP: {stats.requests} requests over {stats.connections_opened} connections ({share:.0f}% reused), "
+            f"peak {stats.peak_open} open of {self.max_connections} allowed, {open_connections} open now "
+            f"({idle} idle, kept {self.keepalive_seconds:g}s)"
+        )
+
+
+CLIENTS = ClientPool()
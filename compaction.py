@@ -0,0 +1,167 @@
+import json
+import re
+from research_store import normalize_title, RESEARCH_CATEGORIES
+
+DEFAULT_RESEARCH_BUDGET = 6000
+SIMILARITY_THRESHOLD = 0.8
+MIN_SUMMARY_CHARS = 120
+CHARS_PER_TOKEN = 4
+
+# Entries trimmed first come first; findings with metrics are kept longest.
+TRIM_PRIORITY = {"Partnership": 0, "Insight": 1, "Trend": 2, "Competitor": 3}
+
+_WORDS = re.compile(r"\w+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+_SPACES = re.compile(r"\s+")
+
+
+def estimate_tokens(text):
+    # Gemini averages about four characters per token; good enough for a
+    # budget without a count_tokens round trip.
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def minify_json(data):
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def _clean(value):
+    if isinstance(value, str):
+        return _SPACES.sub(" ", value).strip()
+    if isinstance(value, dict):
+        cleaned = {key: _clean(item) for key, item in value.items()}
+        return {key: item for key, item in cleaned.items() if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [item for item in (_clean(item) for item in value) if item not in (None, "", [], {})]
+    return value
+
+
+def _words(text):
+    return set(_WORDS.findall(str(text).lower()))
+
+
+def _overlap(words_a, words_b):
+    if not words_a or not words_b:
+        return 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def _similar(words_a, words_b):
+    # Near-identical means both the titles and the whole findings overlap;
+    # templated summaries alone do not make two findings the same.
+    title_a, all_a = words_a
+    title_b, all_b = words_b
+    return _overlap(title_a, title_b) >= 0.5 and _overlap(all_a, all_b) >= SIMILARITY_THRESHOLD
+
+
+def _merge_into(kept, duplicate):
+    if len(str(duplicate.get("summary", ""))) > len(str(kept.get("summary", ""))):
+        kept["summary"] = duplicate["summary"]
+    if isinstance(duplicate.get("metrics"), dict):
+        kept["metrics"] = {**duplicate["metrics"], **(kept.get("metrics") or {})}
+
+
+def deduplicate_entries(entries):
+    kept = []
+    by_title = {}
+    words = []
+    for entry in entries:
+        title = normalize_title(entry.get("title", ""))
+        if title and title in by_title:
+            _merge_into(kept[by_title[title]], entry)
+            continue
+
+        title_words = _words(entry.get("title", ""))
+        entry_words = (title_words, title_words | _words(entry.get("summary", "")))
+        match = None
+        for index, other in enumerate(kept):
+            if other.get("category") == entry.get("category") and _similar(entry_words, words[index]):
+                match = index
+                break
+        if match is not None:
+            _merge_into(kept[match], entry)
+            continue
+
+        if title:
+            by_title[title] = len(kept)
+        kept.append(entry)
+        words.append(entry_words)
+    return kept
+
+
+def _trim_priority(entry):
+    return (bool(entry.get("metrics")), TRIM_PRIORITY.get(entry.get("category"), -1))
+
+
+def _first_sentence(text):
+    return _SENTENCE_END.split(text, 1)[0]
+
+
+def _shorten(text, limit):
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0].rstrip(",;:") + "…"
+
+
+class CompactionResult:
+    def __init__(self, entries, text, tokens_before, tokens_after, entries_before):
+        self.entries = entries
+        self.text = text
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+        self.entries_before = entries_before
+
+    @property
+    def tokens_saved(self):
+        return max(0, self.tokens_before - self.tokens_after)
+
+    def describe(self):
+        return (
+            f"Compacted research: {self.entries_before} -> {len(self.entries)} entries, "
+            f"~{self.tokens_before} -> ~{self.tokens_after} tokens (saved ~{self.tokens_saved})"
+        )
+
+
+def compact_research(entries, token_budget=DEFAULT_RESEARCH_BUDGET, baseline_text=None):
+    # Deduplicates and minifies the research array, then trims summaries,
+    # lowest priority first, until it fits the token budget.
+    if baseline_text is None:
+        baseline_text = json.dumps(entries, indent=2, ensure_ascii=False)
+    entries_before = len(entries)
+    entries = deduplicate_entries([_clean(entry) for entry in entries if isinstance(entry, dict)])
+
+    sizes = [len(minify_json(entry)) + 1 for entry in entries]
+    budget_chars = token_budget * CHARS_PER_TOKEN if token_budget else None
+
+    def fits():
+        return budget_chars is None or sum(sizes) + 1 <= budget_chars
+
+    order = sorted(range(len(entries)), key=lambda index: _trim_priority(entries[index]))
+    trims = (_first_sentence, lambda text: _shorten(text, MIN_SUMMARY_CHARS))
+    for trim in trims:
+        for index in order:
+            if fits():
+                break
+            summary = entries[index].get("summary")
+            if isinstance(summary, str):
+                entries[index]["summary"] = trim(summary)
+                sizes[index] = len(minify_json(entries[index])) + 1
+
+    # Last resort: drop the lowest-priority entries, keeping one per category.
+    remaining = {}
+    for entry in entries:
+        remaining[entry.get("category")] = remaining.get(entry.get("category"), 0) + 1
+    dropped = set()
+    for index in order:
+        if fits():
+            break
+        category = entries[index].get("category")
+        if remaining[category] <= 1 and category in RESEARCH_CATEGORIES:
+            continue
+        remaining[category] -= 1
+        dropped.add(index)
+        sizes[index] = 0
+
+    entries = [entry for index, entry in enumerate(entries) if index not in dropped]
+    text = minify_json(entries)
+    return CompactionResult(entries, text, estimate_tokens(baseline_text), estimate_tokens(text), entries_before)
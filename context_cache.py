@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import threading
+import time
+
+DEFAULT_CONTEXT_TTL_MINUTES = 60
+# The API refuses to cache less than a model-dependent minimum; shorter
+# instructions are sent inline without asking (about four characters per
+# token). Of the stage instructions only query expansion's (about 1,800
+# tokens) is this long. The analysis and report instructions (about 600
+# and 480) are sent inline by design: the API would refuse them, and at
+# that size re-sending them costs little.
+DEFAULT_MIN_CACHE_TOKENS = 1024
+# The lifetime is extended once less than this share of it remains, so a
+# busy prompt never expires between two calls.
+REFRESH_FRACTION = 0.25
+# A cache that could not be created (too small for the model, caching not
+# enabled for the key, ...) is not asked for again for this long.
+UNAVAILABLE_SECONDS = 30 * 60
+
+
+class _Entry:
+    def __init__(self):
+        self.name = None
+        self.client = None
+        self.expires = 0.0
+        self.retry_at = 0.0
+        # Held while this prompt's cache is created or refreshed, so one
+        # caller makes the round trip and the others wait for its result.
+        # Lookups of other prompts and the stats only take the cache's lock,
+        # which is never held across a network call.
+        self.pending = threading.Lock()
+
+
+class ContextCache:
+    # Stores each static system instruction once with the Gemini API's
+    # cached-content feature, so calls send only their variable payload and
+    # the instruction tokens are billed at the cached rate. Lookups fall back
+    # to sending the instruction inline whenever a cache is unavailable.
+
+    def __init__(self, ttl_minutes=DEFAULT_CONTEXT_TTL_MINUTES, min_tokens=DEFAULT_MIN_CACHE_TOKENS):
+        self.ttl_seconds = max(60, int(ttl_minutes * 60))
+        self.min_tokens = min_tokens
+        self.stats = {"hits": 0, "created": 0, "refreshed": 0, "inline": 0, "unavailable": 0}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model_id, system_instruction):
+        return model_id, hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()
+
+    def _entry(self, model_id, system_instruction):
+        key = self._key(model_id, system_instruction)
+        with self._lock:
+            return self._entries.setdefault(key, _Entry())
+
+    def _fresh(self, entry, now):
+        # A name that needs no network round trip, or None.
+        if entry.name is None or entry.expires - now < self.ttl_seconds * REFRESH_FRACTION:
+            return None
+        return entry.name
+
+    def _ensure(self, entry, client, model_id, system_instruction):
+        from google.genai.types import CreateCachedContentConfig, UpdateCachedContentConfig
+        with entry.pending:
+            with self._lock:
+                now = time.time()
+                name = self._fresh(entry, now)
+                if name is not None:
+                    return name
+                if entry.name is None and now < entry.retry_at:
+                    return None
+                refresh = entry.name if entry.expires > now else None
+                owner = entry.client
+            ttl = f"{self.ttl_seconds}s"
+            try:
+                if refresh is not None:
+                    owner.caches.update(name=refresh, config=UpdateCachedContentConfig(ttl=ttl))
+                    name, stat = refresh, "refreshed"
+                else:
+                    cached = client.caches.create(
+                        model=model_id,
+                        config=CreateCachedContentConfig(
+                            system_instruction=system_instruction,
+                            display_name=f"report-prompt-{self._key(model_id, system_instruction)[1][:12]}",
+                            ttl=ttl,
+                        ),
+                    )
+                    name, owner, stat = cached.name, client, "created"
+            except Exception as e:
+                with self._lock:
+                    entry.name = None
+                    entry.retry_at = now + UNAVAILABLE_SECONDS
+                    self.stats["unavailable"] += 1
+                    first = self.stats["unavailable"] == 1
+                # Reported once; later failures only show in the stats.
+                if first:
+                    print(f"Context cache unavailable, sending prompts inline: {e}")
+                return None
+            with self._lock:
+                entry.name = name
+                entry.client = owner
+                entry.expires = now + self.ttl_seconds
+                self.stats[stat] += 1
+            return name
+
+    def _count(self, name):
+        with self._lock:
+            self.stats["hits" if name else "inline"] += 1
+        return name
+
+    def lookup(self, client, model_id, system_instruction):
+        if len(system_instruction) // 4 < self.min_tokens:
+            return self._count(None)
+        entry = self._entry(model_id, system_instruction)
+        name = self._fresh(entry, time.time())
+        if name is None:
+            name = self._ensure(entry, client, model_id, system_instruction)
+        return self._count(name)
+
+    async def lookup_async(self, client, model_id, system_instruction):
+        if len(system_instruction) // 4 < self.min_tokens:
+            return self._count(None)
+        entry = self._entry(model_id, system_instruction)
+        now = time.time()
+        name = self._fresh(entry, now)
+        if name is None and (entry.name is not None or now >= entry.retry_at):
+            # Creating or refreshing is rare; it runs on a thread so the
+            # event loop keeps serving other reports meanwhile.
+            name = await asyncio.to_thread(self._ensure, entry, client, model_id, system_instruction)
+        return self._count(name)
+
+    def serves(self, model_id, system_instruction):
+        # Whether a call would use a cached prompt right now, without any
+        # network call: the scheduler counts an instruction sent inline
+        # against the token quota.
+        if len(system_instruction) // 4 < self.min_tokens:
+            return False
+        with self._lock:
+            entry = self._entries.get(self._key(model_id, system_instruction))
+            return entry is not None and entry.name is not None and entry.expires > time.time()
+
+    def invalidate(self, model_id, system_instruction):
+        # Called when the API no longer knows a cache (expired or deleted
+        # elsewhere); the next lookup creates a new one.
+        entry = self._entry(model_id, system_instruction)
+        with self._lock:
+            entry.name = None
+            entry.expires = 0.0
+
+    def close(self):
+        # Deletes the caches this process created, so their storage is not
+        # billed until the TTL runs out.
+        with self._lock:
+            caches = [(entry.client, entry.name) for entry in self._entries.values() if entry.name]
+            for entry in self._entries.values():
+                entry.name = None
+        for client, name in caches:
+            try:
+                client.caches.delete(name=name)
+            except Exception as e:
+                print(f"Could not delete context cache {name}: {e}")
+
+    def format_stats(self):
+        stats = self.stats
+        return (
+            f"Context cache: {stats['hits']} calls used a cached prompt, {stats['inline']} sent it inline, "
+            f"{stats['created']} caches created, {stats['refreshed']} refreshed, "
+            f"{stats['unavailable']} could not be created"
+        )
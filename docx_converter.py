@@ -1,159 +1,188 @@
-import json
-from docx import Document
-from docx.shared import Pt, RGBColor, Inches
 from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from templates import load_template
+from report_ir import (
+    Heading,
+    Paragraph,
+    ListItem,
+    TextRun,
+    compile_block,
+    compile_report,
+    tokenize_markdown,
+    clean_markdown,
+    list_item_text,
+    plain_text,
+    FALLBACK_LIST_ITEM,
+)
+from renderers import BACKENDS
+import json
 import re
 
-def json_to_docx(json_data, output_filename="esports_report.docx"):
-    if isinstance(json_data, str):
-        try:
-            data = json.loads(json_data)
-        except json.JSONDecodeError:
-            raise ValueError("Invalid JSON string provided")
-    else:
-        data = json_data
+# TextRun, clean_markdown, list_item_text and BACKENDS moved to report_ir and
+# renderers; they stay importable from here for existing callers.
+__all__ = [
+    "DocxBuilder",
+    "create_builder",
+    "json_to_docx",
+    "HYPERLINK_COLOR",
+    "CODE_FONT",
+    "add_hyperlink",
+    "add_markdown_runs",
+    "add_text_runs",
+    "process_text_with_markdown",
+    "TextRun",
+    "clean_markdown",
+    "list_item_text",
+    "BACKENDS",
+]
+
+
+class DocxBuilder:
+    def __init__(self, template=None):
+        self.template = template or load_template()
+        self.doc = self.template.new_document()
+        self.block_count = 0
+        self.list_style_id = self.template.style_id('List Bullet')
     
-    doc = Document()
+    def _add_paragraph(self, style_id=None):
+        # Setting the style id directly skips python-docx's per-call lookup
+        # of the style by name.
+        paragraph = self.doc.add_paragraph()
+        if style_id:
+            paragraph._p.style = style_id
+        return paragraph
     
-    style = doc.styles['Normal']
-    font = style.font
-    font.name = 'Calibri'
-    font.size = Pt(11)
+    def add_block(self, block):
+        if isinstance(block, dict):
+            self.block_count += 1
+        for node in compile_block(block):
+            self.add_node(node)
     
-    for block in data:
-        if not isinstance(block, dict):
-            continue
-            
-        block_type = block.get("type")
+    def add_node(self, node):
+        doc = self.doc
+        node_type = type(node)
         
-        if block_type == "heading":
+        if node_type is Heading:
             try:
-                level = block.get("level", 1)
-                text = block.get("text", "")
-                
-                clean_text = clean_markdown(text)
-                
-                heading = doc.add_heading(clean_text, level=level)
-                
-                for run in heading.runs:
-                    if level == 1:
-                        run.font.color.rgb = RGBColor(0, 0, 128)
-                        run.font.size = Pt(16)
-                    else:
-                        run.font.color.rgb = RGBColor(0, 0, 0)
-                        run.font.size = Pt(14 - (level - 2))
+                style_id = self.template.heading_style_id(node.level)
+                heading = self._add_paragraph(style_id)
+                if node.text:
+                    heading.add_run(node.text)
             except Exception:
-                doc.add_heading("Heading", level=1)
+                heading = self._add_paragraph(self.template.heading_style_id(1))
+                heading.add_run("Heading")
         
-        elif block_type == "paragraph":
+        elif node_type is Paragraph:
             try:
-                text = block.get("text", "")
                 paragraph = doc.add_paragraph()
                 paragraph.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                process_text_with_markdown(paragraph, text)
+                add_text_runs(paragraph, node.runs)
             except Exception:
                 doc.add_paragraph()
             
-        elif block_type == "list":
+        elif node_type is ListItem:
             try:
-                items = block.get("items", [])
-                for item in items:
-                    paragraph = doc.add_paragraph(style='List Bullet')
-                    paragraph.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                    
-                    if isinstance(item, dict):
-                        if 'text' in item:
-                            process_text_with_markdown(paragraph, item['text'])
-                        else:
-                            process_text_with_markdown(paragraph, str(item))
-                    elif isinstance(item, list):
-                        joined_text = ', '.join(str(x) for x in item)
-                        process_text_with_markdown(paragraph, joined_text)
-                    else:
-                        process_text_with_markdown(paragraph, item)
+                paragraph = self._add_paragraph(self.list_style_id)
+                paragraph.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+                add_text_runs(paragraph, node.runs)
             except Exception:
-                doc.add_paragraph("• List item", style='List Bullet')
+                self._add_paragraph(self.list_style_id).add_run(FALLBACK_LIST_ITEM)
     
-    try:
-        doc.save(output_filename)
-        return output_filename
-    except Exception:
-        fallback_filename = "report_fallback.docx"
-        doc.save(fallback_filename)
-        return fallback_filename
+    def save(self, output_filename="esports_report.docx"):
+        try:
+            self.doc.save(output_filename)
+            return output_filename
+        except Exception:
+            fallback_filename = "report_fallback.docx"
+            self.doc.save(fallback_filename)
+            return fallback_filename
 
 
-def clean_markdown(text):
-    if not isinstance(text, str):
-        try:
-            text = str(text)
-        except:
-            return ""
-            
-    try:
-        text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-        text = re.sub(r'(?<!\w)\*(?!\*)(.*?)(?<!\*)\*(?!\w)', r'\1', text)
-        text = re.sub(r'\[(.*?)\]\(.*?\)', r'\1', text)
-        text = re.sub(r'`(.*?)`', r'\1', text)
+def create_builder(backend="docx", template=None):
+    if isinstance(template, str):
+        template = load_template(template)
+    if backend == "stream":
+        from ooxml_writer import OoxmlBuilder
+        return OoxmlBuilder(template)
+    if backend != "docx":
+        raise ValueError(f"Unknown rendering backend: {backend}")
+    return DocxBuilder(template)
+
+
+def json_to_docx(json_data, output_filename="esports_report.docx", backend="docx", template=None):
+    builder = create_builder(backend, template)
+    for node in compile_report(json_data):
+        builder.add_node(node)
+    
+    return builder.save(output_filename)
+
+
+HYPERLINK_COLOR = "0563C1"
+CODE_FONT = "Consolas"
+
+
+def add_hyperlink(paragraph, text, url):
+    r_id = paragraph.part.relate_to(url, RT.HYPERLINK, is_external=True)
+    
+    hyperlink = OxmlElement('w:hyperlink')
+    hyperlink.set(qn('r:id'), r_id)
+    
+    run = OxmlElement('w:r')
+    run_properties = OxmlElement('w:rPr')
+    color = OxmlElement('w:color')
+    color.set(qn('w:val'), HYPERLINK_COLOR)
+    underline = OxmlElement('w:u')
+    underline.set(qn('w:val'), 'single')
+    run_properties.append(color)
+    run_properties.append(underline)
+    run.append(run_properties)
+    
+    text_element = OxmlElement('w:t')
+    text_element.text = text
+    text_element.set(qn('xml:space'), 'preserve')
+    run.append(text_element)
+    
+    hyperlink.append(run)
+    paragraph._p.append(hyperlink)
+    return hyperlink
+
+
+def add_markdown_runs(paragraph, runs):
+    for text_run in runs:
+        if text_run.url:
+            add_hyperlink(paragraph, text_run.text, text_run.url)
+            continue
         
-        return text
-    except Exception:
-        return text
+        run = paragraph.add_run(text_run.text)
+        if text_run.bold:
+            run.bold = True
+        if text_run.italic:
+            run.italic = True
+        if text_run.code:
+            run.font.name = CODE_FONT
 
 
-def process_text_with_markdown(paragraph, text):
+def add_text_runs(paragraph, runs):
     try:
-        if not isinstance(text, str):
-            try:
-                text = str(text)
-            except:
-                text = ""
-                
-        bold_pattern = re.compile(r'\*\*(.*?)\*\*')
-        
-        positions = []
-        for match in bold_pattern.finditer(text):
-            positions.append((match.start(), 'start_bold'))
-            positions.append((match.end(), 'end_bold'))
-        
-        if not positions:
-            paragraph.add_run(text)
-            return
-        
-        positions.sort()
-        
-        last_pos = 0
-        is_bold = False
-        
-        for pos, marker_type in positions:
-            if pos > last_pos:
-                run_text = text[last_pos:pos]
-                if is_bold and run_text.startswith('**'):
-                    run_text = run_text[2:]
-                if not is_bold and run_text.endswith('**'):
-                    run_text = run_text[:-2]
-                    
-                if run_text:
-                    run = paragraph.add_run(run_text)
-                    run.bold = is_bold
-            
-            if marker_type == 'start_bold':
-                is_bold = True
-            elif marker_type == 'end_bold':
-                is_bold = False
-            
-            last_pos = pos
-        
-        if last_pos < len(text):
-            run = paragraph.add_run(text[last_pos:])
-            run.bold = is_bold
+        add_markdown_runs(paragraph, runs)
     except Exception:
         try:
-            paragraph.add_run(str(text))
+            paragraph.add_run(plain_text(runs))
         except:
             paragraph.add_run("Text processing error")
 
 
+def process_text_with_markdown(paragraph, text):
+    if not isinstance(text, str):
+        try:
+            text = str(text)
+        except:
+            text = ""
+    add_text_runs(paragraph, tokenize_markdown(text))
+
+
 def main():
     import argparse
     
@@ -168,6 +197,7 @@ def main():
         test_data = [
             {"type": "heading", "level": 1, "text": "Test Document"},
             {"type": "paragraph", "text": "This is a paragraph with **bold text** inside it."},
+            {"type": "paragraph", "text": "Mixed *italic*, `inline code` and a [link](https://example.com) with **bold**."},
             {"type": "heading", "level": 2, "text": "List Items"},
             {"type": "list", "items": [
                 "Regular item",
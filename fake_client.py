@@ -0,0 +1,315 @@
+import asyncio
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+from google.genai import errors
+from research_store import RESEARCH_CATEGORIES
+
+_REPAIR_STAGE = re.compile(r'produced for the \*\*(\w+)\*\* stage')
+_REFRESH_SECTION = re.compile(r'^- \w+: (.+)$', re.MULTILINE)
+# Pipeline stages that share a canned output.
+_STAGE_OUTPUTS = {"analysis_report": "report", "analysis_map": "analysis", "analysis_reduce": "analysis"}
+
+
+def sample_report_blocks(count):
+    blocks = [{"type": "heading", "level": 1, "text": "Executive Summary"}]
+    section = 0
+    while len(blocks) < count:
+        section += 1
+        kind = section % 3
+        if kind == 1:
+            blocks.append({"type": "heading", "level": 2, "text": f"Section {section}: **Key** Findings"})
+        elif kind == 2:
+            blocks.append({
+                "type": "paragraph",
+                "text": (
+                    f"We posit that segment {section} **grew 12%** year over year, "
+                    "which suggests sustained demand; based on 2024 metrics the trend indicates further expansion."
+                ),
+            })
+        else:
+            blocks.append({
+                "type": "list",
+                "items": [
+                    f"**Player {section}-{item}**: holds an estimated {item * 7}% share of the market"
+                    for item in range(1, 5)
+                ],
+            })
+    return blocks[:count]
+
+
+def refresh_report_blocks(request_text):
+    # A refresh's rewritten report: the title and summary, then the sections
+    # listed in the request with the headings given for them.
+    title = re.search(r'<TITLE>(.*?)</TITLE>', request_text)
+    sections = re.search(r'<SECTIONS>(.*?)</SECTIONS>', request_text, re.DOTALL)
+    blocks = [
+        {"type": "heading", "level": 1, "text": title.group(1) if title else "Executive Summary"},
+        {"type": "paragraph", "text": "We posit that the refreshed findings indicate continued growth."},
+    ]
+    for heading in _REFRESH_SECTION.findall(sections.group(1) if sections else ""):
+        blocks.append({"type": "heading", "level": 2, "text": heading})
+        blocks.append({"type": "list", "items": [f"**Updated**: {heading} reflects the new research"]})
+    return blocks
+
+
+def sample_research_entries(count):
+    return [
+        {
+            "category": RESEARCH_CATEGORIES[index % len(RESEARCH_CATEGORIES)],
+            "title": f"Finding {index}",
+            "summary": f"Finding {index} summarizes a market development with supporting figures from 2024.",
+            "metrics": {"growth_rate": f"{index % 20}%"},
+        }
+        for index in range(count)
+    ]
+
+
+def sample_analysis():
+    return {
+        "trends": [{"title": "Mobile growth", "details": "Mobile audiences grew 20% in 2024."}],
+        "competitive_landscape": [{
+            "name": "Example Corp",
+            "positioning": "Premium platform",
+            "strengths": ["Brand"],
+            "weaknesses": ["Price"],
+        }],
+        "insights": [{"market": "Global", "finding": "Younger audiences prefer short-form content."}],
+        "recommendations": [{"action": "Expand mobile offering", "rationale": "Follows the mobile growth trend."}],
+    }
+
+
+def _request_text(contents, config):
+    text = contents if isinstance(contents, str) else json.dumps(contents, default=str)
+    system_instruction = getattr(config, "system_instruction", None)
+    if system_instruction:
+        text += str(system_instruction)
+    return text
+
+
+def classify_request(contents, config=None, system_instruction=None):
+    if getattr(config, "tools", None):
+        return "research"
+    text = _request_text(contents, config) + (system_instruction or "")
+    match = _REPAIR_STAGE.search(text)
+    if match:
+        stage = match.group(1)
+        return _STAGE_OUTPUTS.get(stage, stage.split("_")[0])
+    if "Prompt Engineer" in text:
+        return "input"
+    if "<SECTIONS>" in text and "<ANALYSIS_DATA>" in text:
+        return "report_refresh"
+    if "<ANALYSIS_DATA>" in text or "block objects" in text:
+        return "report"
+    if "<PARTIAL_ANALYSES>" in text or "<DATA>" in text:
+        return "analysis"
+    return "research"
+
+
+class FakeGeminiClient:
+    # Deterministic stand-in for genai.Client: canned stage outputs with
+    # configurable latency, jitter, stream chunking and failure rate.
+    # token_latency adds seconds per 1,000 prompt tokens, so long prompts
+    # are slower like they are on the real API. quota_rpm answers calls
+    # beyond that many per minute with a 429 carrying a retry delay.
+    # Cached contents are kept in memory; cache_min_tokens rejects smaller
+    # ones the way the API does. model_latency scales the latency per model
+    # name, e.g. {"gemini-2.0-flash-lite": 0.5}.
+
+    def __init__(self, latency=0.0, jitter=0.0, chunk_size=256, chunk_delay=0.0,
+                 failure_rate=0.0, report_blocks=40, research_entries=20, outputs=None, seed=0,
+                 token_latency=0.0, quota_rpm=None, cache_min_tokens=0, model_latency=None):
+        self.latency = latency
+        self.quota_rpm = quota_rpm
+        self._recent = deque()
+        self.token_latency = token_latency
+        self.model_latency = model_latency or {}
+        self.jitter = jitter
+        self.chunk_size = max(1, chunk_size)
+        self.chunk_delay = chunk_delay
+        self.failure_rate = failure_rate
+        self.outputs = {
+            "input": "Research the market described in the query and return a JSON array of findings.",
+            "research": json.dumps(sample_research_entries(research_entries)),
+            "analysis": json.dumps(sample_analysis()),
+            "report": json.dumps(sample_report_blocks(report_blocks)),
+        }
+        self.outputs.update(outputs or {})
+        self.calls = {}
+        self.cache_min_tokens = cache_min_tokens
+        self.cached_contents = {}
+        self.caches = _FakeCaches(self)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.models = _FakeModels(self)
+        self.aio = SimpleNamespace(models=_FakeAsyncModels(self))
+
+    def _cached_instruction(self, config):
+        name = getattr(config, "cached_content", None)
+        if not name:
+            return None
+        with self._lock:
+            cached = self.cached_contents.get(name)
+        if cached is None:
+            raise errors.ClientError(404, {"error": {
+                "code": 404, "message": f"CachedContent not found: {name}", "status": "NOT_FOUND",
+            }})
+        return cached.system_instruction
+
+    def _plan(self, contents, config, model=None):
+        # A cached instruction decides the stage but adds no token latency,
+        # the way cached prompt tokens skip most of the prefill on the API.
+        stage = classify_request(contents, config, self._cached_instruction(config))
+        self._check_quota(stage)
+        with self._lock:
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+            failed = self._random.random() < self.failure_rate
+            spread = self._random.uniform(-self.jitter, self.jitter)
+        latency = self.latency.get(stage, 0.0) if isinstance(self.latency, dict) else self.latency
+        latency += self.token_latency * len(_request_text(contents, config)) / 4000
+        latency *= self.model_latency.get(model, 1.0)
+        delay = max(0.0, latency * (1 + spread))
+        return stage, delay, failed
+
+    def _output(self, stage, contents):
+        if stage == "report_refresh" and stage not in self.outputs:
+            return json.dumps(refresh_report_blocks(_request_text(contents, None)))
+        return self.outputs[stage]
+
+    def _check_quota(self, stage):
+        if not self.quota_rpm:
+            return
+        with self._lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+            if len(self._recent) < self.quota_rpm:
+                self._recent.append(now)
+                return
+            self.calls["rate_limited"] = self.calls.get("rate_limited", 0) + 1
+            retry_delay = 60 - (now - self._recent[0])
+        raise errors.ClientError(429, {"error": {
+            "code": 429,
+            "message": f"Fake quota of {self.quota_rpm} requests per minute exceeded by {stage}",
+            "status": "RESOURCE_EXHAUSTED",
+            "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_delay:.3f}s"}],
+        }})
+
+    def _response(self, contents, text, usage_text=None):
+        usage = None
+        if usage_text is not None:
+            prompt_tokens = len(_request_text(contents, None)) // 4
+            candidate_tokens = len(usage_text) // 4
+            usage = SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=candidate_tokens,
+                total_token_count=prompt_tokens + candidate_tokens,
+            )
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def _chunks(self, text):
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+
+    @staticmethod
+    def _failure(stage):
+        return errors.ServerError(503, {"error": {"message": f"Fake {stage} failure", "status": "UNAVAILABLE"}})
+
+
+class _FakeCaches:
+    def __init__(self, client):
+        self._client = client
+        self._names = itertools.count(1)
+
+    def create(self, model, config=None):
+        client = self._client
+        system_instruction = str(getattr(config, "system_instruction", "") or "")
+        tokens = len(system_instruction) // 4
+        if tokens < client.cache_min_tokens:
+            raise errors.ClientError(400, {"error": {
+                "code": 400,
+                "message": f"Cached content is too small: {tokens} tokens, minimum is {client.cache_min_tokens}",
+                "status": "INVALID_ARGUMENT",
+            }})
+        cached = SimpleNamespace(
+            name=f"cachedContents/fake-{next(self._names)}",
+            model=model,
+            system_instruction=system_instruction,
+            ttl=getattr(config, "ttl", None),
+        )
+        with client._lock:
+            client.cached_contents[cached.name] = cached
+            client.calls["cache_create"] = client.calls.get("cache_create", 0) + 1
+        return cached
+
+    def update(self, name, config=None):
+        client = self._client
+        with client._lock:
+            cached = client.cached_contents[name]
+            cached.ttl = getattr(config, "ttl", None)
+        return cached
+
+    def delete(self, name, config=None):
+        with self._client._lock:
+            self._client.cached_contents.pop(name, None)
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        client = self._client
+        stage, delay, failed = client._plan(contents, config, model)
+        time.sleep(delay)
+        if failed:
+            raise client._failure(stage)
+        output = client._output(stage, contents)
+        return client._response(contents, output, output)
+
+    def generate_content_stream(self, model, contents, config=None):
+        client = self._client
+        stage, delay, failed = client._plan(contents, config, model)
+        time.sleep(delay)
+        if failed:
+            raise client._failure(stage)
+        output = client._output(stage, contents)
+        chunks = client._chunks(output)
+        for index, chunk in enumerate(chunks):
+            if index and client.chunk_delay:
+                time.sleep(client.chunk_delay)
+            yield client._response(contents, chunk, output if index == len(chunks) - 1 else None)
+
+
+class _FakeAsyncModels:
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, model, contents, config=None):
+        client = self._client
+        stage, delay, failed = client._plan(contents, config, model)
+        await asyncio.sleep(delay)
+        if failed:
+            raise client._failure(stage)
+        output = client._output(stage, contents)
+        return client._response(contents, output, output)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        client = self._client
+        stage, delay, failed = client._plan(contents, config, model)
+        await asyncio.sleep(delay)
+        if failed:
+            raise client._failure(stage)
+        return self._stream(contents, client._output(stage, contents))
+
+    async def _stream(self, contents, output):
+        client = self._client
+        chunks = client._chunks(output)
+        for index, chunk in enumerate(chunks):
+            if index:
+                await asyncio.sleep(client.chunk_delay)
+            yield client._response(contents, chunk, output if index == len(chunks) - 1 else None)
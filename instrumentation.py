@@ -0,0 +1,176 @@
+import json
+import threading
+import time
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class StageTiming:
+    def __init__(self, report, stage, model_id, repairs=0):
+        self.report = report
+        self.record = {
+            "query": report.query,
+            "stage": stage,
+            "model": model_id,
+            "status": "ok",
+            "cached": False,
+            # Times the scheduler resent this call after a transient error,
+            # and which repair of the stage's output it is.
+            "retries": 0,
+            "repairs": repairs,
+            "wall_seconds": None,
+            "ttfb_seconds": None,
+            "prompt_tokens": None,
+            "candidate_tokens": None,
+            "total_tokens": None,
+            "context_cached_tokens": None,
+        }
+        self._start = time.perf_counter()
+
+    def first_byte(self):
+        if self.record["ttfb_seconds"] is None:
+            self.record["ttfb_seconds"] = time.perf_counter() - self._start
+
+    def usage(self, usage_metadata):
+        if usage_metadata is None:
+            return
+        self.record["prompt_tokens"] = getattr(usage_metadata, "prompt_token_count", None)
+        self.record["candidate_tokens"] = getattr(usage_metadata, "candidates_token_count", None)
+        self.record["total_tokens"] = getattr(usage_metadata, "total_token_count", None)
+        self.record["context_cached_tokens"] = getattr(usage_metadata, "cached_content_token_count", None)
+
+    def finish(self, status="ok", cached=False, retries=0):
+        self.record["wall_seconds"] = time.perf_counter() - self._start
+        self.record["status"] = status
+        self.record["cached"] = cached
+        self.record["retries"] = retries
+        if self.record["ttfb_seconds"] is None:
+            self.record["ttfb_seconds"] = self.record["wall_seconds"]
+        self.report.tracer.add(self.record)
+
+
+class ReportTrace:
+    def __init__(self, tracer, query):
+        self.tracer = tracer
+        self.query = query
+        self.render_seconds = 0.0
+        self._start = time.perf_counter()
+
+    def stage(self, stage, model_id, repairs=0):
+        return StageTiming(self, stage, model_id, repairs)
+
+    def add_render_time(self, seconds):
+        self.render_seconds += seconds
+
+    def finish(self, status, blocks=0):
+        self.tracer.add({
+            "query": self.query,
+            "stage": "render",
+            "status": status,
+            "blocks": blocks,
+            "wall_seconds": self.render_seconds,
+        })
+        self.tracer.add({
+            "query": self.query,
+            "stage": "total",
+            "status": status,
+            "wall_seconds": time.perf_counter() - self._start,
+        })
+
+
+class Tracer:
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def start_report(self, query):
+        return ReportTrace(self, query)
+
+    def add(self, record):
+        record["timestamp"] = time.time()
+        with self._lock:
+            self.records.append(record)
+
+    def export_jsonl(self, path):
+        with self._lock:
+            records = list(self.records)
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return path
+
+    def summary(self):
+        stages = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            stages.setdefault(record["stage"], []).append(record)
+
+        rows = []
+        for stage, stage_records in stages.items():
+            called = [r for r in stage_records if not r.get("cached")]
+            walls = [r["wall_seconds"] for r in called if r.get("wall_seconds") is not None]
+            ttfbs = [r["ttfb_seconds"] for r in called if r.get("ttfb_seconds") is not None]
+            prompt_tokens = sum(r.get("prompt_tokens") or 0 for r in called)
+            candidate_tokens = sum(r.get("candidate_tokens") or 0 for r in called)
+            rows.append({
+                "stage": stage,
+                "calls": len(stage_records),
+                "cached": len(stage_records) - len(called),
+                "failed": sum(1 for r in stage_records if r.get("status") != "ok"),
+                "retries": sum(r.get("retries") or 0 for r in stage_records),
+                "repairs": sum(1 for r in stage_records if r.get("repairs")),
+                "mean_seconds": sum(walls) / len(walls) if walls else 0.0,
+                "p95_seconds": _percentile(walls, 0.95),
+                "mean_ttfb": sum(ttfbs) / len(ttfbs) if ttfbs else 0.0,
+                "prompt_tokens": prompt_tokens,
+                "candidate_tokens": candidate_tokens,
+                "tokens_per_second": candidate_tokens / sum(walls) if walls and sum(walls) else 0.0,
+            })
+        return rows
+
+    def format_summary(self):
+        header = (
+            f"{'stage':<18}{'calls':>6}{'cached':>7}{'failed':>7}{'retries':>8}{'repairs':>8}"
+            f"{'mean s':>9}{'p95 s':>9}{'ttfb s':>9}{'in tok':>9}{'out tok':>9}{'out tok/s':>11}"
+        )
+        lines = [header, "-" * len(header)]
+        for row in self.summary():
+            lines.append(
+                f"{row['stage']:<18}{row['calls']:>6}{row['cached']:>7}{row['failed']:>7}{row['retries']:>8}"
+                f"{row['repairs']:>8}"
+                f"{row['mean_seconds']:>9.2f}{row['p95_seconds']:>9.2f}{row['mean_ttfb']:>9.2f}"
+                f"{row['prompt_tokens']:>9}{row['candidate_tokens']:>9}{row['tokens_per_second']:>11.1f}"
+            )
+        return "\n".join(lines)
+
+
+class _NullTiming:
+    def first_byte(self):
+        pass
+
+    def usage(self, usage_metadata):
+        pass
+
+    def finish(self, status="ok", cached=False, retries=0):
+        pass
+
+
+class _NullReportTrace:
+    def stage(self, stage, model_id, repairs=0):
+        return _NullTiming()
+
+    def add_render_time(self, seconds):
+        pass
+
+    def finish(self, status, blocks=0):
+        pass
+
+
+NULL_TRACE = _NullReportTrace()
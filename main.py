@@ -1,74 +1,80 @@
-from google import genai
-from google.genai.types import Tool, GenerateContentConfig, GoogleSearch
 import os
-import json
-import re
 import argparse
+import asyncio
 import sys
-from dotenv import load_dotenv
-from prompts import format_input_prompt, format_analysis_prompt, format_report_prompt
-from docx_converter import json_to_docx
+from pipeline import create_client, generate_report, MAX_REPAIRS, MODEL_ID
+from batch import run_batch_async, read_queries, DEFAULT_CONCURRENCY
+from cassette import CassetteWriter, RecordingClient, ReplayClient
+from client_pool import (
+    CLIENTS, DEFAULT_MAX_CONNECTIONS, DEFAULT_MAX_KEEPALIVE, DEFAULT_KEEPALIVE_SECONDS, DEFAULT_TIMEOUT_SECONDS
+)
+from instrumentation import Tracer
+from renderers import BACKENDS, FORMATS, FORMAT_EXTENSIONS
+from stage_cache import StageCache, DEFAULT_CACHE_DIR, DEFAULT_TTL_HOURS, DEFAULT_MAX_MB
+from compaction import DEFAULT_RESEARCH_BUDGET
+from map_reduce import ANALYSIS_MODES, MAP_REDUCE_MIN_ENTRIES
+from research_store import ResearchStore, DEFAULT_STORE_PATH, DEFAULT_MAX_AGE_DAYS
+from context_cache import ContextCache, DEFAULT_CONTEXT_TTL_MINUTES
+from refresh import load_report_state
+from routing import ModelRouter, load_routing
+from scheduler import CallScheduler, DEFAULT_MAX_RETRIES
+from service import run_service, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE
+from worker import run_worker, submit, DEFAULT_SOCKET_PATH, DEFAULT_PROCESSES
 
-def generate_report(query, output_file=None):
-    client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
-    model_id = "gemini-2.0-flash"
-    google_search_tool = Tool(
-        google_search = GoogleSearch()
-    )
-    
-    print(f"Starting research on: {query}")
-    print("Step 1/3: Generating search prompt...")
-    input_response = client.models.generate_content(
-        model=model_id,
-        contents=format_input_prompt(query),
-    )
+# Options that shape the pipeline's calls; a cassette stores them so its
+# replay makes the same calls.
+CASSETTE_OPTIONS = ("fast", "stream", "max_repairs", "research_budget", "analysis_mode", "fan_out")
 
-    print("Step 2/3: Performing web search and gathering data...")
-    research_response = client.models.generate_content(
-        model=model_id,
-        contents=input_response.text,
-        config=GenerateContentConfig(
-            tools=[google_search_tool],
-            response_modalities=["TEXT"],
-        )
-    )
+def load_previous(path):
+    try:
+        return load_report_state(path)
+    except Exception as e:
+        print(f"Error loading {path}: {e}")
+        sys.exit(1)
 
-    print("Step 3/3: Analyzing data and preparing report...")
-    analysis_response = client.models.generate_content(
-        model=model_id,
-        contents=format_analysis_prompt(research_response.text),
-    )
+def run_refresh(args, previous, report_options):
+    # The refreshed document replaces the previous one unless -o is given.
+    output = args.output
+    if output is None and args.refresh:
+        output = os.path.splitext(args.refresh)[0] + ".docx"
+    generate_report(previous["query"], output, previous=previous, **report_options)
 
-    print("Finalizing report structure...")
-    report_response = client.models.generate_content(
-        model=model_id,
-        contents=format_report_prompt(analysis_response.text),
-    )
+def resolve_query(args):
+    if args.query:
+        high_level_query = args.query
+    elif args.example:
+        high_level_query = "What are the key players in the Esports Industry?"
+        print(f"Using example query: \"{high_level_query}\"")
+    else:
+        print("No query provided. Please enter your business query below:")
+        high_level_query = input("> ")
+        
+        if not high_level_query.strip():
+            print("No query entered. Using default example query.")
+            high_level_query = "What are the key players in the Esports Industry?"
+    
+    return high_level_query
 
+def hand_off(argv, args):
+    # The worker has no terminal, so a query is asked for here.
+    job = list(argv)
+    if not (args.query or args.example or args.batch or args.refresh or args.replay):
+        args.query = resolve_query(args)
+        job += ["--", args.query]
     try:
-        json_text = report_response.text
-        json_text = re.sub(r'^```json\s*', '', json_text)
-        json_text = re.sub(r'\s*```$', '', json_text)
-        
-        report_json = json.loads(json_text)
-        
-        if output_file is None:
-            words = query.split()[:4]
-            base_name = "_".join(words).lower()
-            base_name = re.sub(r'[^\w\s-]', '', base_name).strip()
-            base_name = re.sub(r'[-\s]+', '_', base_name)
-            output_file = f"{base_name}_report.docx"
-        
-        output_doc = json_to_docx(report_json, output_file)
-        print(f"Report generated: {output_doc}")
-        return output_doc
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON: {e}")
+        return submit(job, args.socket)
+    except OSError as e:
+        print(f"No worker answering on {args.socket} ({e}); running here instead.")
         return None
 
-def main():
+def main(argv=None, in_worker=False):
+    # Heavy modules (google.genai, python-docx) are imported on first use, so
+    # --help, argument errors and hand-offs to a warm worker start quickly.
+    argv = sys.argv[1:] if argv is None else list(argv)
     parser = argparse.ArgumentParser(
-        description='Generate a business intelligence report on any topic or industry'
+        description='Generate a business intelligence report on any topic or industry',
+        epilog='Run "main.py serve [options]" to start the HTTP report service, or "main.py worker [options]" '
+               'to start a warm worker, instead.'
     )
     parser.add_argument(
         'query', 
@@ -86,30 +92,439 @@ def main():
         action='store_true',
         help='Use default example query about esports industry'
     )
+    parser.add_argument(
+        '--batch',
+        type=str,
+        metavar='FILE',
+        help='Generate one report per line of FILE concurrently'
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f'Maximum number of reports generated at once in batch mode (default: {DEFAULT_CONCURRENCY})'
+    )
+    parser.add_argument(
+        '--render-workers',
+        type=int,
+        default=0,
+        help='Render batch reports in this many worker processes instead of alongside the LLM calls (default: 0)'
+    )
+    parser.add_argument(
+        '--render-queue',
+        type=int,
+        help='Finished reports allowed to wait for a render worker before pipelines pause (default: 2 per worker)'
+    )
+    parser.add_argument(
+        '--output-dir',
+        type=str,
+        default='reports',
+        help='Directory for batch reports and manifest.json (default: reports)'
+    )
+    parser.add_argument(
+        '--refresh',
+        type=str,
+        metavar='REPORT',
+        help='Update a previously generated .docx: rerun research and regenerate only the sections whose findings changed'
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Stream the report stage and render blocks into the document as they arrive'
+    )
+    parser.add_argument(
+        '--fast',
+        action='store_true',
+        help='Two-call pipeline: expand the query locally and analyze and write the report in one call'
+    )
+    parser.add_argument(
+        '--max-repairs',
+        type=int,
+        default=MAX_REPAIRS,
+        help=f'Repair calls allowed per stage when its JSON fails validation (default: {MAX_REPAIRS})'
+    )
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default='docx',
+        help='Rendering engine: python-docx (docx) or the low-memory streaming OOXML writer (stream)'
+    )
+    parser.add_argument(
+        '--formats',
+        nargs='+',
+        choices=FORMATS,
+        default=['docx'],
+        help='Output formats, all rendered from one compiled report; each gets its own extension '
+             f'({", ".join(FORMAT_EXTENSIONS.values())}) next to the output name (default: docx)'
+    )
+    parser.add_argument(
+        '--template',
+        type=str,
+        metavar='PATH',
+        help='Corporate .docx or .dotx template whose styles, headers and footers the report uses'
+    )
+    parser.add_argument(
+        '--trace',
+        type=str,
+        metavar='FILE',
+        help='Append per-stage timings and token counts to FILE as JSON lines'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Print a per-stage latency and token summary when done'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help=f'Directory for cached stage results (default: {DEFAULT_CACHE_DIR})'
+    )
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=DEFAULT_TTL_HOURS,
+        help=f'Hours before a cached stage result expires (default: {DEFAULT_TTL_HOURS})'
+    )
+    parser.add_argument(
+        '--cache-max-mb',
+        type=float,
+        default=DEFAULT_MAX_MB,
+        help=f'Size limit of the stage cache; least recently used results are evicted first (default: {DEFAULT_MAX_MB})'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Call every stage again instead of reusing cached results'
+    )
+    parser.add_argument(
+        '--fan-out',
+        action='store_true',
+        help='Run one concurrent web search per research category instead of a single search'
+    )
+    parser.add_argument(
+        '--research-budget',
+        type=int,
+        default=DEFAULT_RESEARCH_BUDGET,
+        help=f'Approximate token budget for research data in the analysis prompt; 0 only deduplicates and minifies (default: {DEFAULT_RESEARCH_BUDGET})'
+    )
+    parser.add_argument(
+        '--analysis-mode',
+        choices=ANALYSIS_MODES,
+        default='auto',
+        help=f'Analyze research in one call (single) or in concurrent chunks plus a merge call (map-reduce); '
+             f'auto uses map-reduce above {MAP_REDUCE_MIN_ENTRIES} entries (default: auto)'
+    )
+    parser.add_argument(
+        '--research-db',
+        type=str,
+        default=DEFAULT_STORE_PATH,
+        help=f'SQLite store of research entries reused across overlapping queries (default: {DEFAULT_STORE_PATH})'
+    )
+    parser.add_argument(
+        '--research-max-age',
+        type=float,
+        default=DEFAULT_MAX_AGE_DAYS,
+        help=f'Days before stored research entries are no longer reused (default: {DEFAULT_MAX_AGE_DAYS})'
+    )
+    parser.add_argument(
+        '--no-research-store',
+        action='store_true',
+        help='Always run the web search and do not store its entries'
+    )
+    parser.add_argument(
+        '--context-cache-ttl',
+        type=float,
+        default=DEFAULT_CONTEXT_TTL_MINUTES,
+        help=f'Minutes the static stage instructions stay in the Gemini context cache, extended while in use (default: {DEFAULT_CONTEXT_TTL_MINUTES})'
+    )
+    parser.add_argument(
+        '--no-context-cache',
+        action='store_true',
+        help='Send the static stage instructions with every call instead of caching them'
+    )
+    parser.add_argument(
+        '--routing',
+        type=str,
+        metavar='FILE',
+        help='JSON file of per-stage candidate models, generation settings and latency/failure SLOs (default: built-in policy)'
+    )
+    parser.add_argument(
+        '--routing-log',
+        type=str,
+        metavar='FILE',
+        help='Append routing decisions and call outcomes to FILE as JSON lines; earlier outcomes seed the policy'
+    )
+    parser.add_argument(
+        '--no-routing',
+        action='store_true',
+        help=f'Run every stage on {MODEL_ID} with default generation settings'
+    )
+    parser.add_argument(
+        '--rpm',
+        type=int,
+        help='Requests per minute allowed across all reports; calls wait their turn, later stages first (default: unlimited)'
+    )
+    parser.add_argument(
+        '--tpm',
+        type=int,
+        help='Estimated prompt tokens per minute allowed across all reports (default: unlimited)'
+    )
+    parser.add_argument(
+        '--max-retries',
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help=f'Retries per call after rate limits and transient errors, with exponential backoff (default: {DEFAULT_MAX_RETRIES})'
+    )
+    parser.add_argument(
+        '--http-max-connections',
+        type=int,
+        default=DEFAULT_MAX_CONNECTIONS,
+        help=f'HTTP connections to the Gemini API open at once, shared by all reports (default: {DEFAULT_MAX_CONNECTIONS})'
+    )
+    parser.add_argument(
+        '--http-keepalive',
+        type=int,
+        default=DEFAULT_MAX_KEEPALIVE,
+        help=f'Idle HTTP connections kept open for reuse (default: {DEFAULT_MAX_KEEPALIVE})'
+    )
+    parser.add_argument(
+        '--http-keepalive-expiry',
+        type=float,
+        default=DEFAULT_KEEPALIVE_SECONDS,
+        help=f'Seconds an idle HTTP connection is kept open (default: {DEFAULT_KEEPALIVE_SECONDS:g})'
+    )
+    parser.add_argument(
+        '--http-timeout',
+        type=float,
+        default=DEFAULT_TIMEOUT_SECONDS,
+        help=f'Seconds allowed to connect and for each read or write of a model call; timed out calls are retried (default: {DEFAULT_TIMEOUT_SECONDS:g})'
+    )
+    parser.add_argument(
+        '--record',
+        type=str,
+        metavar='FILE',
+        help='Save every model request, response, usage and timing to a compressed cassette FILE'
+    )
+    parser.add_argument(
+        '--replay',
+        type=str,
+        metavar='FILE',
+        help='Rerun the reports recorded in a cassette FILE from its saved responses, without network access'
+    )
+    parser.add_argument(
+        '--replay-timing',
+        action='store_true',
+        help='With --replay, make each call take as long as it did when recorded'
+    )
+    service = parser.add_argument_group('report service (main.py serve)')
+    service.add_argument('--host', type=str, default=DEFAULT_HOST, help=f'Address to listen on (default: {DEFAULT_HOST})')
+    service.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'Port to listen on (default: {DEFAULT_PORT})')
+    service.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f'Report jobs run at once (default: {DEFAULT_WORKERS})'
+    )
+    service.add_argument(
+        '--queue-size',
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help=f'Jobs allowed to wait for a worker before submissions are refused (default: {DEFAULT_QUEUE_SIZE})'
+    )
+    service.add_argument(
+        '--fake',
+        action='store_true',
+        help='Serve canned reports from the offline fake client; no API key needed'
+    )
+    
+    worker = parser.add_argument_group('warm worker (main.py worker)')
+    worker.add_argument(
+        '--socket',
+        type=str,
+        metavar='PATH',
+        default=DEFAULT_SOCKET_PATH,
+        help=f'Unix socket the worker listens on and --use-worker connects to (default: {DEFAULT_SOCKET_PATH})'
+    )
+    worker.add_argument(
+        '--processes',
+        type=int,
+        default=DEFAULT_PROCESSES,
+        help=f'Pre-forked processes waiting for jobs, each with everything loaded (default: {DEFAULT_PROCESSES})'
+    )
+    worker.add_argument(
+        '--use-worker',
+        action='store_true',
+        help='Hand this run to the warm worker on --socket; runs here if no worker answers'
+    )
     
-    args = parser.parse_args()
+    serve = argv[:1] == ["serve"]
+    run_as_worker = argv[:1] == ["worker"]
+    args = parser.parse_args(argv[1:] if serve or run_as_worker else argv)
     
+    if run_as_worker:
+        sys.exit(run_worker(main, args.socket, args.processes, args.template))
+    if args.use_worker and not serve and not in_worker:
+        code = hand_off(argv, args)
+        if code is not None:
+            sys.exit(code)
+    
+    from dotenv import load_dotenv
     load_dotenv()
     
-    if not os.getenv("GOOGLE_API_KEY"):
+    replay = None
+    if args.replay:
+        if args.record or serve:
+            print("Error: --replay cannot be combined with --record or serve.")
+            sys.exit(1)
+        try:
+            replay = ReplayClient(args.replay, args.replay_timing)
+        except Exception as e:
+            print(f"Error loading cassette {args.replay}: {e}")
+            sys.exit(1)
+        if replay.header.get("mode") not in ("single", "batch", "refresh"):
+            print(f"Error: {args.replay} was recorded by the report service and has no reports to replay.")
+            sys.exit(1)
+        for option, value in replay.header.get("options", {}).items():
+            if option in CASSETTE_OPTIONS:
+                setattr(args, option, value)
+    
+    if not (serve and args.fake) and replay is None and not os.getenv("GOOGLE_API_KEY"):
         print("Error: Google API key not found. Please set the GOOGLE_API_KEY environment variable.")
         print("Create a .env file with the following content: GOOGLE_API_KEY=your_api_key_here")
         sys.exit(1)
     
-    if args.query:
-        high_level_query = args.query
-    elif args.example:
-        high_level_query = "What are the key players in the Esports Industry?"
-        print(f"Using example query: \"{high_level_query}\"")
-    else:
-        print("No query provided. Please enter your business query below:")
-        high_level_query = input("> ")
-        
-        if not high_level_query.strip():
-            print("No query entered. Using default example query.")
-            high_level_query = "What are the key players in the Esports Industry?"
+    # Cached stage results and stored research would skip calls, leaving
+    # gaps in a recording or calls a replay does not expect.
+    if args.record or args.replay:
+        args.no_cache = args.no_research_store = True
+        print("Stage cache and research store are not used while recording or replaying.")
+    
+    cache = None
+    if not args.no_cache:
+        cache = StageCache(args.cache_dir, args.cache_ttl, args.cache_max_mb)
+    
+    research_store = None
+    if not args.no_research_store:
+        try:
+            research_store = ResearchStore(args.research_db, args.research_max_age)
+        except Exception as e:
+            print(f"Research store unavailable, searching every time: {e}")
+    
+    CLIENTS.configure(
+        max_connections=args.http_max_connections,
+        max_keepalive=args.http_keepalive,
+        keepalive_seconds=args.http_keepalive_expiry,
+        timeout_seconds=args.http_timeout,
+    )
+    tracer = Tracer() if args.trace or args.profile else None
+    scheduler = CallScheduler(args.rpm, args.tpm, args.max_retries)
+    context_cache = None if args.no_context_cache else ContextCache(args.context_cache_ttl)
+    
+    router = None
+    if not args.no_routing:
+        try:
+            routing = load_routing(args.routing) if args.routing else None
+        except Exception as e:
+            print(f"Error loading routing file {args.routing}: {e}")
+            sys.exit(1)
+        # A replay's outcomes say nothing about the live models, so they are
+        # not logged.
+        router = ModelRouter(routing, MODEL_ID, None if replay else args.routing_log)
+    
+    template = None
+    if args.template:
+        from templates import load_template
+        try:
+            template = load_template(args.template)
+        except Exception as e:
+            print(f"Error loading template {args.template}: {e}")
+            sys.exit(1)
+    
+    report_options = {
+        "cache": cache,
+        "stream": args.stream,
+        "fast": args.fast,
+        "max_repairs": args.max_repairs,
+        "tracer": tracer,
+        "backend": args.backend,
+        "formats": tuple(args.formats),
+        "template": template,
+        "research_store": research_store,
+        "research_budget": args.research_budget,
+        "analysis_mode": args.analysis_mode,
+        "fan_out": args.fan_out,
+        "scheduler": scheduler,
+        "context_cache": context_cache,
+        "router": router,
+    }
+    
+    mode = "serve" if serve else "refresh" if args.refresh else "batch" if args.batch else "single"
+    queries, previous = [], None
+    if replay is not None:
+        mode = replay.header["mode"]
+        queries = replay.header.get("queries", [])
+        previous = replay.header.get("previous")
+        print(f"Replaying {len(replay.interactions)} recorded calls for {len(queries)} report(s) from {args.replay}")
+    elif mode == "refresh":
+        previous = load_previous(args.refresh)
+        queries = [previous["query"]]
+    elif mode == "batch":
+        queries = read_queries(args.batch)
+    elif mode == "single":
+        queries = [resolve_query(args)]
+    
+    client = replay
+    if serve:
+        if args.fake:
+            from fake_client import FakeGeminiClient
+            client = FakeGeminiClient(latency=0.5, jitter=0.25)
+    
+    cassette = None
+    if args.record:
+        header = {
+            "mode": mode,
+            "queries": queries,
+            "options": {option: getattr(args, option) for option in CASSETTE_OPTIONS},
+        }
+        if previous is not None:
+            header["previous"] = previous
+        cassette = CassetteWriter(args.record, header)
+        client = RecordingClient(client or create_client(), cassette)
+    
+    try:
+        if serve:
+            run_service(client, args.host, args.port, args.workers, args.queue_size, **report_options)
+        elif mode == "refresh":
+            run_refresh(args, previous, {**report_options, "client": client})
+        elif mode == "batch":
+            asyncio.run(run_batch_async(
+                queries, args.output_dir, args.concurrency, client,
+                args.render_workers, args.render_queue, **report_options
+            ))
+        else:
+            generate_report(queries[0], args.output, client=client, **report_options)
+    finally:
+        if context_cache is not None:
+            context_cache.close()
+        if cassette is not None:
+            cassette.close()
+            print(f"Cassette written: {cassette.path} ({cassette.count} calls)")
     
-    generate_report(high_level_query, args.output)
+    if tracer is not None:
+        if args.trace:
+            print(f"Trace written: {tracer.export_jsonl(args.trace)}")
+        if args.profile:
+            print(tracer.format_summary())
+            print(scheduler.format_stats())
+            if context_cache is not None:
+                print(context_cache.format_stats())
+            if router is not None:
+                print(router.format_stats())
+            if replay is not None:
+                print(replay.format_stats())
+            elif not args.fake:
+                print(CLIENTS.format_stats())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
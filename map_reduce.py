@@ -0,0 +1,72 @@
+from research_store import normalize_title, RESEARCH_CATEGORIES
+
+ANALYSIS_MODES = ("auto", "single", "map-reduce")
+ANALYSIS_CHUNK_ENTRIES = 40
+# In auto mode, research sets larger than this are analyzed in chunks.
+MAP_REDUCE_MIN_ENTRIES = 80
+
+
+def use_map_reduce(research, analysis_mode="auto"):
+    if analysis_mode == "map-reduce":
+        return True
+    return analysis_mode == "auto" and len(research) > MAP_REDUCE_MIN_ENTRIES
+
+
+def chunk_research(entries, chunk_entries=ANALYSIS_CHUNK_ENTRIES):
+    # Splits by category first, then by size, so each chunk is a coherent
+    # slice the analysis can summarize on its own.
+    groups = {}
+    for entry in entries:
+        groups.setdefault(entry.get("category") or "Other", []).append(entry)
+
+    order = [category for category in RESEARCH_CATEGORIES if category in groups]
+    order += [category for category in groups if category not in order]
+
+    chunk_entries = max(1, chunk_entries)
+    chunks = []
+    for category in order:
+        group = groups[category]
+        parts = [group[start:start + chunk_entries] for start in range(0, len(group), chunk_entries)]
+        for number, part in enumerate(parts, start=1):
+            label = f"{category} entries" if len(parts) == 1 else f"{category} entries, part {number} of {len(parts)}"
+            chunks.append((label, part))
+    return chunks
+
+
+def _unique_strings(*lists):
+    seen = {}
+    for items in lists:
+        for item in items or []:
+            seen.setdefault(normalize_title(item), item)
+    return list(seen.values())
+
+
+def merge_partial_analyses(partials):
+    # Concatenates the chunk analyses and folds exact repeats together, so the
+    # merge call only has to consolidate findings that overlap in substance.
+    trends = {}
+    competitors = {}
+    insights = {}
+    for partial in partials:
+        for trend in partial.get("trends", []):
+            if isinstance(trend, dict):
+                trends.setdefault(normalize_title(trend.get("title", "")), trend)
+        for competitor in partial.get("competitive_landscape", []):
+            if not isinstance(competitor, dict):
+                continue
+            key = normalize_title(competitor.get("name", ""))
+            known = competitors.get(key)
+            if known is None:
+                competitors[key] = dict(competitor)
+                continue
+            known["strengths"] = _unique_strings(known.get("strengths"), competitor.get("strengths"))
+            known["weaknesses"] = _unique_strings(known.get("weaknesses"), competitor.get("weaknesses"))
+        for insight in partial.get("insights", []):
+            if isinstance(insight, dict):
+                key = (normalize_title(insight.get("market", "")), normalize_title(insight.get("finding", "")))
+                insights.setdefault(key, insight)
+    return {
+        "trends": list(trends.values()),
+        "competitive_landscape": list(competitors.values()),
+        "insights": list(insights.values()),
+    }
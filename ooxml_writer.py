@@ -0,0 +1,319 @@
+import io
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+from docx import Document
+from templates import load_template
+from report_ir import Heading, Paragraph, ListItem, compile_block, FALLBACK_LIST_ITEM
+from docx_converter import CODE_FONT, HYPERLINK_COLOR
+
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS_PART = "word/_rels/document.xml.rels"
+HYPERLINK_RELATIONSHIP = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink"
+SPOOL_BYTES = 1024 * 1024
+
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_RUN_BREAKS = re.compile(r'([\t\r\n])')
+_RELATIONSHIP_ID = re.compile(r'Id="rId(\d+)"')
+
+
+class OoxmlTemplate:
+    # The package parts of a report template, split so that only
+    # word/document.xml and its relationships are written per report.
+
+    def __init__(self, report_template):
+        self.report_template = report_template
+        self.parts = []
+        with zipfile.ZipFile(io.BytesIO(report_template.package_bytes())) as package:
+            for info in package.infolist():
+                self.parts.append((info.filename, package.read(info)))
+
+        parts = dict(self.parts)
+        document_xml = parts[DOCUMENT_PART].decode('utf-8')
+        # Blocks go after any content the template already has, right before
+        # the body-level section properties.
+        section_start = document_xml.rindex('<w:sectPr')
+        self.document_head = document_xml[:section_start].encode('utf-8')
+        self.document_tail = document_xml[section_start:].encode('utf-8')
+
+        self.relationships = parts[DOCUMENT_RELS_PART].decode('utf-8')
+        ids = [int(rid) for rid in _RELATIONSHIP_ID.findall(self.relationships)]
+        self.next_relationship_id = max(ids, default=0) + 1
+
+
+_ooxml_templates = weakref.WeakKeyDictionary()
+_ooxml_templates_lock = threading.Lock()
+
+
+def ooxml_template(report_template=None):
+    if report_template is None:
+        report_template = load_template()
+    with _ooxml_templates_lock:
+        template = _ooxml_templates.get(report_template)
+        if template is None:
+            template = OoxmlTemplate(report_template)
+            _ooxml_templates[report_template] = template
+        return template
+
+
+def _text_xml(text):
+    # Mirrors python-docx: tabs become <w:tab/>, line breaks <w:br/>.
+    parts = []
+    for piece in _RUN_BREAKS.split(text):
+        if not piece:
+            continue
+        if piece == '\t':
+            parts.append('<w:tab/>')
+        elif piece in '\r\n':
+            parts.append('<w:br/>')
+        elif len(piece.strip()) < len(piece):
+            parts.append(f'<w:t xml:space="preserve">{escape(piece)}</w:t>')
+        else:
+            parts.append(f'<w:t>{escape(piece)}</w:t>')
+    return ''.join(parts)
+
+
+def _run_xml(text, bold=False, italic=False, font=None):
+    properties = []
+    if font:
+        properties.append(f'<w:rFonts w:ascii={quoteattr(font)} w:hAnsi={quoteattr(font)}/>')
+    if bold:
+        properties.append('<w:b/>')
+    if italic:
+        properties.append('<w:i/>')
+    run_properties = f"<w:rPr>{''.join(properties)}</w:rPr>" if properties else ''
+    return f'<w:r>{run_properties}{_text_xml(text)}</w:r>'
+
+
+def _check_text(text):
+    if _INVALID_XML_CHARS.search(text):
+        raise ValueError("All strings must be XML compatible")
+    return text
+
+
+class OoxmlBuilder:
+    # Streams document.xml to a spooled temporary file one block at a time,
+    # so memory stays flat no matter how many blocks a report has.
+
+    def __init__(self, template=None):
+        self.template = ooxml_template(template)
+        self.block_count = 0
+        self._body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, mode='w+b')
+        self._hyperlinks = {}
+
+    def _hyperlink_id(self, url):
+        relationship_id = self._hyperlinks.get(url)
+        if relationship_id is None:
+            relationship_id = f"rId{self.template.next_relationship_id + len(self._hyperlinks)}"
+            self._hyperlinks[url] = relationship_id
+        return relationship_id
+
+    def _paragraph_properties(self, style_id, justify):
+        style = f'<w:pStyle w:val="{style_id}"/>' if style_id else ''
+        alignment = '<w:jc w:val="both"/>' if justify else ''
+        if not style and not alignment:
+            return ''
+        return f'<w:pPr>{style}{alignment}</w:pPr>'
+
+    def _heading_xml(self, level, text):
+        style_id = self.template.report_template.heading_style_id(level)
+        run = _run_xml(_check_text(text)) if text else ''
+        return f'<w:p>{self._paragraph_properties(style_id, False)}{run}</w:p>'
+
+    def _markdown_runs_xml(self, runs):
+        if any(_INVALID_XML_CHARS.search(text_run.text) for text_run in runs):
+            return _run_xml("Text processing error")
+
+        parts = []
+        for text_run in runs:
+            if text_run.url:
+                parts.append(
+                    f'<w:hyperlink r:id="{self._hyperlink_id(text_run.url)}"><w:r><w:rPr>'
+                    f'<w:color w:val="{HYPERLINK_COLOR}"/><w:u w:val="single"/></w:rPr>'
+                    f'<w:t xml:space="preserve">{escape(text_run.text)}</w:t></w:r></w:hyperlink>'
+                )
+            else:
+                parts.append(_run_xml(
+                    text_run.text,
+                    bold=text_run.bold,
+                    italic=text_run.italic,
+                    font=CODE_FONT if text_run.code else None,
+                ))
+        return ''.join(parts)
+
+    def _paragraph_xml(self, runs, style_id=None):
+        return f'<w:p>{self._paragraph_properties(style_id, True)}{self._markdown_runs_xml(runs)}</w:p>'
+
+    def add_block(self, block):
+        if isinstance(block, dict):
+            self.block_count += 1
+        for node in compile_block(block):
+            self.add_node(node)
+
+    def add_node(self, node):
+        node_type = type(node)
+
+        if node_type is Heading:
+            try:
+                xml = self._heading_xml(node.level, node.text)
+            except Exception:
+                xml = self._heading_xml(1, "Heading")
+
+        elif node_type is Paragraph:
+            try:
+                xml = self._paragraph_xml(node.runs)
+            except Exception:
+                xml = '<w:p/>'
+
+        elif node_type is ListItem:
+            style_id = self.template.report_template.style_id("List Bullet")
+            try:
+                xml = self._paragraph_xml(node.runs, style_id)
+            except Exception:
+                xml = f'<w:p>{self._paragraph_properties(style_id, False)}{_run_xml(FALLBACK_LIST_ITEM)}</w:p>'
+
+        else:
+            return
+
+        self._body.write(xml.encode('utf-8'))
+
+    def _relationships_xml(self):
+        if not self._hyperlinks:
+            return self.template.relationships.encode('utf-8')
+        extra = ''.join(
+            f'<Relationship Id="{relationship_id}" Type="{HYPERLINK_RELATIONSHIP}" '
+            f'Target={quoteattr(url)} TargetMode="External"/>'
+            for url, relationship_id in self._hyperlinks.items()
+        )
+        return self.template.relationships.replace('</Relationships>', extra + '</Relationships>').encode('utf-8')
+
+    def _write(self, output_filename):
+        with zipfile.ZipFile(output_filename, 'w', zipfile.ZIP_DEFLATED) as package:
+            for name, data in self.template.parts:
+                if name == DOCUMENT_PART:
+                    with package.open(DOCUMENT_PART, 'w') as document:
+                        document.write(self.template.document_head)
+                        self._body.seek(0)
+                        shutil.copyfileobj(self._body, document)
+                        document.write(self.template.document_tail)
+                elif name == DOCUMENT_RELS_PART:
+                    package.writestr(name, self._relationships_xml())
+                else:
+                    package.writestr(name, data)
+
+    def save(self, output_filename="esports_report.docx"):
+        # The builder is finished once saved; its spooled body is released
+        # whether or not the document could be written.
+        try:
+            self._write(output_filename)
+            return output_filename
+        except Exception:
+            fallback_filename = "report_fallback.docx"
+            self._write(fallback_filename)
+            return fallback_filename
+        finally:
+            self.close()
+
+    def close(self):
+        self._body.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def describe_document(path):
+    doc = Document(path)
+    normal_font = doc.styles['Normal'].font
+    description = [("normal", normal_font.name, normal_font.size)]
+    for paragraph in doc.paragraphs:
+        content = []
+        for item in paragraph.iter_inner_content():
+            if hasattr(item, 'address'):
+                content.append(("link", item.address, item.text))
+            else:
+                font = item.font
+                content.append((
+                    item.text, item.bold, item.italic, font.name,
+                    font.color.rgb if font.color.type is not None else None, font.size,
+                ))
+        description.append((paragraph.style.name, paragraph.alignment, content))
+    return description
+
+
+def _canonical_part(path, part):
+    from lxml import etree
+    with zipfile.ZipFile(path) as package:
+        return etree.tostring(etree.fromstring(package.read(part)), method='c14n')
+
+
+def compare_documents(path_a, path_b):
+    description_a = describe_document(path_a)
+    description_b = describe_document(path_b)
+    differences = []
+    if len(description_a) != len(description_b):
+        differences.append(f"paragraph count differs: {len(description_a)} != {len(description_b)}")
+    for index, (a, b) in enumerate(zip(description_a, description_b)):
+        if a != b:
+            differences.append(f"paragraph {index} differs: {a!r} != {b!r}")
+    for part in (DOCUMENT_PART, DOCUMENT_RELS_PART, "word/styles.xml"):
+        if _canonical_part(path_a, part) != _canonical_part(path_b, part):
+            differences.append(f"{part} differs after XML canonicalization")
+    return differences
+
+
+def main():
+    import argparse
+    import os
+    from docx_converter import json_to_docx
+
+    parser = argparse.ArgumentParser(description='Check that the streaming writer matches python-docx')
+    parser.add_argument('--blocks', type=int, default=500, help='Size of the generated sample report')
+    args = parser.parse_args()
+
+    from fake_client import sample_report_blocks
+    cases = {
+        "edge cases": [
+            {"type": "heading", "level": 1, "text": "Edge **Cases** & <Escaping>"},
+            {"type": "heading", "level": 0, "text": "Title level"},
+            {"type": "heading", "level": 3, "text": ""},
+            {"type": "heading", "level": 12, "text": "Out of range"},
+            {"type": "paragraph", "text": "Tabs\tand\nbreaks, *italic*, `code`, ***both*** and [a link](https://example.com/?a=1&b=2)."},
+            {"type": "paragraph", "text": "  leading and trailing spaces  "},
+            {"type": "paragraph", "text": 42},
+            "not a block",
+            {"type": "unknown", "text": "ignored"},
+            {"type": "list", "items": [
+                "Regular item",
+                "Item with **bold text** and [the same link](https://example.com/?a=1&b=2)",
+                ["This", "is", "a", "list", "item"],
+                {"text": "This is a dict item", "value": 100},
+                {"value": 100},
+                None,
+            ]},
+        ],
+        f"{args.blocks} sample blocks": sample_report_blocks(args.blocks),
+    }
+
+    failed = False
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, blocks in cases.items():
+            reference = json_to_docx(blocks, os.path.join(output_dir, "reference.docx"), backend="docx")
+            streamed = json_to_docx(blocks, os.path.join(output_dir, "streamed.docx"), backend="stream")
+            differences = compare_documents(reference, streamed)
+            print(f"{name}: {'equivalent' if not differences else 'DIFFERENT'}")
+            for difference in differences[:10]:
+                print(f"  {difference}")
+            failed = failed or bool(differences)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1016 @@
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from prompts import (
+    INPUT_PROMPT,
+    ANALYSIS_PROMPT,
+    REPORT_PROMPT,
+    FAST_REPORT_PROMPT,
+    ANALYSIS_MAP_PROMPT,
+    ANALYSIS_REDUCE_PROMPT,
+    SECTION_ANALYSIS_PROMPT,
+    SECTION_REPORT_PROMPT,
+    format_input_prompt,
+    format_analysis_prompt,
+    format_report_prompt,
+    format_fast_research_prompt,
+    format_fast_report_prompt,
+    format_repair_prompt,
+    format_narrowed_research_prompt,
+    format_analysis_map_prompt,
+    format_analysis_reduce_prompt,
+    format_category_research_prompt,
+    format_section_analysis_prompt,
+    format_section_report_prompt,
+)
+from report_ir import compile_block, compile_report
+from renderers import render_ir, output_targets
+from report_json import (
+    BlockStreamParser,
+    ReportFormatError,
+    dump_json,
+    parse_research,
+    parse_analysis,
+    parse_partial_analysis,
+    parse_report_blocks,
+    section_analysis_parser,
+    section_report_parser,
+)
+from schemas import ANALYSIS_SCHEMA, PARTIAL_ANALYSIS_SCHEMA, REPORT_SCHEMA
+from instrumentation import NULL_TRACE
+from research_store import merge_entries, RESEARCH_CATEGORIES
+from compaction import compact_research, minify_json, DEFAULT_RESEARCH_BUDGET
+from map_reduce import chunk_research, merge_partial_analyses, use_map_reduce
+from refresh import (
+    changed_categories,
+    changed_sections,
+    section_headings,
+    report_title,
+    unplaced_sections,
+    patch_blocks,
+    save_report_state,
+    report_state_path,
+)
+from single_flight import SingleFlight, flight_key
+
+MODEL_ID = "gemini-2.0-flash"
+MAX_REPAIRS = 1
+# Reports for the same query and configuration that run at the same time
+# share one pipeline; each caller still renders its own document.
+IN_FLIGHT = SingleFlight()
+
+
+class StageCall:
+    def __init__(self, stage, contents, search=False, json_mode=False, schema=None, on_text=None, attempt=0,
+                 system=None, repair_of=None, fresh=False):
+        self.stage = stage
+        self.contents = contents
+        # Static instructions, sent as the system instruction or through the
+        # context cache; contents carries only the per-call payload.
+        self.system = system
+        # The call whose invalid output this one repairs.
+        self.repair_of = repair_of
+        # Model and generation settings, set when a router picks them.
+        self.route = None
+        self.search = search
+        self.json_mode = json_mode
+        self.schema = schema
+        # When set, the stage is streamed and every text chunk is passed here.
+        self.on_text = on_text
+        self.attempt = attempt
+        # Skips the stage cache lookup; the new result is still cached.
+        self.fresh = fresh
+
+    def config_key(self):
+        config = {"search": self.search, "json": self.json_mode, "schema": self.schema}
+        if self.system:
+            config["system"] = self.system
+        if self.route is not None and self.route.generation:
+            config["generation"] = self.route.generation
+        return config
+
+
+# google.genai and python-docx take most of a second to import, so they are
+# imported where a model call or a Word document first needs them, not when
+# the command line loads this module.
+@lru_cache(maxsize=None)
+def search_tools():
+    # Built once; every search stage sends the same tool.
+    from google.genai.types import Tool, GoogleSearch
+    return [Tool(google_search=GoogleSearch())]
+
+
+def stage_config(call, cached_content=None):
+    from google.genai.types import GenerateContentConfig
+    # A cached prompt replaces the inline system instruction.
+    system = {"cached_content": cached_content} if cached_content else {"system_instruction": call.system}
+    generation = call.route.generation if call.route is not None else {}
+    if call.search:
+        return GenerateContentConfig(
+            tools=search_tools(),
+            response_modalities=["TEXT"],
+            **generation,
+        )
+    if call.json_mode:
+        return GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=call.schema,
+            **system,
+            **generation,
+        )
+    if call.system or generation:
+        return GenerateContentConfig(**system, **generation)
+    return None
+
+
+class StreamingRenderer:
+    def __init__(self, trace=NULL_TRACE, backend="docx", template=None):
+        self.trace = trace
+        self.backend = backend
+        self.template = template
+        self.reset()
+
+    def reset(self):
+        from docx_converter import create_builder
+        self.builder = create_builder(self.backend, self.template)
+        # The compiled blocks, kept so other formats can be rendered from
+        # them once the stream is complete.
+        self.nodes = []
+        self.block_count = 0
+
+    def add_block(self, block):
+        start = time.perf_counter()
+        nodes = compile_block(block)
+        self.nodes.extend(nodes)
+        for node in nodes:
+            self.builder.add_node(node)
+        self.block_count += 1
+        self.trace.add_render_time(time.perf_counter() - start)
+        print(f"Rendered block {self.block_count}: {block.get('type')}")
+
+    def stream_blocks(self):
+        return BlockStreamParser(self.add_block).feed
+
+    def save(self, output_file):
+        return self.builder.save(output_file)
+
+
+def checked_stage(call, parse, renderer=None, max_repairs=MAX_REPAIRS):
+    # Runs a stage and validates its output; on failure only this stage is
+    # asked to repair its JSON, instead of rerunning the whole pipeline.
+    text = yield call
+    attempt = 0
+    last = call
+    while True:
+        try:
+            return parse(text)
+        except ReportFormatError as e:
+            if attempt >= max_repairs:
+                raise
+            attempt += 1
+            print(f"{e}. Requesting repair {attempt}/{max_repairs}...")
+            if renderer is not None:
+                renderer.reset()
+            last = StageCall(
+                f"{call.stage}_repair",
+                format_repair_prompt(call.stage, text, e.errors),
+                json_mode=True,
+                schema=call.schema,
+                on_text=renderer.stream_blocks() if renderer else None,
+                attempt=attempt,
+                repair_of=last,
+                fresh=call.fresh,
+            )
+            text = yield last
+
+
+def parallel_stages(stages):
+    # Runs several stage generators side by side: their pending calls are
+    # yielded together as a list, which the drivers issue concurrently.
+    # Repairs of one stage do not hold back the others' results.
+    results = [None] * len(stages)
+    pending = {}
+    for index, stage in enumerate(stages):
+        try:
+            pending[index] = next(stage)
+        except StopIteration as stop:
+            results[index] = stop.value
+    while pending:
+        indexes = list(pending)
+        texts = yield [pending[index] for index in indexes]
+        for index, text in zip(indexes, texts):
+            try:
+                pending[index] = stages[index].send(text)
+            except StopIteration as stop:
+                results[index] = stop.value
+                del pending[index]
+    return results
+
+
+def stored_research(query, research_store):
+    if research_store is None:
+        return None
+    coverage = research_store.coverage(query)
+    if coverage.complete:
+        print(f"Using {len(coverage.entries)} stored research entries; skipping web search")
+    elif coverage.entries:
+        print(f"Found {len(coverage.entries)} stored research entries; "
+              f"narrowing web search to {', '.join(coverage.missing_categories)}")
+    return coverage
+
+
+def optional_stage(stage, fallback=None):
+    # Lets one of several parallel stages fail validation without failing
+    # the report; its result is replaced by the fallback.
+    try:
+        return (yield from stage)
+    except ReportFormatError as e:
+        print(f"{e}. Continuing without it.")
+        return fallback
+
+
+def fan_out_search(research_prompt, categories, max_repairs=MAX_REPAIRS, fresh=False):
+    # One grounded search per category, issued concurrently: shorter calls
+    # that each dig deeper into their category than a single search does.
+    print(f"Searching {len(categories)} categories concurrently: {', '.join(categories)}")
+    results = yield from parallel_stages([
+        optional_stage(checked_stage(
+            StageCall(
+                f"research_{category.lower()}",
+                format_category_research_prompt(research_prompt, category),
+                search=True,
+                fresh=fresh,
+            ),
+            parse_research,
+            max_repairs=max_repairs,
+        ), [])
+        for category in categories
+    ])
+    research = merge_entries(*results)
+    if not research:
+        raise ReportFormatError("research", ["no research entries from any category search"])
+    return research
+
+
+def search_stage(query, research_prompt, coverage=None, research_store=None, max_repairs=MAX_REPAIRS,
+                 fan_out=False, fresh=False):
+    # Grounded search is the slowest call: when stored entries cover part of
+    # the query, only the thin categories are searched and the rest reused.
+    categories = list(RESEARCH_CATEGORIES)
+    if coverage is not None and coverage.entries:
+        categories = coverage.missing_categories
+        research_prompt = format_narrowed_research_prompt(
+            research_prompt,
+            coverage.missing_categories,
+            [entry.get("title") for entry in coverage.entries],
+        )
+    if fan_out:
+        research = yield from fan_out_search(research_prompt, categories, max_repairs, fresh)
+    else:
+        research = yield from checked_stage(
+            StageCall("research", research_prompt, search=True, fresh=fresh),
+            parse_research,
+            max_repairs=max_repairs,
+        )
+    if research_store is not None:
+        try:
+            research_store.add(query, research)
+        except Exception as e:
+            print(f"Could not store research entries: {e}")
+    if coverage is not None and coverage.entries:
+        research = merge_entries(coverage.entries, research)
+    return research
+
+
+def compacted_research(research, research_budget=DEFAULT_RESEARCH_BUDGET):
+    compaction = compact_research(research, research_budget)
+    print(compaction.describe())
+    return compaction.text
+
+
+def single_analysis(research, research_budget=DEFAULT_RESEARCH_BUDGET, max_repairs=MAX_REPAIRS):
+    return (yield from checked_stage(
+        StageCall(
+            "analysis",
+            format_analysis_prompt(compacted_research(research, research_budget)),
+            json_mode=True,
+            schema=ANALYSIS_SCHEMA,
+            system=ANALYSIS_PROMPT,
+        ),
+        parse_analysis,
+        max_repairs=max_repairs,
+    ))
+
+
+def map_reduce_analysis(research, research_budget=DEFAULT_RESEARCH_BUDGET, max_repairs=MAX_REPAIRS):
+    # Chunks are analyzed concurrently into partial analyses and one merge
+    # call adds recommendations, so wall time stays flat as research grows.
+    # The token budget applies to each chunk instead of the whole set.
+    research = compact_research(research, 0).entries
+    chunks = chunk_research(research)
+    print(f"Analyzing {len(research)} entries in {len(chunks)} chunks concurrently...")
+    partials = yield from parallel_stages([
+        checked_stage(
+            StageCall(
+                "analysis_map",
+                format_analysis_map_prompt(compact_research(chunk, research_budget).text, label),
+                json_mode=True,
+                schema=PARTIAL_ANALYSIS_SCHEMA,
+                system=ANALYSIS_MAP_PROMPT,
+            ),
+            parse_partial_analysis,
+            max_repairs=max_repairs,
+        )
+        for label, chunk in chunks
+    ])
+
+    print("Merging chunk analyses...")
+    return (yield from checked_stage(
+        StageCall(
+            "analysis_reduce",
+            format_analysis_reduce_prompt(minify_json(merge_partial_analyses(partials))),
+            json_mode=True,
+            schema=ANALYSIS_SCHEMA,
+            system=ANALYSIS_REDUCE_PROMPT,
+        ),
+        parse_analysis,
+        max_repairs=max_repairs,
+    ))
+
+
+def research_stages(query, research_store=None, max_repairs=MAX_REPAIRS, fan_out=False, fresh=False):
+    # fresh searches the web again, bypassing stored research and cached
+    # stage results; the new entries are still stored.
+    coverage = None if fresh else stored_research(query, research_store)
+    if coverage is not None and coverage.complete:
+        return coverage.entries
+
+    print("Step 1/4: Generating search prompt...")
+    research_prompt = yield StageCall("input", format_input_prompt(query), system=INPUT_PROMPT, fresh=fresh)
+
+    print("Step 2/4: Performing web search and gathering data...")
+    return (yield from search_stage(
+        query, research_prompt, coverage, research_store, max_repairs, fan_out, fresh
+    ))
+
+
+def report_pipeline(query, renderer=None, max_repairs=MAX_REPAIRS, research_store=None,
+                    research_budget=DEFAULT_RESEARCH_BUDGET, analysis_mode="auto", fan_out=False, artifacts=None,
+                    fresh_research=False):
+    # artifacts, when given, receives the research and analysis the report
+    # was built from.
+    artifacts = {} if artifacts is None else artifacts
+    print(f"Starting research on: {query}")
+    research = artifacts["research"] = yield from research_stages(
+        query, research_store, max_repairs, fan_out, fresh_research
+    )
+    return (yield from analysis_report_stages(
+        research, renderer, max_repairs, research_budget, analysis_mode, artifacts
+    ))
+
+
+def analysis_report_stages(research, renderer=None, max_repairs=MAX_REPAIRS,
+                           research_budget=DEFAULT_RESEARCH_BUDGET, analysis_mode="auto", artifacts=None):
+    artifacts = {} if artifacts is None else artifacts
+    print("Step 3/4: Analyzing data...")
+    if use_map_reduce(research, analysis_mode):
+        analysis = yield from map_reduce_analysis(research, research_budget, max_repairs)
+    else:
+        analysis = yield from single_analysis(research, research_budget, max_repairs)
+    artifacts["analysis"] = analysis
+
+    print("Step 4/4: Finalizing report structure...")
+    return (yield from checked_stage(
+        StageCall(
+            "report",
+            format_report_prompt(dump_json(analysis)),
+            json_mode=True,
+            schema=REPORT_SCHEMA,
+            system=REPORT_PROMPT,
+            on_text=renderer.stream_blocks() if renderer else None,
+        ),
+        parse_report_blocks,
+        renderer,
+        max_repairs,
+    ))
+
+
+def fast_report_pipeline(query, renderer=None, max_repairs=MAX_REPAIRS, research_store=None,
+                         research_budget=DEFAULT_RESEARCH_BUDGET, fan_out=False, artifacts=None):
+    # Expands the query locally and merges analysis and report formatting
+    # into one call: two round trips instead of four.
+    artifacts = {} if artifacts is None else artifacts
+    print(f"Starting research on: {query}")
+    coverage = stored_research(query, research_store)
+    if coverage is not None and coverage.complete:
+        research = coverage.entries
+    else:
+        print("Step 1/2: Performing web search and gathering data...")
+        research = yield from search_stage(
+            query, format_fast_research_prompt(query), coverage, research_store, max_repairs, fan_out
+        )
+    artifacts["research"] = research
+
+    print("Step 2/2: Analyzing data and writing report...")
+    return (yield from checked_stage(
+        StageCall(
+            "analysis_report",
+            format_fast_report_prompt(compacted_research(research, research_budget)),
+            json_mode=True,
+            schema=REPORT_SCHEMA,
+            system=FAST_REPORT_PROMPT,
+            on_text=renderer.stream_blocks() if renderer else None,
+        ),
+        parse_report_blocks,
+        renderer,
+        max_repairs,
+    ))
+
+
+def refresh_pipeline(previous, max_repairs=MAX_REPAIRS, research_store=None,
+                     research_budget=DEFAULT_RESEARCH_BUDGET, fan_out=False, artifacts=None):
+    # Reruns research, then regenerates only the analysis and report
+    # sections whose research categories changed, and patches them into the
+    # previous block array. A report without stored analysis (e.g. from
+    # --fast) is regenerated in full.
+    artifacts = {} if artifacts is None else artifacts
+    query = previous["query"]
+    if not previous.get("analysis"):
+        print("Previous report has no stored analysis; regenerating it in full")
+        return (yield from report_pipeline(
+            query, None, max_repairs, research_store, research_budget, fan_out=fan_out, artifacts=artifacts,
+            fresh_research=True,
+        ))
+
+    # A refresh exists to pick up research that changed since the last run,
+    # so neither stored entries nor cached search results may answer it.
+    print(f"Refreshing report on: {query}")
+    research = artifacts["research"] = yield from research_stages(
+        query, research_store, max_repairs, fan_out, fresh=True
+    )
+    categories = changed_categories(previous["research"], research)
+    if not categories:
+        print("Research is unchanged; keeping the previous analysis and report")
+        artifacts["analysis"] = previous["analysis"]
+        artifacts["unchanged"] = True
+        return previous["blocks"]
+
+    sections = changed_sections(categories)
+    unplaced = unplaced_sections(previous["blocks"], sections)
+    if unplaced:
+        # Without exactly one section of each kind to replace, a patched
+        # report would duplicate or drop text; build it anew from the new
+        # research instead.
+        print(f"Previous report has no single {', '.join(unplaced)} section; rebuilding it in full")
+        return (yield from analysis_report_stages(research, None, max_repairs, research_budget, artifacts=artifacts))
+    print(f"Changed categories: {', '.join(categories)}; regenerating {', '.join(sections)}")
+    unchanged = {key: value for key, value in previous["analysis"].items() if key not in sections}
+    entries = [entry for entry in research if (entry.get("category") or "Other") in categories]
+
+    print("Step 3/4: Updating changed analysis sections...")
+    update = yield from checked_stage(
+        StageCall(
+            "analysis_refresh",
+            format_section_analysis_prompt(
+                compacted_research(entries, research_budget), sections, minify_json(unchanged)
+            ),
+            json_mode=True,
+            schema={
+                "type": "OBJECT",
+                "properties": {key: ANALYSIS_SCHEMA["properties"][key] for key in sections},
+                "required": sections,
+                "property_ordering": sections,
+            },
+            system=SECTION_ANALYSIS_PROMPT,
+        ),
+        section_analysis_parser(sections),
+        max_repairs=max_repairs,
+    )
+    analysis = artifacts["analysis"] = {**previous["analysis"], **update}
+
+    # The executive summary covers every section, so it is rewritten with
+    # them from the whole updated analysis.
+    print("Step 4/4: Rewriting the summary and changed report sections...")
+    try:
+        blocks = yield from checked_stage(
+            StageCall(
+                "report_refresh",
+                format_section_report_prompt(
+                    dump_json(analysis),
+                    section_headings(previous["blocks"], sections),
+                    report_title(previous["blocks"]),
+                ),
+                json_mode=True,
+                schema=REPORT_SCHEMA,
+                system=SECTION_REPORT_PROMPT,
+            ),
+            section_report_parser(len(sections)),
+            max_repairs=max_repairs,
+        )
+    except ReportFormatError as e:
+        # Sections are placed by their order, so output with the wrong
+        # number of them cannot be patched in.
+        print(f"{e}; rebuilding the report in full")
+        return (yield from analysis_report_stages(research, None, max_repairs, research_budget, artifacts=artifacts))
+    return patch_blocks(previous["blocks"], blocks, sections)
+
+
+def build_pipeline(query, renderer=None, fast=False, max_repairs=MAX_REPAIRS, research_store=None,
+                   research_budget=DEFAULT_RESEARCH_BUDGET, analysis_mode="auto", fan_out=False, previous=None,
+                   artifacts=None):
+    # The fast pipeline folds analysis into the report call, so it has no
+    # analysis stage to split.
+    if previous is not None:
+        return refresh_pipeline(previous, max_repairs, research_store, research_budget, fan_out, artifacts)
+    if fast:
+        return fast_report_pipeline(query, renderer, max_repairs, research_store, research_budget, fan_out, artifacts)
+    return report_pipeline(
+        query, renderer, max_repairs, research_store, research_budget, analysis_mode, fan_out, artifacts
+    )
+
+
+def cached_text(cache, model_id, call):
+    if cache is None:
+        return None, None
+    key = cache.key(model_id, call.stage, call.contents, call.config_key())
+    if call.fresh:
+        return key, None
+    text = cache.get(key)
+    if text is not None:
+        print(f"Using cached {call.stage} result")
+        if call.on_text is not None:
+            call.on_text(text)
+    return key, text
+
+
+def _generate(client, model_id, call, timing, config):
+    if call.on_text is None:
+        response = client.models.generate_content(
+            model=model_id,
+            contents=call.contents,
+            config=config,
+        )
+        timing.first_byte()
+        timing.usage(response.usage_metadata)
+        return response.text
+
+    parts = []
+    for chunk in client.models.generate_content_stream(
+        model=model_id,
+        contents=call.contents,
+        config=config,
+    ):
+        timing.first_byte()
+        if chunk.usage_metadata is not None:
+            timing.usage(chunk.usage_metadata)
+        if chunk.text:
+            parts.append(chunk.text)
+            call.on_text(chunk.text)
+    return "".join(parts)
+
+
+def call_model(client, model_id, call, timing, context_cache=None):
+    from google.genai import errors
+    cached_content = None
+    if context_cache is not None and call.system:
+        cached_content = context_cache.lookup(client, model_id, call.system)
+    try:
+        return _generate(client, model_id, call, timing, stage_config(call, cached_content))
+    except errors.ClientError as e:
+        if cached_content is None or e.code == 429:
+            raise
+        # The cache expired or was deleted elsewhere: send the prompt inline.
+        context_cache.invalidate(model_id, call.system)
+        return _generate(client, model_id, call, timing, stage_config(call))
+
+
+async def _generate_async(client, model_id, call, timing, config):
+    if call.on_text is None:
+        response = await client.aio.models.generate_content(
+            model=model_id,
+            contents=call.contents,
+            config=config,
+        )
+        timing.first_byte()
+        timing.usage(response.usage_metadata)
+        return response.text
+
+    parts = []
+    async for chunk in await client.aio.models.generate_content_stream(
+        model=model_id,
+        contents=call.contents,
+        config=config,
+    ):
+        timing.first_byte()
+        if chunk.usage_metadata is not None:
+            timing.usage(chunk.usage_metadata)
+        if chunk.text:
+            parts.append(chunk.text)
+            call.on_text(chunk.text)
+    return "".join(parts)
+
+
+async def call_model_async(client, model_id, call, timing, context_cache=None):
+    from google.genai import errors
+    cached_content = None
+    if context_cache is not None and call.system:
+        cached_content = await context_cache.lookup_async(client, model_id, call.system)
+    try:
+        return await _generate_async(client, model_id, call, timing, stage_config(call, cached_content))
+    except errors.ClientError as e:
+        if cached_content is None or e.code == 429:
+            raise
+        context_cache.invalidate(model_id, call.system)
+        return await _generate_async(client, model_id, call, timing, stage_config(call))
+
+
+def advance_pipeline(pipeline, done, value, cache=None):
+    # A stage result is only cached once the pipeline has accepted it, so a
+    # report that fails to parse is fetched again on the next run.
+    try:
+        next_call = pipeline.send(value)
+    except StopIteration:
+        _store_results(cache, done, True)
+        raise
+    except Exception:
+        _store_results(cache, done, False)
+        raise
+    _store_results(cache, done, True)
+    return next_call
+
+
+def _store_results(cache, done, accepted):
+    if cache is None:
+        return
+    for call, key, text in done:
+        if accepted:
+            cache.put(key, text, call.stage)
+        else:
+            cache.discard(key)
+
+
+def route_call(router, model_id, call):
+    # Picks the stage's model and generation settings; a repair also tells
+    # the router that the repaired call's output was invalid.
+    if router is None:
+        return model_id
+    if call.repair_of is not None and call.repair_of.route is not None:
+        router.record(call.repair_of.route, None, "invalid")
+    call.route = router.route(call.stage, model_id)
+    return call.route.model
+
+
+def _inline_system(context_cache, model_id, call):
+    return not (call.system and context_cache is not None and context_cache.serves(model_id, call.system))
+
+
+def _recorded(router, call, send):
+    if router is None:
+        return send
+
+    def recorded(each):
+        start = time.perf_counter()
+        try:
+            text = send(each)
+        except Exception:
+            router.record(call.route, time.perf_counter() - start, "error")
+            raise
+        router.record(call.route, time.perf_counter() - start, "ok")
+        return text
+
+    return recorded
+
+
+def _recorded_async(router, call, send):
+    if router is None:
+        return send
+
+    async def recorded(each):
+        start = time.perf_counter()
+        try:
+            text = await send(each)
+        except Exception:
+            router.record(call.route, time.perf_counter() - start, "error")
+            raise
+        router.record(call.route, time.perf_counter() - start, "ok")
+        return text
+
+    return recorded
+
+
+def execute_call(client, model_id, call, cache=None, trace=NULL_TRACE, scheduler=None, context_cache=None,
+                 router=None):
+    model_id = route_call(router, model_id, call)
+    timing = trace.stage(call.stage, model_id, call.attempt)
+    key, text = cached_text(cache, model_id, call)
+    cached = text is not None
+    retries = 0
+    if not cached:
+        send = _recorded(router, call, lambda each: call_model(client, model_id, each, timing, context_cache))
+        try:
+            if scheduler is None:
+                text = send(call)
+            else:
+                text, retries = scheduler.run(call, send, _inline_system(context_cache, model_id, call))
+        except Exception as e:
+            timing.finish("error", retries=getattr(e, "scheduler_retries", 0))
+            raise
+    timing.finish(cached=cached, retries=retries)
+    return call, key, text
+
+
+async def execute_call_async(client, model_id, call, cache=None, trace=NULL_TRACE, scheduler=None,
+                             context_cache=None, router=None):
+    model_id = route_call(router, model_id, call)
+    timing = trace.stage(call.stage, model_id, call.attempt)
+    key, text = cached_text(cache, model_id, call)
+    cached = text is not None
+    retries = 0
+    if not cached:
+        send = _recorded_async(
+            router, call, lambda each: call_model_async(client, model_id, each, timing, context_cache)
+        )
+        try:
+            if scheduler is None:
+                text = await send(call)
+            else:
+                text, retries = await scheduler.run_async(call, send, _inline_system(context_cache, model_id, call))
+        except Exception as e:
+            timing.finish("error", retries=getattr(e, "scheduler_retries", 0))
+            raise
+    timing.finish(cached=cached, retries=retries)
+    return call, key, text
+
+
+def run_pipeline(pipeline, client, model_id=MODEL_ID, cache=None, trace=NULL_TRACE, scheduler=None,
+                 context_cache=None, router=None):
+    try:
+        call = next(pipeline)
+        while True:
+            if isinstance(call, list):
+                # Independent calls from parallel_stages run side by side.
+                with ThreadPoolExecutor(max_workers=len(call)) as executor:
+                    done = list(executor.map(
+                        lambda each: execute_call(client, model_id, each, cache, trace, scheduler, context_cache, router), call
+                    ))
+                value = [text for _, _, text in done]
+            else:
+                done = [execute_call(client, model_id, call, cache, trace, scheduler, context_cache, router)]
+                value = done[0][2]
+            call = advance_pipeline(pipeline, done, value, cache)
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_pipeline_async(pipeline, client, model_id=MODEL_ID, cache=None, trace=NULL_TRACE,
+                             scheduler=None, context_cache=None, router=None):
+    try:
+        call = next(pipeline)
+        while True:
+            if isinstance(call, list):
+                done = await asyncio.gather(*[
+                    execute_call_async(client, model_id, each, cache, trace, scheduler, context_cache, router)
+                    for each in call
+                ])
+                value = [text for _, _, text in done]
+            else:
+                done = [await execute_call_async(client, model_id, call, cache, trace, scheduler, context_cache, router)]
+                value = done[0][2]
+            call = advance_pipeline(pipeline, done, value, cache)
+    except StopIteration as stop:
+        return stop.value
+
+
+def default_output_filename(query):
+    words = query.split()[:4]
+    base_name = "_".join(words).lower()
+    base_name = re.sub(r'[^\w\s-]', '', base_name).strip()
+    base_name = re.sub(r'[-\s]+', '_', base_name)
+    return f"{base_name}_report.docx"
+
+
+def create_client():
+    # The process-wide client, or the current event loop's when called from
+    # a coroutine; see client_pool.py.
+    from client_pool import CLIENTS
+    return CLIENTS.get()
+
+
+def _report_targets(query, output_file, formats):
+    return output_targets(default_output_filename(query) if output_file is None else output_file, formats)
+
+
+def _print_outputs(outputs):
+    for output_doc in outputs.values():
+        print(f"Report generated: {output_doc if isinstance(output_doc, str) else 'in memory'}")
+
+
+def render_report(query, report_json, output_file=None, renderer=None, trace=NULL_TRACE, backend="docx",
+                  template=None, formats=("docx",)):
+    # Returns {format: output}. The blocks are compiled once (or were as
+    # they streamed in) and every format is rendered from the same nodes.
+    targets = _report_targets(query, output_file, formats)
+
+    start = time.perf_counter()
+    ir = renderer.nodes if renderer is not None else compile_report(report_json)
+    outputs = {}
+    for fmt, target in targets.items():
+        if fmt == "docx" and renderer is not None:
+            outputs[fmt] = renderer.save(target)
+        else:
+            outputs[fmt] = render_ir(ir, target, fmt, backend, template)
+    trace.add_render_time(time.perf_counter() - start)
+    trace.finish("ok", len(report_json))
+    _print_outputs(outputs)
+    return outputs
+
+
+def _finish_pooled_render(report_json, outputs, seconds, trace):
+    trace.add_render_time(seconds)
+    trace.finish("ok", len(report_json))
+    _print_outputs(outputs)
+    return outputs
+
+
+def render_report_in_pool(query, report_json, output_file, render_pool, trace=NULL_TRACE, formats=("docx",)):
+    targets = _report_targets(query, output_file, formats)
+    try:
+        outputs, seconds = render_pool.render(report_json, targets)
+    except Exception:
+        trace.finish("render_failed", len(report_json))
+        raise
+    return _finish_pooled_render(report_json, outputs, seconds, trace)
+
+
+async def render_report_in_pool_async(query, report_json, output_file, render_pool, trace=NULL_TRACE,
+                                      formats=("docx",)):
+    targets = _report_targets(query, output_file, formats)
+    try:
+        outputs, seconds = await render_pool.render_async(report_json, targets)
+    except Exception:
+        trace.finish("render_failed", len(report_json))
+        raise
+    return _finish_pooled_render(report_json, outputs, seconds, trace)
+
+
+def _flight_key(query, fast, max_repairs, research_budget, analysis_mode, fan_out, previous, coalesce, router):
+    # A refresh depends on its previous report, so it is never shared.
+    # Callers with different routing policies (or none) would get reports
+    # from different models, so the policy is part of the key.
+    if not coalesce or previous is not None:
+        return None
+    policy = router.policy if router is not None else None
+    return flight_key(query, MODEL_ID, fast, max_repairs, research_budget, analysis_mode, fan_out, policy)
+
+
+def _unchanged_report(query, output_file, report_json, artifacts, trace, formats):
+    # A refresh whose research did not change leaves the existing documents
+    # untouched.
+    if not artifacts.get("unchanged"):
+        return None
+    targets = _report_targets(query, output_file, formats)
+    if not all(isinstance(target, str) and os.path.exists(target) for target in targets.values()):
+        return None
+    trace.finish("ok", len(report_json))
+    for target in targets.values():
+        print(f"Report unchanged: {target}")
+    return next(iter(targets.values()))
+
+
+def _store_report_state(query, outputs, report_json, artifacts):
+    # Returns the first format's output. The report data is stored next to
+    # the Word document, or the first output without one, unless that would
+    # overwrite a rendered file.
+    output_doc = next(iter(outputs.values()))
+    state_target = outputs.get("docx", output_doc)
+    if isinstance(state_target, str) and report_state_path(state_target) not in outputs.values():
+        try:
+            save_report_state(state_target, query, artifacts.get("research"), artifacts.get("analysis"), report_json)
+        except Exception as e:
+            print(f"Could not store report data for --refresh: {e}")
+    return output_doc
+
+
+def generate_report(query, output_file=None, client=None, cache=None, stream=False, fast=False,
+                    max_repairs=MAX_REPAIRS, tracer=None, backend="docx", template=None,
+                    render_pool=None, research_store=None,
+                    research_budget=DEFAULT_RESEARCH_BUDGET, analysis_mode="auto", fan_out=False,
+                    scheduler=None, context_cache=None, previous=None, coalesce=True, router=None,
+                    formats=("docx",)):
+    # previous is the stored state of an earlier report (see refresh.py);
+    # when given, only the sections whose research changed are regenerated.
+    if client is None:
+        client = create_client()
+
+    trace = tracer.start_report(query) if tracer else NULL_TRACE
+    # Blocks are rendered as they stream in only when rendering stays in
+    # this process; a render pool gets the finished block array instead.
+    # A refresh patches a finished block array, so it is never streamed.
+    # Only the Word document is streamed; other formats are rendered from
+    # the streamed blocks once they are complete.
+    streamed = stream and render_pool is None and previous is None and "docx" in formats
+    renderer = StreamingRenderer(trace, backend, template) if streamed else None
+
+    def run():
+        artifacts = {}
+        pipeline = build_pipeline(
+            query, renderer, fast, max_repairs, research_store, research_budget, analysis_mode, fan_out,
+            previous, artifacts
+        )
+        report_json = run_pipeline(
+            pipeline, client, cache=cache, trace=trace, scheduler=scheduler, context_cache=context_cache,
+            router=router
+        )
+        return report_json, artifacts
+
+    key = _flight_key(
+        query, fast, max_repairs, research_budget, analysis_mode, fan_out, previous, coalesce, router
+    )
+    try:
+        if key is None:
+            report_json, artifacts = run()
+        else:
+            (report_json, artifacts), joined = IN_FLIGHT.do(key, run)
+            if joined:
+                print(f"Shared the in-flight pipeline of an identical query: {query}")
+                renderer = None
+    except ReportFormatError as e:
+        print(f"Error parsing JSON: {e}")
+        trace.finish("failed")
+        return None
+    except Exception:
+        trace.finish("error")
+        raise
+
+    unchanged = _unchanged_report(query, output_file, report_json, artifacts, trace, formats)
+    if unchanged is not None:
+        return unchanged
+    if render_pool is not None:
+        outputs = render_report_in_pool(query, report_json, output_file, render_pool, trace, formats)
+    else:
+        outputs = render_report(query, report_json, output_file, renderer, trace, backend, template, formats)
+    return _store_report_state(query, outputs, report_json, artifacts)
+
+
+async def generate_report_async(query, output_file=None, client=None, cache=None, stream=False, fast=False,
+                                max_repairs=MAX_REPAIRS, tracer=None, backend="docx", template=None,
+                                render_pool=None, research_store=None,
+                                research_budget=DEFAULT_RESEARCH_BUDGET, analysis_mode="auto", fan_out=False,
+                                scheduler=None, context_cache=None, previous=None, coalesce=True, router=None,
+                                formats=("docx",)):
+    if client is None:
+        client = create_client()
+
+    trace = tracer.start_report(query) if tracer else NULL_TRACE
+    streamed = stream and render_pool is None and previous is None and "docx" in formats
+    renderer = StreamingRenderer(trace, backend, template) if streamed else None
+
+    async def run():
+        artifacts = {}
+        pipeline = build_pipeline(
+            query, renderer, fast, max_repairs, research_store, research_budget, analysis_mode, fan_out,
+            previous, artifacts
+        )
+        report_json = await run_pipeline_async(
+            pipeline, client, cache=cache, trace=trace, scheduler=scheduler, context_cache=context_cache,
+            router=router
+        )
+        return report_json, artifacts
+
+    key = _flight_key(
+        query, fast, max_repairs, research_budget, analysis_mode, fan_out, previous, coalesce, router
+    )
+    try:
+        if key is None:
+            report_json, artifacts = await run()
+        else:
+            (report_json, artifacts), joined = await IN_FLIGHT.do_async(key, run)
+            if joined:
+                print(f"Shared the in-flight pipeline of an identical query: {query}")
+                renderer = None
+    except ReportFormatError as e:
+        print(f"Error parsing JSON: {e}")
+        trace.finish("failed")
+        return None
+    except Exception:
+        trace.finish("error")
+        raise
+
+    unchanged = _unchanged_report(query, output_file, report_json, artifacts, trace, formats)
+    if unchanged is not None:
+        return unchanged
+    if render_pool is not None:
+        outputs = await render_report_in_pool_async(
+            query, report_json, output_file, render_pool, trace, formats
+        )
+    else:
+        # Building documents is CPU-bound; on a thread it does not stall the
+        # other reports sharing this event loop (and is done with the
+        # streamed blocks by now).
+        outputs = await asyncio.to_thread(
+            render_report, query, report_json, output_file, renderer, trace, backend, template, formats
+        )
+    return _store_report_state(query, outputs, report_json, artifacts)
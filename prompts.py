@@ -1,3 +1,5 @@
+from datetime import date
+
 INPUT_PROMPT = """
 Your goal is to **transform** a high-level business query into a **complete, structured prompt** that a downstream LLM can immediately consume to research and collect relevant data on a specific market or company. Said research must look for key players, trends, competitors, and other relevant information.
 
@@ -81,12 +83,12 @@ Use clear headings, numbered lists, and imperative verbs. The final prompt shoul
 > **Desired Deliverable:**  
 > A **JSON array** of research entries, where each entry has:  
 > ```json
-> {{
+> {
 >   "category": "Trend | Competitor | Insight | Partnership",
 >   "title": "Short descriptive title",
 >   "summary": "2–3 sentence summary of finding",
->   "metrics": {{ /* if applicable, e.g. adoption rates, user counts */ }}
-> }}
+>   "metrics": { /* if applicable, e.g. adoption rates, user counts */ }
+> }
 > ```  
 > This raw dataset will be passed to a downstream analysis LLM.  
 >  
@@ -142,13 +144,7 @@ Comprehensive but **concise**—aim for a single prompt block of 150–300 words
 
 **DELIMITERS FOR BUSINESS QUERY:**
 
-All user input goes between:
-```
-
-<QUERY>
-{high_level_query}
-</QUERY>
-```
+The user's business query is the text between the `<QUERY>` and `</QUERY>` delimiters of the message.
 
 **EVALUATION CRITERIA:**
 
@@ -167,12 +163,12 @@ After generating, ensure the prompt is:
 A **JSON array** of research entries, exactly as below, with **no** additional text around it:
 ```json
 [
-  {{
+  {
     "category": "Trend | Competitor | Insight | Partnership",
     "title": "Short descriptive title",
     "summary": "2–3 sentence summary of finding",
-    "metrics": {{ /* optional numeric data */ }}
-  }},
+    "metrics": { /* optional numeric data */ }
+  },
   …
 ]
 """
@@ -192,38 +188,38 @@ Act as an **Expert Business Data Analyst**. You excel at taking raw market data
 Output a **single JSON object** with exactly these four top-level keys (and no other fields):
 
 ```json
-{{
+{
   "trends": [
-    {{
+    {
       "title": "Concise trend headline",
       "details": "2-3 sentence summary with key metrics"
-    }},
+    },
     …
   ],
   "competitive_landscape": [
-    {{
+    {
       "name": "Competitor name",
       "positioning": "How they differentiate",
       "strengths": [ "…", … ],
       "weaknesses": [ "…", … ]
-    }},
+    },
     …
   ],
   "insights": [
-    {{
+    {
       "market": "Country or segment",
       "finding": "2-3 sentence summary of consumer/market behavior"
-    }},
+    },
     …
   ],
   "recommendations": [
-    {{
+    {
       "action": "Short imperative recommendation",
       "rationale": "1-2 sentences linking back to trends/insights"
-    }},
+    },
     …
   ]
-}}
+}
 ```
 
 **OUTPUT CONSTRAINTS:**
@@ -272,28 +268,253 @@ Act as an **Expert Business Report Writer** who can fuse technical precision wit
 
 **OUTPUT FORMAT:**
 Return a JSON array of block objects. Each block must be one of:
-- `{{ "type": "heading", "level": <1-3>, "text": "<heading text>" }}`
-- `{{ "type": "paragraph", "text": "<body text>" }}`
-- `{{ "type": "list", "items": ["item1", "item2", …] }}`
+- `{ "type": "heading", "level": <1-3>, "text": "<heading text>" }`
+- `{ "type": "paragraph", "text": "<body text>" }`
+- `{ "type": "list", "items": ["item1", "item2", …] }`
 
 Blocks should appear in document order. Do **not** include any other keys or narrative.
 """
 
+FAST_RESEARCH_PROMPT = """
+**Purpose & Objective:**
+Conduct comprehensive web research to identify market trends, key players, consumer insights, and opportunities relevant to the following business query:
+
+<QUERY>
+{high_level_query}
+</QUERY>
+
+**Key Questions & Scope:**
+1. What are the top 5–7 emerging trends in this market?
+2. Who are the leading companies, brands, and suppliers?
+3. What consumer segments show highest growth potential or are underserved?
+4. Which influencers, organizations, or brands could be strategic partners?
+
+**Data & Resources:**
+Use Google Search with targeted queries built from the query above (e.g., "<market> trends {previous_year}–{current_year}," "top <market> companies {previous_year}").
+Prioritize reputable sources: industry reports, news outlets, company blogs, and app store pages.
+
+**Constraints & Assumptions:**
+Time window: data from the last 24 months.
+
+**Step-by-Step Guidance:**
+1. **Search for Trends:** extract the top 5 trends; category "Trend."
+2. **Identify Competitors:** for each competitor give name, pricing tiers, unique features, estimated user base; category "Competitor."
+3. **Gather Consumer Insights:** summarize 3 insights per market from surveys and reviews; category "Insight."
+4. **Map Partnership Opportunities:** list organizations or influencers with a description; category "Partnership."
+5. **Assemble JSON Output:** combine all entries into a single JSON array with consistent field names.
+
+**Desired Deliverable:**
+A **JSON array** of research entries, exactly as below, with **no** additional text around it:
+```json
+[
+  {{
+    "category": "Trend | Competitor | Insight | Partnership",
+    "title": "Short descriptive title",
+    "summary": "2–3 sentence summary of finding",
+    "metrics": {{ /* optional numeric data */ }}
+  }},
+  …
+]
+```
+Do **not** wrap your output in code fences, headings, or paragraphs, and do **not** include any analysis or narrative.
+"""
+
+FAST_ANALYSIS_GUIDE = """
+**TASK DEFINITION:**
+Your goal is to turn the raw research JSON in `<DATA>` directly into an executive report. Analyze the data internally, then emit **only** the report blocks described below.
+
+**ANALYSIS GUIDE (internal reasoning only, do not output):**
+1. **Group** entries by `"category"`.
+2. **Synthesize Trends:** consolidate similar Trend entries into 4–6 headline trends with key metrics.
+3. **Map Competitors:** for each Competitor entry, extract positioning, strengths, and weaknesses.
+4. **Aggregate Insights:** list 3–5 key consumer/market insights across regions.
+5. **Formulate Recommendations:** craft 4–6 strategic actions directly tied to the trends and insights.
+"""
+
+CATEGORY_FOCUS = {
+    "Trend": "emerging market trends, with adoption and growth metrics",
+    "Competitor": "leading companies, brands and suppliers, with pricing tiers, unique features and estimated user base",
+    "Insight": "consumer segments and market behavior, from surveys, reviews and regional data",
+    "Partnership": "organizations, influencers and brands that could be strategic partners",
+}
+
+CATEGORY_RESEARCH_PROMPT = """
+**SEARCH FOCUS:**
+This search is one of several running in parallel, one per category. Cover **only** {category} entries: {focus}.
+Aim for 5–8 well-sourced entries, each with `"category": "{category}"`, in the same JSON array format.
+"""
+
+ANALYSIS_MAP_PROMPT = """
+**TASK DEFINITION:**
+The `<DATA>` JSON array is **one chunk** of a larger research set, described in `<CHUNK>`. Analyze only this chunk and produce a partial analysis; other chunks are analyzed separately and merged afterwards.
+
+**ROLE PROMPT:**
+Act as an **Expert Business Data Analyst**.
+
+**FORMAT SPECIFICATION:**
+Output a **single JSON object** with exactly these three top-level keys (and no other fields):
+
+```json
+{
+  "trends": [ { "title": "Concise trend headline", "details": "2-3 sentence summary with key metrics" } ],
+  "competitive_landscape": [ { "name": "Competitor name", "positioning": "How they differentiate", "strengths": [ "…" ], "weaknesses": [ "…" ] } ],
+  "insights": [ { "market": "Country or segment", "finding": "2-3 sentence summary of consumer/market behavior" } ]
+}
+```
+
+Use an empty array for a key the chunk has no data for. Keep every metric and `"source_url"` from the entries you use. Do **not** add recommendations, code fences, or narrative.
+"""
+
+ANALYSIS_REDUCE_PROMPT = """
+**TASK DEFINITION:**
+The `<PARTIAL_ANALYSES>` JSON object combines partial analyses of separate chunks of one research set. Merge them into the final analysis:
+1. **Consolidate** duplicate or overlapping trends into 4–6 headline trends.
+2. **Merge** competitor entries that describe the same company.
+3. **Keep** the 3–5 most important insights.
+4. **Formulate** 4–6 strategic recommendations tied to the merged trends and insights.
+
+**FORMAT SPECIFICATION:**
+Output a **single JSON object** with exactly the keys `"trends"`, `"competitive_landscape"`, `"insights"` and `"recommendations"`, using the same item fields as the partial analyses; each recommendation has `"action"` and `"rationale"`.
+
+Preserve metrics and sources. Do **not** add code fences or narrative.
+"""
+
+SECTION_ANALYSIS_PROMPT = """
+**TASK DEFINITION:**
+An existing analysis is being refreshed with new research. The `<DATA>` JSON array holds the current research entries of the categories that changed since the last run. Produce updated versions of **only** the analysis sections listed in `<SECTIONS>`. The sections in `<CURRENT_ANALYSIS>` did not change and are given for context.
+
+**ROLE PROMPT:**
+Act as an **Expert Business Data Analyst**.
+
+**FORMAT SPECIFICATION:**
+Output a **single JSON object** whose keys are exactly the section names in `<SECTIONS>`, with the same item fields as the full analysis:
+- `"trends"`: objects with `"title"` and `"details"` (4–6 headline trends)
+- `"competitive_landscape"`: objects with `"name"`, `"positioning"`, `"strengths"` and `"weaknesses"`
+- `"insights"`: objects with `"market"` and `"finding"` (3–5 insights)
+- `"recommendations"`: objects with `"action"` and `"rationale"` (4–6 actions tied to both the updated and the unchanged sections)
+
+Preserve metrics and sources. Do **not** add code fences or narrative.
+"""
+
+SECTION_REPORT_PROMPT = """
+**TASK DEFINITION:**
+An existing executive report is being refreshed. Start with the report title from `<TITLE>` as a level-1 heading, followed by a rewritten executive summary (paragraphs and lists only, no level-2 heading) that reflects the whole updated analysis in `<ANALYSIS_DATA>`. Then rewrite **only** the report sections listed in `<SECTIONS>`, in that order. Each section starts with a level-2 heading using exactly the heading text listed for it, followed by its paragraphs and lists; use level-3 headings for subsections. Do **not** write any other level-2 section, such as limitations.
+
+**STYLE:**
+Keep the report's style: open each section with a concise proposition ("We posit that…"), qualify statements with epistemic modals ("suggests," "indicates"), include numeric values where relevant, and report only factual findings.
+
+**OUTPUT FORMAT:**
+Return a JSON array of block objects. Each block must be one of:
+- `{ "type": "heading", "level": <2-3>, "text": "<heading text>" }`
+- `{ "type": "paragraph", "text": "<body text>" }`
+- `{ "type": "list", "items": ["item1", "item2", …] }`
+
+Blocks should appear in document order. Do **not** include any other keys or narrative.
+"""
+
+REPAIR_PROMPT = """
+**TASK DEFINITION:**
+The JSON output above, produced for the **{stage}** stage, failed validation with these errors:
+
+{errors}
+
+Return the corrected JSON only. Keep every finding, value and source from the original output, change only what is needed to fix the errors, and do **not** add code fences, commentary, or any other text.
+"""
+
+NARROW_RESEARCH_PROMPT = """
+**KNOWN FINDINGS:**
+Recent research already covers this query with the findings titled below. Do **not** search for them again:
+{known_titles}
+
+Focus your searches on the categories that are still thin: **{missing_categories}**. Return only new entries, in the same JSON array format.
+"""
+
+# The static prompts above go out as system instructions, which can be
+# stored once with the API's context cache; the formatters below build only
+# the per-call payload.
+FAST_REPORT_PROMPT = FAST_ANALYSIS_GUIDE + REPORT_PROMPT
+
 def format_input_prompt(high_level_query):
-    return INPUT_PROMPT.format(high_level_query=high_level_query)
+    return f"""
+<QUERY>
+{high_level_query}
+</QUERY>"""
 
 def format_analysis_prompt(research_text):
     return f"""
 <DATA>
 {research_text}
-</DATA>
-
-{ANALYSIS_PROMPT}"""
+</DATA>"""
 
 def format_report_prompt(analysis_text):
     return f"""
 <ANALYSIS_DATA>
 {analysis_text}
-</ANALYSIS_DATA>
+</ANALYSIS_DATA>"""
+
+def format_fast_research_prompt(high_level_query, current_year=None):
+    if current_year is None:
+        current_year = date.today().year
+    return FAST_RESEARCH_PROMPT.format(
+        high_level_query=high_level_query,
+        current_year=current_year,
+        previous_year=current_year - 1,
+    )
+
+def format_fast_report_prompt(research_text):
+    return format_analysis_prompt(research_text)
+
+def format_repair_prompt(stage, invalid_text, errors):
+    error_list = "\n".join(f"- {error}" for error in errors)
+    return f"""
+<INVALID_OUTPUT>
+{invalid_text}
+</INVALID_OUTPUT>
+""" + REPAIR_PROMPT.format(stage=stage, errors=error_list)
+
+def format_narrowed_research_prompt(research_prompt, missing_categories, known_titles):
+    title_list = "\n".join(f"- {title}" for title in known_titles)
+    return research_prompt + NARROW_RESEARCH_PROMPT.format(
+        known_titles=title_list,
+        missing_categories=", ".join(missing_categories),
+    )
+
+def format_analysis_map_prompt(research_text, chunk_label):
+    return f"""
+<CHUNK>{chunk_label}</CHUNK>
+<DATA>
+{research_text}
+</DATA>"""
+
+def format_analysis_reduce_prompt(partial_text):
+    return f"""
+<PARTIAL_ANALYSES>
+{partial_text}
+</PARTIAL_ANALYSES>"""
+
+def format_category_research_prompt(research_prompt, category):
+    return research_prompt + CATEGORY_RESEARCH_PROMPT.format(
+        category=category,
+        focus=CATEGORY_FOCUS.get(category, f"{category} findings"),
+    )
+
+def format_section_analysis_prompt(research_text, sections, current_analysis_text):
+    return f"""
+<SECTIONS>{", ".join(sections)}</SECTIONS>
+<CURRENT_ANALYSIS>
+{current_analysis_text}
+</CURRENT_ANALYSIS>
+<DATA>
+{research_text}
+</DATA>"""
 
-{REPORT_PROMPT}""" 
\ No newline at end of file
+def format_section_report_prompt(analysis_text, headings, title):
+    heading_list = "\n".join(f"- {section}: {heading}" for section, heading in headings)
+    return f"""
+<TITLE>{title}</TITLE>
+<SECTIONS>
+{heading_list}
+</SECTIONS>
+<ANALYSIS_DATA>
+{analysis_text}
+</ANALYSIS_DATA>"""
@@ -0,0 +1,164 @@
+import json
+import os
+from datetime import datetime, timezone
+from research_store import normalize_title, dedup_key, RESEARCH_CATEGORIES
+from compaction import minify_json
+
+# Analysis sections and the research category each is built from.
+# Recommendations draw on every category, Partnership included.
+SECTION_CATEGORIES = {
+    "trends": "Trend",
+    "competitive_landscape": "Competitor",
+    "insights": "Insight",
+}
+SECTION_HEADINGS = {
+    "trends": "Key Trends",
+    "competitive_landscape": "Competitive Landscape",
+    "insights": "Insights",
+    "recommendations": "Recommendations",
+}
+# Share of a category's findings that must be new, gone or carry new
+# figures before its sections are regenerated. Grounded search rarely
+# returns the same set twice; one finding more or less does not change what
+# a section says.
+MIN_CHANGED_SHARE = 1 / 3
+_HEADING_WORDS = (
+    ("trend", "trends"),
+    ("competit", "competitive_landscape"),
+    ("insight", "insights"),
+    ("recommend", "recommendations"),
+)
+
+
+def report_state_path(output_file):
+    return os.path.splitext(output_file)[0] + ".json"
+
+
+def save_report_state(output_file, query, research, analysis, blocks):
+    # Stored next to the document so a later --refresh can tell which
+    # sections' inputs changed.
+    path = report_state_path(output_file)
+    state = {
+        "query": query,
+        "generated": datetime.now(timezone.utc).isoformat(),
+        "research": research,
+        "analysis": analysis,
+        "blocks": blocks,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def load_report_state(path):
+    state_path = path if path.endswith(".json") else report_state_path(path)
+    if not os.path.exists(state_path):
+        raise FileNotFoundError(f"No stored report data at {state_path}; generate the report once without --refresh")
+    with open(state_path, encoding="utf-8") as f:
+        state = json.load(f)
+    for key in ("query", "research", "blocks"):
+        if not state.get(key):
+            raise ValueError(f"{state_path} has no {key}")
+    return state
+
+
+def _fingerprints(entries):
+    # Findings are compared by title, source and metrics: a reworded summary
+    # of the same finding does not count as a change, new figures do.
+    fingerprints = {}
+    for entry in entries:
+        category = entry.get("category") or "Other"
+        metrics = entry.get("metrics")
+        fingerprints.setdefault(category, {})[dedup_key(entry)] = minify_json(metrics) if metrics else ""
+    return fingerprints
+
+
+def changed_share(previous, current):
+    # previous and current map a category's finding keys to their metrics.
+    keys = set(previous) | set(current)
+    if not keys:
+        return 0.0
+    return sum(1 for key in keys if previous.get(key) != current.get(key)) / len(keys)
+
+
+def changed_categories(previous_entries, entries, min_share=MIN_CHANGED_SHARE):
+    previous = _fingerprints(previous_entries)
+    current = _fingerprints(entries)
+    categories = [category for category in RESEARCH_CATEGORIES if category in previous or category in current]
+    categories += sorted(category for category in set(previous) | set(current) if category not in categories)
+    return [
+        category for category in categories
+        if changed_share(previous.get(category, {}), current.get(category, {})) >= min_share
+    ]
+
+
+def changed_sections(categories):
+    sections = [section for section, category in SECTION_CATEGORIES.items() if category in categories]
+    if categories:
+        sections.append("recommendations")
+    return sections
+
+
+def section_key(heading_text):
+    text = normalize_title(heading_text)
+    for word, section in _HEADING_WORDS:
+        if word in text:
+            return section
+    return None
+
+
+def _starts_section(block):
+    return block.get("type") == "heading" and block.get("level") == 2
+
+
+def split_sections(blocks):
+    # Splits a block array at its level-2 headings into (section, blocks)
+    # pairs; the title and executive summary before the first one, and
+    # sections that match no analysis key (e.g. Limitations), get None.
+    sections = [[None, []]]
+    for block in blocks:
+        if _starts_section(block):
+            sections.append([section_key(block.get("text", "")), []])
+        sections[-1][1].append(block)
+    return [(section, section_blocks) for section, section_blocks in sections if section_blocks]
+
+
+def section_headings(blocks, sections):
+    # Reuses the previous report's heading text, so a refreshed document
+    # keeps its headings.
+    headings = {section: heading_blocks[0].get("text") for section, heading_blocks in split_sections(blocks) if section}
+    return [(section, headings.get(section) or SECTION_HEADINGS[section]) for section in sections]
+
+
+def report_title(blocks):
+    for block in blocks:
+        if block.get("type") == "heading" and block.get("level") == 1:
+            return block.get("text") or "Executive Summary"
+        if _starts_section(block):
+            break
+    return "Executive Summary"
+
+
+def unplaced_sections(blocks, sections):
+    # Sections the previous report does not have exactly once: rewritten
+    # text for them would have no single place to go.
+    counts = {}
+    for section, _ in split_sections(blocks):
+        counts[section] = counts.get(section, 0) + 1
+    return [section for section in sections if counts.get(section) != 1]
+
+
+def patch_blocks(blocks, new_blocks, sections):
+    # new_blocks holds a new title and executive summary, then one level-2
+    # section per entry of sections, in the order they were asked for (see
+    # section_report_parser). The summary replaces the previous one and each
+    # section the previous section of its kind; the rest is kept.
+    parts = split_sections(new_blocks)
+    summary = parts.pop(0)[1] if parts and not _starts_section(parts[0][1][0]) else []
+    updates = {section: section_blocks for section, (_, section_blocks) in zip(sections, parts)}
+    patched = list(summary)
+    for section, section_blocks in split_sections(blocks):
+        if not _starts_section(section_blocks[0]):
+            continue
+        patched.extend(updates.get(section, section_blocks))
+    return patched
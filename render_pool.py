@@ -0,0 +1,91 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from report_ir import compile_report
+from renderers import render_ir
+
+DEFAULT_RENDER_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+
+def _render(blocks, targets, backend, template_path):
+    # Runs in a worker process. The blocks are compiled once for all
+    # formats, the template is parsed once per worker by load_template's
+    # cache, and each file only appears under its final name once it is
+    # complete.
+    start = time.perf_counter()
+    ir = compile_report(blocks)
+    for fmt, output_file in targets.items():
+        partial_file = output_file + ".part"
+        output_doc = render_ir(ir, partial_file, fmt, backend, template_path)
+        if output_doc != partial_file:
+            # The builder fell back to report_fallback.docx in the working
+            # directory, which concurrent workers would overwrite.
+            os.remove(output_doc)
+            raise RuntimeError(f"Could not write {output_file}")
+        os.replace(partial_file, output_file)
+    return dict(targets), time.perf_counter() - start
+
+
+class RenderPool:
+    # Renders finished reports in worker processes, so CPU-bound document
+    # building does not hold the GIL while LLM stages wait on the network.
+    # At most workers + queue_size renders are in flight; further callers
+    # wait for a slot, which holds back the pipelines producing them.
+
+    def __init__(self, workers=DEFAULT_RENDER_WORKERS, queue_size=None, backend="docx", template=None):
+        self.workers = max(1, workers)
+        self.queue_size = self.workers * 2 if queue_size is None else max(0, queue_size)
+        self.backend = backend
+        # Workers load the template themselves; only its path crosses over.
+        self.template_path = getattr(template, "path", template)
+        self.completed = 0
+        self.failed = 0
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._thread_slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._async_slots = None
+        self._lock = threading.Lock()
+
+    def _count(self, ok):
+        with self._lock:
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def render(self, blocks, targets):
+        # targets maps each format to its output path.
+        with self._thread_slots:
+            future = self._executor.submit(_render, blocks, targets, self.backend, self.template_path)
+            try:
+                result = future.result()
+            except Exception:
+                self._count(False)
+                raise
+        self._count(True)
+        return result
+
+    async def render_async(self, blocks, targets):
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.workers + self.queue_size)
+        async with self._async_slots:
+            future = self._executor.submit(_render, blocks, targets, self.backend, self.template_path)
+            try:
+                result = await asyncio.wrap_future(future)
+            except Exception:
+                self._count(False)
+                raise
+        self._count(True)
+        return result
+
+    def shutdown(self, cancel_pending=False):
+        # Renders already running always finish, so their documents are kept;
+        # cancel_pending drops the ones still waiting for a worker.
+        self._executor.shutdown(wait=True, cancel_futures=cancel_pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown(cancel_pending=exc_type is not None)
@@ -0,0 +1,262 @@
+import html
+import json
+import os
+import re
+from report_ir import Heading, Paragraph, ListItem, plain_text
+
+# Word documents are built with python-docx or the streaming OOXML writer.
+BACKENDS = ("docx", "stream")
+FORMAT_EXTENSIONS = {"docx": ".docx", "md": ".md", "html": ".html", "json": ".ir.json"}
+CONTENT_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "md": "text/markdown; charset=utf-8",
+    "html": "text/html; charset=utf-8",
+    "json": "application/json",
+}
+
+_MARKDOWN_SPECIAL = re.compile(r'([\\`*_\[\]<>])')
+
+
+def _heading_level(level, lowest=1, highest=6):
+    # Level 0 is the document title; anything unusable becomes a top-level
+    # heading, as in the docx template.
+    try:
+        level = int(level)
+    except (TypeError, ValueError):
+        return lowest
+    return min(highest, max(lowest, level))
+
+
+def _escape_markdown(text):
+    return _MARKDOWN_SPECIAL.sub(r'\\\1', text)
+
+
+class _TextRenderer:
+    # Renderers for text formats collect their output as a list of strings
+    # and write it UTF-8 encoded to a path or a binary file object. They
+    # take the docx backend and template like every renderer, and ignore
+    # them.
+
+    def __init__(self, backend="docx", template=None):
+        self.parts = []
+        self.in_list = False
+
+    def add_nodes(self, nodes):
+        for node in nodes:
+            self.add_node(node)
+
+    def text(self):
+        return "".join(self.parts)
+
+    def save(self, output_filename):
+        data = self.text().encode("utf-8")
+        if isinstance(output_filename, str):
+            with open(output_filename, "wb") as f:
+                f.write(data)
+        else:
+            output_filename.write(data)
+        return output_filename
+
+
+class MarkdownRenderer(_TextRenderer):
+    def _runs(self, runs):
+        parts = []
+        for run in runs:
+            if run.code:
+                fence = "``" if "`" in run.text else "`"
+                parts.append(f"{fence}{run.text}{fence}")
+                continue
+            text = _escape_markdown(run.text)
+            if run.bold and run.italic:
+                text = f"***{text}***"
+            elif run.bold:
+                text = f"**{text}**"
+            elif run.italic:
+                text = f"*{text}*"
+            if run.url:
+                text = f"[{text}]({run.url})"
+            parts.append(text)
+        return "".join(parts).replace("\n", "  \n")
+
+    def add_node(self, node):
+        node_type = type(node)
+        if node_type is ListItem:
+            if not self.in_list and self.parts:
+                self.parts.append("\n")
+            self.parts.append(f"- {self._runs(node.runs)}\n")
+            self.in_list = True
+            return
+        if self.parts:
+            self.parts.append("\n")
+        self.in_list = False
+        if node_type is Heading:
+            self.parts.append(f"{'#' * _heading_level(node.level)} {_escape_markdown(node.text)}\n")
+        elif node_type is Paragraph:
+            self.parts.append(f"{self._runs(node.runs)}\n")
+
+
+class HtmlRenderer(_TextRenderer):
+    def __init__(self, backend="docx", template=None):
+        super().__init__()
+        self.title = None
+
+    def _runs(self, runs):
+        parts = []
+        for run in runs:
+            text = html.escape(run.text).replace("\n", "<br>")
+            if run.code:
+                text = f"<code>{text}</code>"
+            if run.italic:
+                text = f"<em>{text}</em>"
+            if run.bold:
+                text = f"<strong>{text}</strong>"
+            if run.url:
+                text = f'<a href="{html.escape(run.url)}">{text}</a>'
+            parts.append(text)
+        return "".join(parts)
+
+    def _close_list(self):
+        if self.in_list:
+            self.parts.append("</ul>\n")
+            self.in_list = False
+
+    def add_node(self, node):
+        node_type = type(node)
+        if node_type is ListItem:
+            if not self.in_list:
+                self.parts.append("<ul>\n")
+                self.in_list = True
+            self.parts.append(f"<li>{self._runs(node.runs)}</li>\n")
+            return
+        self._close_list()
+        if node_type is Heading:
+            if self.title is None:
+                self.title = node.text
+            level = _heading_level(node.level)
+            self.parts.append(f"<h{level}>{html.escape(node.text)}</h{level}>\n")
+        elif node_type is Paragraph:
+            self.parts.append(f"<p>{self._runs(node.runs)}</p>\n")
+
+    def text(self):
+        self._close_list()
+        return (
+            '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+            f"<title>{html.escape(self.title or 'Report')}</title>\n</head>\n<body>\n"
+            f"{''.join(self.parts)}</body>\n</html>\n"
+        )
+
+
+class JsonRenderer(_TextRenderer):
+    # The compiled report as plain JSON: headings, paragraphs and lists,
+    # each with its plain text and its formatted runs.
+
+    def __init__(self, backend="docx", template=None):
+        super().__init__()
+        self.blocks = []
+
+    @staticmethod
+    def _runs(runs):
+        described = []
+        for run in runs:
+            entry = {"text": run.text}
+            for flag in ("bold", "italic", "code"):
+                if getattr(run, flag):
+                    entry[flag] = True
+            if run.url:
+                entry["url"] = run.url
+            described.append(entry)
+        return described
+
+    def add_node(self, node):
+        node_type = type(node)
+        if node_type is Heading:
+            self.blocks.append({"type": "heading", "level": _heading_level(node.level, 0, 9), "text": node.text})
+        elif node_type is Paragraph:
+            self.blocks.append({"type": "paragraph", "text": plain_text(node.runs), "runs": self._runs(node.runs)})
+        elif node_type is ListItem:
+            if not self.blocks or self.blocks[-1]["type"] != "list":
+                self.blocks.append({"type": "list", "items": []})
+            self.blocks[-1]["items"].append({"text": plain_text(node.runs), "runs": self._runs(node.runs)})
+
+    def text(self):
+        return json.dumps({"blocks": self.blocks}, ensure_ascii=False, indent=2)
+
+
+class _DocxRenderer:
+    # Adapts the docx builders (python-docx or the streaming writer) to the
+    # renderer interface.
+
+    def __init__(self, backend="docx", template=None):
+        # python-docx is only imported once a Word document is rendered.
+        from docx_converter import create_builder
+        self.builder = create_builder(backend, template)
+
+    def add_nodes(self, nodes):
+        for node in nodes:
+            self.builder.add_node(node)
+
+    def save(self, output_filename):
+        return self.builder.save(output_filename)
+
+
+RENDERERS = {
+    "docx": _DocxRenderer,
+    "md": MarkdownRenderer,
+    "html": HtmlRenderer,
+    "json": JsonRenderer,
+}
+FORMATS = tuple(RENDERERS)
+
+
+def register_renderer(name, factory, extension, content_type="application/octet-stream"):
+    # factory(backend, template) returns an object with add_nodes(nodes)
+    # and save(path_or_file). Formats added here can be rendered by name;
+    # the command-line choices stay the built-in FORMATS.
+    RENDERERS[name] = factory
+    FORMAT_EXTENSIONS[name] = extension
+    CONTENT_TYPES[name] = content_type
+
+
+def create_renderer(fmt="docx", backend="docx", template=None):
+    factory = RENDERERS.get(fmt)
+    if factory is None:
+        raise ValueError(f"Unknown output format: {fmt}")
+    return factory(backend, template)
+
+
+def render_ir(ir, output_filename, fmt="docx", backend="docx", template=None):
+    renderer = create_renderer(fmt, backend, template)
+    renderer.add_nodes(ir)
+    return renderer.save(output_filename)
+
+
+def output_base(path):
+    for extension in sorted(FORMAT_EXTENSIONS.values(), key=len, reverse=True):
+        if path.endswith(extension):
+            return path[:-len(extension)]
+    return os.path.splitext(path)[0]
+
+
+def output_targets(output_file, formats):
+    # Where each format of one report goes: a path names the report and each
+    # format gets its own extension next to it; a dict maps formats to paths
+    # or file objects itself; a file object takes the only format.
+    formats = tuple(formats or ("docx",))
+    if isinstance(output_file, dict):
+        return {fmt: output_file[fmt] for fmt in formats if fmt in output_file}
+    if not isinstance(output_file, str):
+        if len(formats) > 1:
+            raise ValueError("Rendering several formats needs a file name or one file object per format")
+        return {formats[0]: output_file}
+    base = output_base(output_file)
+    return {
+        fmt: output_file if output_file.endswith(FORMAT_EXTENSIONS[fmt]) else base + FORMAT_EXTENSIONS[fmt]
+        for fmt in formats
+    }
+
+
+def render_formats(ir, output_file, formats=("docx",), backend="docx", template=None):
+    return {
+        fmt: render_ir(ir, target, fmt, backend, template)
+        for fmt, target in output_targets(output_file, formats).items()
+    }
@@ -0,0 +1,138 @@
+import json
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# The compiled form of a report's block array that every renderer consumes:
+# a flat tuple of headings, paragraphs and list items. Inline markdown is
+# tokenized into runs once, here, instead of by each output format.
+Heading = namedtuple("Heading", "level text")
+Paragraph = namedtuple("Paragraph", "runs")
+ListItem = namedtuple("ListItem", "runs")
+TextRun = namedtuple("TextRun", "text bold italic code url")
+
+_INLINE_MARKDOWN = re.compile(
+    r'\*\*\*(?P<bold_italic>.+?)\*\*\*'
+    r'|\*\*(?P<bold>.+?)\*\*'
+    r'|`(?P<code>[^`]+)`'
+    r'|\[(?P<link>[^\]]+)\]\((?P<url>[^)\s]+)\)'
+    r'|(?<![\w*])\*(?P<italic>[^*\s](?:[^*]*[^*\s])?)\*(?![\w*])'
+)
+FALLBACK_LIST_ITEM = "• List item"
+
+
+def list_item_text(item):
+    if isinstance(item, dict):
+        if 'text' in item:
+            return item['text']
+        return str(item)
+    if isinstance(item, list):
+        return ', '.join(str(x) for x in item)
+    return item
+
+
+@lru_cache(maxsize=4096)
+def tokenize_markdown(text):
+    runs = []
+    last = 0
+    for match in _INLINE_MARKDOWN.finditer(text):
+        if match.start() > last:
+            runs.append(TextRun(text[last:match.start()], False, False, False, None))
+
+        if match.group('bold_italic') is not None:
+            runs.append(TextRun(match.group('bold_italic'), True, True, False, None))
+        elif match.group('bold') is not None:
+            runs.append(TextRun(match.group('bold'), True, False, False, None))
+        elif match.group('code') is not None:
+            runs.append(TextRun(match.group('code'), False, False, True, None))
+        elif match.group('link') is not None:
+            runs.append(TextRun(match.group('link'), False, False, False, match.group('url')))
+        else:
+            runs.append(TextRun(match.group('italic'), False, True, False, None))
+        last = match.end()
+
+    if last < len(text):
+        runs.append(TextRun(text[last:], False, False, False, None))
+    return tuple(runs)
+
+
+def clean_markdown(text):
+    if not isinstance(text, str):
+        try:
+            text = str(text)
+        except:
+            return ""
+
+    try:
+        return "".join(run.text for run in tokenize_markdown(text))
+    except Exception:
+        return text
+
+
+def plain_text(runs):
+    return "".join(run.text for run in runs)
+
+
+def _runs(text):
+    if not isinstance(text, str):
+        try:
+            text = str(text)
+        except Exception:
+            text = ""
+    return tokenize_markdown(text)
+
+
+@lru_cache(maxsize=4096)
+def _paragraph(text):
+    return Paragraph(_runs(text))
+
+
+@lru_cache(maxsize=4096)
+def _list_item(text):
+    return ListItem(_runs(text))
+
+
+def compile_block(block):
+    # Returns the nodes for one block; anything that is not a known block
+    # compiles to nothing. Identical paragraphs and items share one node.
+    if not isinstance(block, dict):
+        return ()
+    block_type = block.get("type")
+
+    if block_type == "heading":
+        try:
+            return (Heading(block.get("level", 1), clean_markdown(block.get("text", ""))),)
+        except Exception:
+            return (Heading(1, "Heading"),)
+
+    if block_type == "paragraph":
+        text = block.get("text", "")
+        try:
+            return (_paragraph(text),)
+        except TypeError:
+            return (Paragraph(_runs(text)),)
+
+    if block_type == "list":
+        nodes = []
+        try:
+            for item in block.get("items", []):
+                text = list_item_text(item)
+                try:
+                    nodes.append(_list_item(text))
+                except TypeError:
+                    nodes.append(ListItem(_runs(text)))
+        except Exception:
+            nodes.append(ListItem((TextRun(FALLBACK_LIST_ITEM, False, False, False, None),)))
+        return tuple(nodes)
+
+    return ()
+
+
+def compile_report(json_data):
+    # Accepts the block array or its JSON text, like json_to_docx.
+    if isinstance(json_data, str):
+        try:
+            json_data = json.loads(json_data)
+        except json.JSONDecodeError:
+            raise ValueError("Invalid JSON string provided")
+    return tuple(node for block in json_data for node in compile_block(block))
@@ -0,0 +1,245 @@
+import json
+import re
+from schemas import ANALYSIS_KEYS, PARTIAL_ANALYSIS_KEYS
+
+_STRUCTURE = re.compile(r'[{}\[\]"]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_FENCE_START = re.compile(r'^\s*```(?:json)?\s*')
+_FENCE_END = re.compile(r'\s*```\s*$')
+
+BLOCK_TYPES = frozenset(("heading", "paragraph", "list"))
+MAX_REPORTED_ERRORS = 10
+
+
+class ReportFormatError(ValueError):
+    def __init__(self, stage, errors):
+        self.stage = stage
+        self.errors = errors[:MAX_REPORTED_ERRORS]
+        super().__init__(f"Invalid {stage} output: " + "; ".join(self.errors))
+
+
+def parse_report_json(json_text):
+    json_text = _FENCE_START.sub('', json_text)
+    json_text = _FENCE_END.sub('', json_text)
+    return json.loads(json_text)
+
+
+def dump_json(data):
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def _load_json(stage, text, opening, closing):
+    try:
+        return parse_report_json(text)
+    except json.JSONDecodeError as e:
+        error = e
+
+    # Grounded responses often wrap the JSON in prose; retry on the outermost
+    # bracketed span before giving up.
+    start = text.find(opening)
+    end = text.rfind(closing)
+    if start != -1 and end > start:
+        try:
+            return json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            pass
+    raise ReportFormatError(stage, [f"not valid JSON ({error})"])
+
+
+def validate_blocks(blocks):
+    if not isinstance(blocks, list):
+        return ["expected a JSON array of blocks"]
+
+    errors = []
+    for index, block in enumerate(blocks):
+        if not isinstance(block, dict):
+            errors.append(f"block {index} is not an object")
+            continue
+        block_type = block.get("type")
+        if block_type not in BLOCK_TYPES:
+            errors.append(f"block {index} has unknown type {block_type!r}")
+        elif block_type == "heading":
+            level = block.get("level")
+            if type(level) is not int or not 1 <= level <= 3:
+                errors.append(f"block {index} heading level must be 1-3, got {level!r}")
+            if not isinstance(block.get("text"), str):
+                errors.append(f"block {index} heading has no text")
+        elif block_type == "paragraph":
+            if not isinstance(block.get("text"), str):
+                errors.append(f"block {index} paragraph has no text")
+        elif not isinstance(block.get("items"), list):
+            errors.append(f"block {index} list has no items array")
+        if len(errors) >= MAX_REPORTED_ERRORS:
+            break
+    return errors
+
+
+def validate_research(entries):
+    if not isinstance(entries, list):
+        return ["expected a JSON array of research entries"]
+
+    errors = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            errors.append(f"entry {index} is not an object")
+            continue
+        for field in ("category", "title", "summary"):
+            if not isinstance(entry.get(field), str):
+                errors.append(f"entry {index} has no {field}")
+        if len(errors) >= MAX_REPORTED_ERRORS:
+            break
+    if not entries:
+        errors.append("no research entries")
+    return errors
+
+
+def validate_analysis(analysis, keys=ANALYSIS_KEYS):
+    if not isinstance(analysis, dict):
+        return ["expected a JSON object"]
+    return [
+        f"{key} must be an array"
+        for key in keys
+        if not isinstance(analysis.get(key), list)
+    ]
+
+
+def parse_research(text):
+    entries = _load_json("research", text, '[', ']')
+    errors = validate_research(entries)
+    if errors:
+        raise ReportFormatError("research", errors)
+    return entries
+
+
+def parse_analysis(text):
+    analysis = _load_json("analysis", text, '{', '}')
+    errors = validate_analysis(analysis)
+    if errors:
+        raise ReportFormatError("analysis", errors)
+    return analysis
+
+
+def parse_partial_analysis(text):
+    analysis = _load_json("analysis_map", text, '{', '}')
+    errors = validate_analysis(analysis, PARTIAL_ANALYSIS_KEYS)
+    if errors:
+        raise ReportFormatError("analysis_map", errors)
+    return analysis
+
+
+def section_analysis_parser(keys):
+    # Parses a refresh analysis that covers only some sections.
+    def parse(text):
+        analysis = _load_json("analysis_refresh", text, '{', '}')
+        errors = validate_analysis(analysis, keys)
+        if errors:
+            raise ReportFormatError("analysis_refresh", errors)
+        return {key: analysis[key] for key in keys}
+    return parse
+
+
+def section_report_parser(count):
+    # Parses a refresh's rewritten report: a new title and executive summary,
+    # then exactly count level-2 sections, which are placed by their order.
+    def parse(text):
+        blocks = _load_json("report_refresh", text, '[', ']')
+        errors = validate_blocks(blocks)
+        if not errors:
+            starts = [index for index, block in enumerate(blocks)
+                      if block["type"] == "heading" and block["level"] == 2]
+            if len(starts) != count:
+                errors.append(f"expected {count} level-2 section headings, got {len(starts)}")
+            if not starts or starts[0] == 0:
+                errors.append("expected the title and executive summary before the first section")
+        if errors:
+            raise ReportFormatError("report_refresh", errors)
+        return blocks
+    return parse
+
+
+def parse_report_blocks(text):
+    blocks = _load_json("report", text, '[', ']')
+    errors = validate_blocks(blocks)
+    if errors:
+        raise ReportFormatError("report", errors)
+    return blocks
+
+
+class BlockStreamParser:
+    # Emits each object of a top-level JSON array as soon as it closes, so
+    # blocks can be rendered while the rest of the response is still arriving.
+    # Anything before the opening bracket (e.g. a ```json fence) is skipped.
+
+    def __init__(self, on_block):
+        self.on_block = on_block
+        self.block_count = 0
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._object_start = None
+        self._done = False
+
+    def feed(self, chunk):
+        if self._done or not chunk:
+            return
+        self._buffer += chunk
+        buffer = self._buffer
+        pos = self._pos
+
+        while pos < len(buffer):
+            if self._in_string:
+                match = _STRING_SPECIAL.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                if match.group() == '\\':
+                    # Skip the escaped character, even if it has not arrived yet.
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                continue
+
+            match = _STRUCTURE.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            char = match.group()
+            pos = match.end()
+
+            if self._depth == 0:
+                if char == '[':
+                    self._depth = 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+                if self._depth == 2 and char == '{':
+                    self._object_start = match.start()
+            else:
+                self._depth -= 1
+                if self._depth == 1 and self._object_start is not None:
+                    self._emit(buffer[self._object_start:pos])
+                    self._object_start = None
+                    buffer = buffer[pos:]
+                    pos = 0
+                elif self._depth == 0:
+                    self._done = True
+                    break
+
+        if self._object_start is None and not self._in_string:
+            buffer = buffer[pos:]
+            pos = 0
+        self._buffer = buffer
+        self._pos = pos
+
+    def _emit(self, object_text):
+        try:
+            block = json.loads(object_text)
+        except json.JSONDecodeError:
+            return
+        self.block_count += 1
+        self.on_block(block)
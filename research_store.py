@@ -0,0 +1,216 @@
+import contextlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_STORE_PATH = "research.db"
+DEFAULT_MAX_AGE_DAYS = 7
+RESEARCH_CATEGORIES = ("Trend", "Competitor", "Insight", "Partnership")
+MIN_PER_CATEGORY = 2
+MAX_LOOKUP_ENTRIES = 40
+# Share of a query's distinctive terms a stored entry must contain to be
+# reused: all of them for up to three terms. One shared word ("cloud") must
+# not make another market's research ("cloud computing" for "cloud gaming")
+# count as coverage.
+MIN_TERM_SHARE = 0.75
+# bm25 weights of the title, summary, category and query columns: entries
+# rank on what they say rather than on the query they were found for.
+_RANK_WEIGHTS = (4.0, 2.0, 1.0, 0.5)
+
+# Words every business query shares; matching on them would make unrelated
+# markets look covered.
+_GENERIC_TERMS = {
+    "a", "about", "all", "an", "and", "are", "as", "at", "be", "best", "by", "companies", "company",
+    "competitors", "current", "does", "for", "from", "how", "in", "industry", "is", "key", "latest",
+    "leader", "leaders", "leading", "leads", "main", "major", "market", "markets", "of", "on", "or",
+    "player", "players", "report", "sector", "the", "to", "top", "trend", "trends", "what", "which",
+    "who", "with",
+}
+_WORDS = re.compile(r"\w+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    dedup_key TEXT UNIQUE NOT NULL,
+    category TEXT,
+    title TEXT,
+    summary TEXT,
+    source TEXT,
+    query TEXT,
+    entry TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    title, summary, category, query, content='entries', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts(rowid, title, summary, category, query)
+    VALUES (new.id, new.title, new.summary, new.category, new.query);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts(entries_fts, rowid, title, summary, category, query)
+    VALUES ('delete', old.id, old.title, old.summary, old.category, old.query);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE ON entries BEGIN
+    INSERT INTO entries_fts(entries_fts, rowid, title, summary, category, query)
+    VALUES ('delete', old.id, old.title, old.summary, old.category, old.query);
+    INSERT INTO entries_fts(rowid, title, summary, category, query)
+    VALUES (new.id, new.title, new.summary, new.category, new.query);
+END;
+"""
+
+
+def normalize_title(title):
+    return " ".join(_WORDS.findall(str(title).lower()))
+
+
+def entry_source(entry):
+    source = entry.get("source_url") or entry.get("source")
+    if not source and isinstance(entry.get("metrics"), dict):
+        source = entry["metrics"].get("source_url")
+    return str(source).strip().lower() if source else ""
+
+
+def dedup_key(entry):
+    return f"{normalize_title(entry.get('title', ''))}|{entry_source(entry)}"
+
+
+def query_terms(query):
+    terms = []
+    for word in _WORDS.findall(query.lower()):
+        if word not in _GENERIC_TERMS and not word.isdigit() and len(word) > 1 and word not in terms:
+            terms.append(word)
+    return terms
+
+
+def merge_entries(*entry_lists):
+    merged = {}
+    for entries in entry_lists:
+        for entry in entries:
+            merged.setdefault(dedup_key(entry), entry)
+    return list(merged.values())
+
+
+class ResearchCoverage:
+    def __init__(self, entries, missing_categories):
+        self.entries = entries
+        self.missing_categories = missing_categories
+
+    @property
+    def complete(self):
+        return bool(self.entries) and not self.missing_categories
+
+
+class ResearchStore:
+    # Every accepted research entry, searchable with FTS5, so overlapping
+    # queries can reuse findings instead of repeating grounded searches.
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.path = path
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # A connection per call keeps the store safe to share between
+        # threads, event loops and batch processes.
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def add(self, query, entries):
+        now = time.time()
+        rows = []
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            rows.append((
+                dedup_key(entry),
+                str(entry.get("category", "")),
+                str(entry.get("title", "")),
+                str(entry.get("summary", "")),
+                entry_source(entry),
+                query,
+                json.dumps(entry, ensure_ascii=False),
+                now,
+                now,
+            ))
+        with self._lock, self._connect() as connection:
+            connection.executemany(
+                """
+                INSERT INTO entries (dedup_key, category, title, summary, source, query, entry, created, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(dedup_key) DO UPDATE SET
+                    category = excluded.category,
+                    summary = excluded.summary,
+                    query = excluded.query,
+                    entry = excluded.entry,
+                    updated = excluded.updated
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def search(self, query, limit=MAX_LOOKUP_ENTRIES):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        needed = max(1, math.ceil(len(terms) * MIN_TERM_SHARE))
+        # FTS5 cannot ask for "k of n terms", so candidates matching any term
+        # are fetched and those with too few of them dropped here.
+        match = " OR ".join(f'"{term}"' for term in terms)
+        oldest = time.time() - self.max_age_seconds if self.max_age_seconds else 0
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"""
+                SELECT entries.entry, entries.title, entries.summary, entries.category, entries.query
+                FROM entries_fts
+                JOIN entries ON entries.id = entries_fts.rowid
+                WHERE entries_fts MATCH ? AND entries.updated >= ?
+                ORDER BY bm25(entries_fts, {", ".join(map(str, _RANK_WEIGHTS))})
+                LIMIT ?
+                """,
+                (match, oldest, limit * 5),
+            ).fetchall()
+        entries = []
+        for row in rows:
+            text = " ".join(row[column] or "" for column in ("title", "summary", "category", "query"))
+            words = set(_WORDS.findall(text.lower()))
+            if sum(term in words for term in terms) >= needed:
+                entries.append(json.loads(row["entry"]))
+                if len(entries) >= limit:
+                    break
+        return entries
+
+    def coverage(self, query, min_per_category=MIN_PER_CATEGORY):
+        try:
+            entries = self.search(query)
+        except sqlite3.Error as e:
+            print(f"Research store lookup failed: {e}")
+            return ResearchCoverage([], list(RESEARCH_CATEGORIES))
+        counts = {}
+        for entry in entries:
+            counts[entry.get("category")] = counts.get(entry.get("category"), 0) + 1
+        missing = [category for category in RESEARCH_CATEGORIES if counts.get(category, 0) < min_per_category]
+        return ResearchCoverage(entries, missing)
+
+    def prune(self):
+        if self.max_age_seconds is None:
+            return 0
+        with self._lock, self._connect() as connection:
+            cursor = connection.execute("DELETE FROM entries WHERE updated < ?", (time.time() - self.max_age_seconds,))
+            return cursor.rowcount
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+DEFAULT_MIN_SAMPLES = 5
+DEFAULT_WINDOW = 50
+# Every this many routes of a stage, a cheaper model that missed its SLO is
+# tried once more, so it can win the stage back once it recovers.
+DEFAULT_PROBE_EVERY = 20
+# Outcomes read back from the routing log at startup.
+LOG_REPLAY = 500
+
+# Candidate models are listed cheapest first. The input rewrite and report
+# formatting are simple transformations that the lite model can handle, so
+# it is tried first and kept while it meets the SLO. Grounded search and
+# analysis stay on the full model.
+DEFAULT_ROUTING = {
+    "slo": {"latency_seconds": 60.0, "max_failure_rate": 0.2},
+    "stages": {
+        "input": {"models": ["gemini-2.0-flash-lite", "gemini-2.0-flash"], "latency_seconds": 15.0},
+        "research": {"models": ["gemini-2.0-flash"]},
+        "analysis": {"models": ["gemini-2.0-flash"]},
+        "report": {"models": ["gemini-2.0-flash-lite", "gemini-2.0-flash"], "latency_seconds": 30.0},
+    },
+}
+GENERATION_SETTINGS = ("temperature", "max_output_tokens", "thinking_budget")
+
+
+def load_routing(path):
+    with open(path, encoding="utf-8") as f:
+        routing = json.load(f)
+    if not isinstance(routing.get("stages"), dict):
+        raise ValueError("routing file needs a 'stages' object")
+    for stage, settings in routing["stages"].items():
+        if not isinstance(settings.get("models"), list) or not settings["models"]:
+            raise ValueError(f"stage {stage} needs a non-empty 'models' list")
+        unknown = set(settings) - set(GENERATION_SETTINGS) - {"models", "latency_seconds", "max_failure_rate"}
+        if unknown:
+            raise ValueError(f"stage {stage} has unknown settings: {', '.join(sorted(unknown))}")
+    return routing
+
+
+def routing_stage(stage, stages):
+    # Repairs are routed like the stage they repair; research_trend and
+    # analysis_map fall back to research and analysis unless configured.
+    if stage.endswith("_repair"):
+        stage = stage[:-len("_repair")]
+    if stage in stages:
+        return stage
+    return stage.split("_")[0]
+
+
+class Route:
+    def __init__(self, stage, model, generation, reason):
+        self.stage = stage
+        self.model = model
+        # GenerateContentConfig fields for this stage.
+        self.generation = generation
+        self.reason = reason
+
+
+class _ModelStats:
+    def __init__(self, window):
+        self.outcomes = deque(maxlen=window)
+
+    def add(self, seconds, status):
+        self.outcomes.append((seconds, status))
+
+    def summary(self):
+        latencies = sorted(seconds for seconds, status in self.outcomes if status == "ok" and seconds is not None)
+        failures = sum(1 for _, status in self.outcomes if status != "ok")
+        return {
+            "samples": len(self.outcomes),
+            "failure_rate": failures / len(self.outcomes) if self.outcomes else 0.0,
+            "p95_seconds": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+        }
+
+
+class ModelRouter:
+    # Chooses a model and generation config for every stage call: the
+    # cheapest candidate whose recent p95 latency and failure rate (errors
+    # and outputs that needed repair) meet the stage's SLO. Models without
+    # enough samples are given the benefit of the doubt. Decisions and
+    # outcomes can be appended to a JSON-lines log, which is read back on
+    # startup so short runs start from earlier measurements.
+
+    def __init__(self, routing=None, default_model=None, log_path=None, min_samples=DEFAULT_MIN_SAMPLES,
+                 window=DEFAULT_WINDOW, probe_every=DEFAULT_PROBE_EVERY):
+        routing = routing or DEFAULT_ROUTING
+        self.stages = routing.get("stages", {})
+        slo = routing.get("slo", {})
+        self.latency_slo = slo.get("latency_seconds")
+        self.failure_slo = slo.get("max_failure_rate")
+        self.default_model = default_model
+        self.log_path = log_path
+        self.min_samples = min_samples
+        self.window = window
+        self.probe_every = probe_every
+        self._stats = {}
+        self._routes = {}
+        self._current = {}
+        self._lock = threading.Lock()
+        self.policy = hashlib.sha256(json.dumps(
+            {"routing": routing, "default_model": default_model}, sort_keys=True, default=str
+        ).encode("utf-8")).hexdigest()[:16]
+        if log_path:
+            self._replay(log_path)
+
+    def _model_stats(self, stage, model):
+        key = (stage, model)
+        if key not in self._stats:
+            self._stats[key] = _ModelStats(self.window)
+        return self._stats[key]
+
+    def _replay(self, path):
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = deque(f, maxlen=LOG_REPLAY * 2)
+        except OSError as e:
+            print(f"Could not read routing log {path}: {e}")
+            return
+        replayed = 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("event") == "outcome":
+                self._model_stats(record["stage"], record["model"]).add(record.get("seconds"), record["status"])
+                replayed += 1
+        if replayed:
+            print(f"Routing: replayed {replayed} outcomes from {path}")
+
+    def _log(self, record):
+        if not self.log_path:
+            return
+        record["time"] = time.time()
+        try:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"Could not write routing log {self.log_path}: {e}")
+
+    def _verdict(self, summary, latency_slo, failure_slo):
+        if summary["samples"] < self.min_samples:
+            return None
+        if failure_slo is not None and summary["failure_rate"] > failure_slo:
+            return False
+        if latency_slo is not None and summary["p95_seconds"] is not None and summary["p95_seconds"] > latency_slo:
+            return False
+        return True
+
+    def route(self, stage, default_model):
+        name = routing_stage(stage, self.stages)
+        settings = self.stages.get(name, {})
+        candidates = settings.get("models") or [self.default_model or default_model]
+        latency_slo = settings.get("latency_seconds", self.latency_slo)
+        failure_slo = settings.get("max_failure_rate", self.failure_slo)
+
+        with self._lock:
+            self._routes[name] = self._routes.get(name, 0) + 1
+            summaries = {model: self._model_stats(name, model).summary() for model in candidates}
+            chosen, reason, missed = None, None, []
+            for model in candidates:
+                verdict = self._verdict(summaries[model], latency_slo, failure_slo)
+                if verdict is False:
+                    missed.append(model)
+                    continue
+                chosen, reason = model, "meets SLO" if verdict else "not enough samples"
+                break
+            if chosen is None:
+                # Nothing meets the SLO: the least failing model, then the fastest.
+                chosen = min(candidates, key=lambda model: (
+                    summaries[model]["failure_rate"], summaries[model]["p95_seconds"] or 0.0,
+                ))
+                reason = "no model meets SLO; best measured"
+            elif missed and self._routes[name] % self.probe_every == 0:
+                chosen, reason = missed[0], "probe"
+            changed = self._current.get(name) != chosen and reason != "probe"
+            if changed:
+                self._current[name] = chosen
+
+        if changed and len(candidates) > 1:
+            print(f"Routing {name} to {chosen} ({reason})")
+        self._log({
+            "event": "route", "stage": name, "call": stage, "model": chosen, "reason": reason,
+            "candidates": summaries, "latency_slo": latency_slo, "failure_slo": failure_slo,
+        })
+
+        generation = {key: settings[key] for key in ("temperature", "max_output_tokens") if key in settings}
+        if "thinking_budget" in settings:
+            from google.genai.types import ThinkingConfig
+            generation["thinking_config"] = ThinkingConfig(thinking_budget=settings["thinking_budget"])
+        return Route(name, chosen, generation, reason)
+
+    def record(self, route, seconds, status):
+        # status is "ok", "error" or "invalid" (the output failed validation
+        # and had to be repaired).
+        with self._lock:
+            self._model_stats(route.stage, route.model).add(seconds if status == "ok" else None, status)
+        self._log({"event": "outcome", "stage": route.stage, "model": route.model, "seconds": seconds,
+                   "status": status})
+
+    def format_stats(self):
+        with self._lock:
+            rows = [(stage, model, stats.summary()) for (stage, model), stats in sorted(self._stats.items())]
+        lines = [f"{'stage':<10}{'model':<24}{'calls':>6}{'fail %':>8}{'p95 s':>8}"]
+        for stage, model, summary in rows:
+            p95 = f"{summary['p95_seconds']:.2f}" if summary["p95_seconds"] is not None else "-"
+            lines.append(
+                f"{stage:<10}{model:<24}{summary['samples']:>6}{summary['failure_rate'] * 100:>8.1f}{p95:>8}"
+            )
+        return "Routing:\n" + "\n".join(lines)
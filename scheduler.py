@@ -0,0 +1,315 @@
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+RETRYABLE_CODES = frozenset((408, 429, 500, 502, 503, 504))
+# Later stages go first, so reports that are nearly done finish before new
+# ones start and the first report of a batch arrives as early as possible.
+STAGE_PRIORITY = {
+    "report": 0,
+    "analysis_report": 0,
+    "analysis_reduce": 1,
+    "analysis": 2,
+    "analysis_map": 2,
+    "research": 3,
+    "input": 4,
+}
+
+_RETRY_DELAY = re.compile(r'"retryDelay":\s*"([\d.]+)s"')
+
+
+def stage_priority(stage):
+    stage = stage[:-len("_repair")] if stage.endswith("_repair") else stage
+    if stage in STAGE_PRIORITY:
+        return STAGE_PRIORITY[stage]
+    return STAGE_PRIORITY.get(stage.split("_")[0], len(STAGE_PRIORITY))
+
+
+def estimate_call_tokens(contents, system=None):
+    # system is the stage instruction when it is sent inline; one served from
+    # the context cache does not count against the prompt tokens.
+    text = contents if isinstance(contents, str) else json.dumps(contents, default=str)
+    return max(1, (len(text) + len(system or "")) // 4)
+
+
+def is_retryable(error):
+    from google.genai import errors
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_CODES
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in (
+        "ConnectError", "ReadError", "ReadTimeout", "ConnectTimeout", "RemoteProtocolError", "WriteError",
+    )
+
+
+def retry_after(error):
+    # Honors a Retry-After header, or the RetryInfo delay Gemini puts in the
+    # body of a 429.
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            pass
+    match = _RETRY_DELAY.search(json.dumps(getattr(error, "details", None), default=str))
+    return float(match.group(1)) if match else None
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class CallScheduler:
+    # Every model call passes through here. Token buckets keep requests and
+    # estimated tokens per minute under quota, waiting callers are admitted
+    # in stage-priority order, and transient errors are retried with
+    # exponential backoff and jitter. A 429 pauses all callers until its
+    # retry delay has passed, instead of letting every worker hit it again.
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_retries=DEFAULT_MAX_RETRIES,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0, "failed": 0, "waited_seconds": 0.0}
+        self._lock = threading.Lock()
+        # Whenever the first waiting caller changes, threads are woken through
+        # the condition and an asyncio caller through its ticket's event, so
+        # nobody polls for their turn.
+        self._turn = threading.Condition(self._lock)
+        self._wakers = {}
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._random = random.Random()
+
+    @property
+    def limited(self):
+        return self.requests is not None or self.tokens is not None
+
+    def _ticket(self, call, waker=None):
+        # waker is the (loop, event) of an asyncio caller.
+        ticket = (stage_priority(call.stage), next(self._sequence))
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+            if waker is not None:
+                self._wakers[ticket] = waker
+        return ticket
+
+    def _wake_next(self):
+        # Called with the lock held once the first waiting caller changed.
+        self._turn.notify_all()
+        waker = self._wakers.get(self._waiting[0]) if self._waiting else None
+        if waker is not None:
+            loop, event = waker
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass
+
+    def _pause_left(self):
+        # Without buckets calls need no ordering; they only wait out a 429
+        # pause.
+        with self._lock:
+            wait = max(0.0, self._paused_until - time.monotonic())
+            if wait == 0:
+                self.stats["calls"] += 1
+            return wait
+
+    def _admit(self, ticket, tokens):
+        # Called with the lock held. Returns 0 once admitted, None while
+        # another caller is first in line, otherwise how long until the
+        # buckets have refilled enough.
+        now = time.monotonic()
+        if self._waiting[0] != ticket:
+            return None
+        wait = max(0.0, self._paused_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+        heapq.heappop(self._waiting)
+        self.stats["calls"] += 1
+        self._wake_next()
+        return 0.0
+
+    def _try_admit(self, ticket, tokens):
+        with self._lock:
+            return self._admit(ticket, tokens)
+
+    def _wait_turn(self, call, tokens):
+        # The first caller sleeps until the buckets have refilled, the others
+        # until the first one is admitted or gives up its place.
+        if not self.limited:
+            while (wait := self._pause_left()) > 0:
+                time.sleep(wait)
+            return
+        ticket = self._ticket(call)
+        try:
+            with self._turn:
+                while (wait := self._admit(ticket, tokens)) != 0:
+                    self._turn.wait(wait)
+        finally:
+            # A no-op once admitted; an interrupted wait must not leave the
+            # ticket blocking everyone behind it.
+            self._withdraw(ticket)
+
+    async def _wait_turn_async(self, call, tokens):
+        if not self.limited:
+            while (wait := self._pause_left()) > 0:
+                await asyncio.sleep(wait)
+            return
+        event = asyncio.Event()
+        ticket = self._ticket(call, (asyncio.get_running_loop(), event))
+        try:
+            while True:
+                event.clear()
+                wait = self._try_admit(ticket, tokens)
+                if wait == 0:
+                    return
+                if wait is None:
+                    await event.wait()
+                else:
+                    await asyncio.sleep(wait)
+        finally:
+            self._withdraw(ticket)
+
+    def _backoff(self, error, attempt):
+        delay = self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        hinted = retry_after(error)
+        with self._lock:
+            self.stats["retries"] += 1
+            if getattr(error, "code", None) == 429:
+                self.stats["rate_limited"] += 1
+                if hinted:
+                    self._paused_until = max(self._paused_until, time.monotonic() + hinted)
+        return max(delay, hinted or 0.0)
+
+    def _give_up(self, error, attempt, emitted):
+        # A streamed call that already delivered text is not replayed, since
+        # its chunks have been rendered.
+        if emitted or attempt >= self.max_retries or not is_retryable(error):
+            with self._lock:
+                self.stats["failed"] += 1
+            # The caller's trace records how often the call was retried
+            # before it failed.
+            try:
+                error.scheduler_retries = attempt
+            except AttributeError:
+                pass
+            return True
+        return False
+
+    def _wrap_stream(self, call):
+        emitted = [False]
+        if call.on_text is None:
+            return call, emitted
+        on_text = call.on_text
+
+        def tracking(text):
+            emitted[0] = True
+            on_text(text)
+
+        return _StreamingCall(call, tracking), emitted
+
+    def _record_wait(self, seconds):
+        with self._lock:
+            self.stats["waited_seconds"] += seconds
+
+    def run(self, call, send, inline_system=True):
+        # Returns the call's result and how many times it was retried.
+        tokens = estimate_call_tokens(call.contents, getattr(call, "system", None) if inline_system else None)
+        tracked, emitted = self._wrap_stream(call)
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            self._wait_turn(call, tokens)
+            self._record_wait(time.monotonic() - start)
+            try:
+                return send(tracked), attempt
+            except Exception as e:
+                if self._give_up(e, attempt, emitted[0]):
+                    raise
+                delay = self._backoff(e, attempt)
+                attempt += 1
+                print(f"{call.stage} call failed ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    async def run_async(self, call, send, inline_system=True):
+        tokens = estimate_call_tokens(call.contents, getattr(call, "system", None) if inline_system else None)
+        tracked, emitted = self._wrap_stream(call)
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            await self._wait_turn_async(call, tokens)
+            self._record_wait(time.monotonic() - start)
+            try:
+                return await send(tracked), attempt
+            except Exception as e:
+                if self._give_up(e, attempt, emitted[0]):
+                    raise
+                delay = self._backoff(e, attempt)
+                attempt += 1
+                print(f"{call.stage} call failed ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def _withdraw(self, ticket):
+        with self._lock:
+            self._wakers.pop(ticket, None)
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._wake_next()
+
+    def format_stats(self):
+        stats = self.stats
+        return (
+            f"Scheduler: {stats['calls']} calls, {stats['retries']} retries "
+            f"({stats['rate_limited']} rate limited), {stats['failed']} failed, "
+            f"{stats['waited_seconds']:.1f}s waiting for quota"
+        )
+
+
+class _StreamingCall:
+    # The call as the model sees it, with text delivery tracked so a stream
+    # that has already produced output is not retried.
+
+    def __init__(self, call, on_text):
+        self._call = call
+        self.on_text = on_text
+
+    def __getattr__(self, name):
+        return getattr(self._call, name)
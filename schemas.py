@@ -0,0 +1,82 @@
+# The analysis sections, in report order; the response schemas and the
+# validators in report_json.py both use these.
+ANALYSIS_KEYS = ["trends", "competitive_landscape", "insights", "recommendations"]
+# One chunk's share of the analysis; recommendations come from the merge call.
+PARTIAL_ANALYSIS_KEYS = ANALYSIS_KEYS[:3]
+
+ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "trends": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "title": {"type": "STRING"},
+                    "details": {"type": "STRING"},
+                },
+                "required": ["title", "details"],
+            },
+        },
+        "competitive_landscape": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "name": {"type": "STRING"},
+                    "positioning": {"type": "STRING"},
+                    "strengths": {"type": "ARRAY", "items": {"type": "STRING"}},
+                    "weaknesses": {"type": "ARRAY", "items": {"type": "STRING"}},
+                },
+                "required": ["name", "positioning", "strengths", "weaknesses"],
+            },
+        },
+        "insights": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "market": {"type": "STRING"},
+                    "finding": {"type": "STRING"},
+                },
+                "required": ["market", "finding"],
+            },
+        },
+        "recommendations": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "action": {"type": "STRING"},
+                    "rationale": {"type": "STRING"},
+                },
+                "required": ["action", "rationale"],
+            },
+        },
+    },
+    "required": ANALYSIS_KEYS,
+    "property_ordering": ANALYSIS_KEYS,
+}
+
+PARTIAL_ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {key: ANALYSIS_SCHEMA["properties"][key] for key in PARTIAL_ANALYSIS_KEYS},
+    "required": PARTIAL_ANALYSIS_KEYS,
+    "property_ordering": PARTIAL_ANALYSIS_KEYS,
+}
+
+REPORT_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "type": {"type": "STRING", "enum": ["heading", "paragraph", "list"]},
+            "level": {"type": "INTEGER"},
+            "text": {"type": "STRING"},
+            "items": {"type": "ARRAY", "items": {"type": "STRING"}},
+        },
+        "required": ["type"],
+        "property_ordering": ["type", "level", "text", "items"],
+    },
+}
+
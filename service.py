@@ -0,0 +1,339 @@
+import asyncio
+import io
+import json
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from pipeline import create_client, generate_report_async, default_output_filename
+from map_reduce import ANALYSIS_MODES
+from renderers import BACKENDS, FORMATS, FORMAT_EXTENSIONS, CONTENT_TYPES, output_base
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 32
+# Finished jobs kept for download; the oldest are dropped first.
+JOB_RETENTION = 200
+MAX_BODY_BYTES = 64 * 1024
+
+# Report options a job may set per request; everything else (cache,
+# research store, template, tracer) is fixed when the service starts.
+JOB_OPTIONS = {
+    "fast": bool,
+    "stream": bool,
+    "fan_out": bool,
+    "max_repairs": int,
+    "research_budget": int,
+    "analysis_mode": str,
+    "backend": str,
+    "formats": list,
+}
+OPTION_CHOICES = {"analysis_mode": ANALYSIS_MODES, "backend": BACKENDS, "formats": FORMATS}
+
+STATUS_TEXT = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+Download = namedtuple("Download", "filename content_type body")
+
+
+class ReportJob:
+    def __init__(self, query, options):
+        self.id = uuid.uuid4().hex
+        self.query = query
+        self.options = options
+        self.status = "queued"
+        self.error = None
+        # Rendered documents by format, only those the job asked for.
+        self.outputs = {}
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def describe(self):
+        description = {
+            "id": self.id,
+            "query": self.query,
+            "options": self.options,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.status == "done":
+            fmt = "docx" if "docx" in self.outputs else next(iter(self.outputs))
+            description["download_url"] = f"/reports/{self.id}/{fmt}"
+            description["bytes"] = len(self.outputs[fmt])
+            description["downloads"] = {fmt: f"/reports/{self.id}/{fmt}" for fmt in self.outputs}
+        return description
+
+    def download(self, fmt):
+        if fmt not in self.outputs:
+            raise HttpError(404, f"Job was not rendered as {fmt}; request it with the 'formats' option")
+        filename = output_base(default_output_filename(self.query)) + FORMAT_EXTENSIONS[fmt]
+        return Download(filename, CONTENT_TYPES[fmt], self.outputs[fmt])
+
+
+def parse_job_request(body):
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        raise HttpError(400, "Request body must be JSON")
+    if not isinstance(payload, dict):
+        raise HttpError(400, "Request body must be a JSON object")
+
+    query = payload.get("query")
+    if not isinstance(query, str) or not query.strip():
+        raise HttpError(400, "A non-empty 'query' string is required")
+
+    options = {}
+    for name, value in (payload.get("options") or {}).items():
+        kind = JOB_OPTIONS.get(name)
+        if kind is None:
+            raise HttpError(400, f"Unknown option: {name}")
+        if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            raise HttpError(400, f"Option {name} must be of type {kind.__name__}")
+        if kind is list:
+            if not value:
+                raise HttpError(400, f"Option {name} must not be empty")
+            # Duplicates are dropped, the order kept.
+            value = list(dict.fromkeys(value))
+        if name in OPTION_CHOICES and any(item not in OPTION_CHOICES[name] for item in
+                                          (value if kind is list else [value])):
+            raise HttpError(400, f"Option {name} must be one of: {', '.join(OPTION_CHOICES[name])}")
+        options[name] = value
+    return query.strip(), options
+
+
+class ReportService:
+    # Runs report jobs on a bounded queue served by a fixed number of
+    # workers, all sharing one long-lived client. Every job is rendered into
+    # memory in the formats it asks for (the service's --formats by default)
+    # from one compiled report, and kept until downloaded or evicted.
+
+    def __init__(self, client, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, **report_options):
+        self.client = client
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.report_options = report_options
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for job in self.jobs.values():
+            if job.status in ("queued", "running"):
+                job.status = "cancelled"
+
+    def submit(self, query, options):
+        job = ReportJob(query, options)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HttpError(503, "Job queue is full; retry later", {"Retry-After": "5"})
+        self.jobs[job.id] = job
+        self._evict()
+        print(f"Queued job {job.id}: {query}")
+        return job
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status not in ("queued", "running")]
+        for job_id in finished[:max(0, len(finished) - JOB_RETENTION)]:
+            del self.jobs[job_id]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        job.status = "running"
+        job.started = time.time()
+        options = {**self.report_options, **job.options}
+        formats = tuple(options.get("formats") or ("docx",))
+        buffers = {fmt: io.BytesIO() for fmt in formats}
+        try:
+            output = await generate_report_async(
+                job.query, buffers, client=self.client, **{**options, "formats": formats}
+            )
+            if output is None:
+                job.status = "failed"
+                job.error = "Report JSON could not be parsed"
+            else:
+                job.outputs = {fmt: buffer.getvalue() for fmt, buffer in buffers.items()}
+                job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        job.finished = time.time()
+        print(f"[{job.status}] job {job.id} ({job.finished - job.started:.1f}s)")
+
+    def stats(self):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "jobs": counts,
+        }
+
+    def _job(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HttpError(404, f"No job with id {job_id}")
+        return job
+
+    def route(self, method, path, body):
+        parts = [part for part in path.split("?", 1)[0].split("/") if part]
+        if parts == ["health"]:
+            if method != "GET":
+                raise HttpError(405, "Use GET")
+            return 200, self.stats()
+        if parts == ["reports"]:
+            if method == "POST":
+                job = self.submit(*parse_job_request(body))
+                return 202, {"id": job.id, "status": job.status, "status_url": f"/reports/{job.id}"}
+            if method == "GET":
+                return 200, {"reports": [job.describe() for job in self.jobs.values()]}
+            raise HttpError(405, "Use GET or POST")
+        if len(parts) == 2 and parts[0] == "reports":
+            if method != "GET":
+                raise HttpError(405, "Use GET")
+            return 200, self._job(parts[1]).describe()
+        if len(parts) == 3 and parts[0] == "reports" and parts[2] in FORMATS:
+            if method != "GET":
+                raise HttpError(405, "Use GET")
+            job = self._job(parts[1])
+            if job.status != "done":
+                raise HttpError(409, f"Job is {job.status}")
+            return 200, job.download(parts[2])
+        raise HttpError(404, f"No route for {path}")
+
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"Request body is limited to {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, body
+
+
+def _response(status, body, content_type, headers=None):
+    lines = [
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        "Connection: close",
+    ]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+def _json_response(status, payload, headers=None):
+    return _response(status, json.dumps(payload, indent=2).encode("utf-8"), "application/json", headers)
+
+
+async def handle_connection(service, reader, writer):
+    method, path, status = "-", "-", 500
+    try:
+        request = await _read_request(reader)
+        if request is None:
+            writer.close()
+            return
+        method, path, body = request
+        status, result = service.route(method, path, body)
+        if isinstance(result, Download):
+            response = _response(status, result.body, result.content_type, {
+                "Content-Disposition": f'attachment; filename="{result.filename}"',
+            })
+        else:
+            response = _json_response(status, result)
+    except HttpError as e:
+        status = e.status
+        response = _json_response(status, {"error": str(e)}, e.headers)
+    except Exception as e:
+        status = 500
+        response = _json_response(status, {"error": f"{type(e).__name__}: {e}"})
+    try:
+        writer.write(response)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+    print(f"{method} {path} {status}")
+
+
+async def serve(client, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS,
+                queue_size=DEFAULT_QUEUE_SIZE, **report_options):
+    # Created here so that its connections belong to the service's event loop.
+    if client is None:
+        client = create_client()
+    service = ReportService(client, workers, queue_size, **report_options)
+    service.start()
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(service, reader, writer), host, port
+    )
+    print(f"Report service listening on http://{host}:{port} ({service.workers} workers, "
+          f"queue of {service.queue_size})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def run_service(client, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS,
+                queue_size=DEFAULT_QUEUE_SIZE, **report_options):
+    try:
+        asyncio.run(serve(client, host, port, workers, queue_size, **report_options))
+    except KeyboardInterrupt:
+        print("Report service stopped")
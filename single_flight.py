@@ -0,0 +1,94 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import Future
+from research_store import normalize_title
+
+# Handed to the waiters of a flight whose leader was cancelled.
+_ABANDONED = object()
+
+
+def flight_key(query, *config):
+    # Queries that differ only in case, whitespace or punctuation share a
+    # key; any difference in pipeline configuration does not.
+    return json.dumps([normalize_title(query), config], default=str)
+
+
+class SingleFlight:
+    # Lets concurrent callers with the same key share one in-flight call:
+    # the first caller runs it and the others wait for its result (or its
+    # error). Threads and asyncio tasks can wait on the same flight. A leader
+    # that is cancelled or interrupted passes the flight on to a waiter
+    # instead of failing them all.
+
+    def __init__(self):
+        self.stats = {"started": 0, "joined": 0}
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def _join(self, key):
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.stats["joined"] += 1
+                return future, False
+            future = self._flights[key] = Future()
+            self.stats["started"] += 1
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._flights[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _abandon(self, key, future):
+        # The leader was cancelled or interrupted, which says nothing about
+        # the call itself: its waiters start over and one of them leads.
+        with self._lock:
+            del self._flights[key]
+        future.set_result(_ABANDONED)
+
+    def do(self, key, call):
+        # Returns (result, joined); joined is True for callers that shared
+        # another caller's flight.
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                result = future.result()
+                if result is _ABANDONED:
+                    continue
+                return result, True
+            try:
+                result = call()
+            except Exception as e:
+                self._finish(key, future, error=e)
+                raise
+            except BaseException:
+                self._abandon(key, future)
+                raise
+            self._finish(key, future, result)
+            return result, False
+
+    async def do_async(self, key, call):
+        while True:
+            future, leader = self._join(key)
+            if not leader:
+                # Shielded, so a waiter that is cancelled does not cancel the
+                # flight the others are waiting on.
+                result = await asyncio.shield(asyncio.wrap_future(future))
+                if result is _ABANDONED:
+                    continue
+                return result, True
+            try:
+                result = await call()
+            except Exception as e:
+                self._finish(key, future, error=e)
+                raise
+            except BaseException:
+                self._abandon(key, future)
+                raise
+            self._finish(key, future, result)
+            return result, False
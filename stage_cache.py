@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_CACHE_DIR = ".report_cache"
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_MB = 256
+# The directory is scanned for eviction once the bytes written since the
+# last scan could exceed the limit, and at least every this many writes to
+# catch entries written by other processes.
+EVICT_EVERY = 200
+# Eviction frees space down to this share of the limit, so a full cache is
+# not scanned again on the very next write.
+EVICT_TO = 0.9
+
+
+class StageCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl_hours=DEFAULT_TTL_HOURS, max_mb=DEFAULT_MAX_MB):
+        self.directory = directory
+        self.ttl_seconds = ttl_hours * 3600 if ttl_hours else None
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        os.makedirs(directory, exist_ok=True)
+        # Size of the cache as of the last scan plus what was written since;
+        # None until the first scan.
+        self._size = None
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def key(self, model_id, stage, contents, config=None):
+        payload = json.dumps(
+            [model_id, stage, contents, config],
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self.ttl_seconds is not None and time.time() - entry.get("created", 0) > self.ttl_seconds:
+            self.discard(key)
+            return None
+
+        # The file mtime doubles as the LRU clock.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("text")
+
+    def put(self, key, text, stage=None):
+        path = self._path(key)
+        entry = {"stage": stage, "created": time.time(), "text": text}
+        # A unique temporary file per write: threads and processes may store
+        # the same key at once.
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f"{key}.", suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        if self._due(size):
+            self.evict()
+
+    def _due(self, size):
+        if self.max_bytes is None:
+            return False
+        with self._lock:
+            self._puts += 1
+            if self._size is not None:
+                self._size += size
+            return self._size is None or self._size > self.max_bytes or self._puts >= EVICT_EVERY
+
+    def discard(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        if self.max_bytes is None:
+            return
+
+        entries = []
+        total = 0
+        for item in os.scandir(self.directory):
+            if not item.name.endswith('.json'):
+                continue
+            try:
+                stat = item.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, item.path))
+            total += stat.st_size
+
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes * EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+        with self._lock:
+            self._size = total
+            self._puts = 0
+
+    def clear(self):
+        for item in os.scandir(self.directory):
+            if item.name.endswith('.json'):
+                try:
+                    os.remove(item.path)
+                except OSError:
+                    pass
+        with self._lock:
+            self._size = 0
@@ -0,0 +1,120 @@
+import copy
+import io
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from docx import Document
+from docx.shared import Pt, RGBColor
+
+CONTENT_TYPES_PART = "[Content_Types].xml"
+TEMPLATE_CONTENT_TYPE = b"application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml"
+DOCUMENT_CONTENT_TYPE = b"application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"
+
+# Parsed templates, least recently used first. A long-running service may be
+# asked for many templates; only the most recent ones stay parsed.
+MAX_TEMPLATES = 8
+_templates = OrderedDict()
+_templates_lock = threading.Lock()
+
+
+def heading_format(level):
+    if level == 1:
+        return RGBColor(0, 0, 128), Pt(16)
+    return RGBColor(0, 0, 0), Pt(14 - (level - 2))
+
+
+def configure_document(doc):
+    style = doc.styles['Normal']
+    font = style.font
+    font.name = 'Calibri'
+    font.size = Pt(11)
+
+    for level in range(0, 10):
+        name = "Title" if level == 0 else f"Heading {level}"
+        try:
+            heading_style = doc.styles[name]
+        except KeyError:
+            continue
+        color, size = heading_format(level)
+        heading_style.font.color.rgb = color
+        heading_style.font.size = size
+
+
+def _open_template(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    # python-docx only opens documents, so a .dotx is re-packaged with the
+    # document content type before parsing.
+    with zipfile.ZipFile(io.BytesIO(data)) as package:
+        content_types = package.read(CONTENT_TYPES_PART)
+        if TEMPLATE_CONTENT_TYPE not in content_types:
+            return io.BytesIO(data)
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as converted:
+            for info in package.infolist():
+                part = package.read(info)
+                if info.filename == CONTENT_TYPES_PART:
+                    part = part.replace(TEMPLATE_CONTENT_TYPE, DOCUMENT_CONTENT_TYPE)
+                converted.writestr(info.filename, part)
+    output.seek(0)
+    return output
+
+
+class ReportTemplate:
+    # A template parsed and styled once; every report gets a deep copy of the
+    # parsed document instead of unzipping and parsing the template again.
+
+    def __init__(self, path=None):
+        self.path = path
+        if path is None:
+            self.document = Document()
+            configure_document(self.document)
+        else:
+            # Corporate templates keep their own styles.
+            self.document = Document(_open_template(path))
+        self.style_ids = {style.name: style.style_id for style in self.document.styles}
+        self._package_bytes = None
+        self._lock = threading.Lock()
+
+    def new_document(self):
+        with self._lock:
+            return copy.deepcopy(self.document)
+
+    def style_id(self, name):
+        return self.style_ids.get(name)
+
+    def heading_style_id(self, level):
+        if not 0 <= level <= 9:
+            raise ValueError("level must be in range 0-9, got %d" % level)
+        return self.style_id("Title" if level == 0 else "Heading %d" % level)
+
+    def package_bytes(self):
+        with self._lock:
+            if self._package_bytes is None:
+                buffer = io.BytesIO()
+                self.document.save(buffer)
+                self._package_bytes = buffer.getvalue()
+            return self._package_bytes
+
+
+def load_template(path=None):
+    key = None
+    if path is not None:
+        path = os.path.abspath(path)
+        key = (path, os.path.getmtime(path))
+
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is not None:
+            _templates.move_to_end(key)
+            return template
+        template = ReportTemplate(path)
+        # An edited template replaces its earlier version.
+        for stale in [cached for cached in _templates if cached is not None and cached[0] == path]:
+            del _templates[stale]
+        _templates[key] = template
+        while len(_templates) > MAX_TEMPLATES:
+            _templates.popitem(last=False)
+        return template
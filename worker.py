@@ -0,0 +1,191 @@
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+
+DEFAULT_SOCKET_PATH = os.path.join(tempfile.gettempdir(), f"report-worker-{getattr(os, 'getuid', lambda: 0)()}.sock")
+DEFAULT_PROCESSES = 2
+# Ends a job's output; the exit code follows it. Report output is text and
+# never contains a NUL byte.
+_EXIT_MARKER = b"\0"
+
+
+def preload(template_path=None):
+    # Everything a report needs that is slow to import or load: the Gemini
+    # SDK, python-docx and lxml, and the parsed templates. Forked job
+    # processes inherit all of it.
+    from google import genai
+    from google.genai import types, errors
+    import httpx
+    import pipeline
+    import batch
+    import cassette
+    import docx_converter
+    import ooxml_writer
+    from templates import load_template
+    load_template()
+    if template_path:
+        load_template(template_path)
+
+
+def _listening(socket_path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def _read_request(conn):
+    # None when the client hangs up without a job, as the check for an
+    # already running worker does.
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            return None
+        data += chunk
+    return json.loads(data)
+
+
+def _run_job(handle, argv):
+    try:
+        handle(argv, in_worker=True)
+        return 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+def _serve_one(listener, handle):
+    # Runs in a forked process: takes one job, runs it as if the command
+    # line had been run in the client's directory and environment with its
+    # output going to the client, and exits. Every job starts from the
+    # preloaded state, never from another job's leftovers.
+    code = 1
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        conn, _ = listener.accept()
+        listener.close()
+        request = _read_request(conn)
+        if request is None:
+            code = 0
+            return
+        print(f"[{os.getpid()}] main.py {' '.join(request['argv'])}", flush=True)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(conn.fileno(), 1)
+        os.dup2(conn.fileno(), 2)
+        sys.stdout.reconfigure(line_buffering=True)
+        code = _run_job(handle, request["argv"])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        conn.sendall(_EXIT_MARKER + str(code).encode())
+        conn.close()
+    except KeyboardInterrupt:
+        pass
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(code)
+
+
+def run_worker(handle, socket_path=DEFAULT_SOCKET_PATH, processes=DEFAULT_PROCESSES, template_path=None):
+    # handle(argv, in_worker=True) runs one command line. A few processes
+    # are forked ahead of time and wait for a job each; a process exits when
+    # its job is done and a fresh one is forked in its place.
+    if not hasattr(os, "fork") or not hasattr(socket, "AF_UNIX"):
+        print("Error: the warm worker needs a Unix system (fork and Unix sockets).")
+        return 1
+    if os.path.exists(socket_path):
+        if _listening(socket_path):
+            print(f"Error: a worker is already listening on {socket_path}")
+            return 1
+        os.unlink(socket_path)
+
+    start = time.perf_counter()
+    preload(template_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Only this user may hand jobs, and with them their environment, over.
+    umask = os.umask(0o177)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(umask)
+    listener.listen(max(8, processes * 4))
+    print(f"Worker listening on {socket_path} ({processes} warm processes, "
+          f"loaded in {time.perf_counter() - start:.2f}s)", flush=True)
+
+    # Stopping with SIGTERM cleans up like Ctrl-C does.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    children = set()
+    try:
+        while True:
+            while len(children) < max(1, processes):
+                pid = os.fork()
+                if pid == 0:
+                    _serve_one(listener, handle)
+                children.add(pid)
+            pid, _ = os.wait()
+            children.discard(pid)
+    except (KeyboardInterrupt, SystemExit):
+        print("Worker stopped")
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        listener.close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+    return 0
+
+
+def submit(argv, socket_path=DEFAULT_SOCKET_PATH):
+    # Hands a command line to the worker and copies its output here as it
+    # arrives. Returns the job's exit code; raises OSError when no worker is
+    # listening.
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+        request = {"argv": list(argv), "cwd": os.getcwd(), "env": dict(os.environ)}
+        conn.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        out = sys.stdout.buffer
+        trailer = None
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            if trailer is not None:
+                trailer += data
+                continue
+            data, marker, rest = data.partition(_EXIT_MARKER)
+            out.write(data)
+            out.flush()
+            if marker:
+                trailer = rest
+    finally:
+        conn.close()
+    try:
+        return int(trailer)
+    except (TypeError, ValueError):
+        print("Error: the worker process ended without finishing the job")
+        return 1